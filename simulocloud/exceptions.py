@@ -27,6 +27,10 @@ class EmptyPointCloud(PointCloudException, ValueError):
     """An empty PointCloud is being created or summarised."""
     pass
 
+class BadHeaderWarning(PointCloudException, UserWarning):
+    """A .las file's header misdescribes the points it contains."""
+    pass
+
 class DimsError(VisualiseException):
     """Base exception for errors relating to the dims argument."""
     pass
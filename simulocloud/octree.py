@@ -0,0 +1,202 @@
+"""
+octree
+
+Multi-resolution (level of detail) octree of pointclouds, stored on disk.
+"""
+import numpy as np
+import os
+import simulocloud.pointcloud
+import simulocloud.tiles
+import simulocloud.exceptions
+
+# Fields of the nodes table, ordered as the nodes' points are stored
+_NODE_DTYPE = [('level', np.int8),
+               ('ix', np.int64), ('iy', np.int64), ('iz', np.int64),
+               ('start', np.int64), ('count', np.int64)]
+
+# Maximum octree depth (limited by 64 bit 3D Morton keys)
+_MAX_LEVEL = 21
+
+class Octree(object):
+    """Level of detail octree whose nodes each hold a subsample of points.
+
+    The root node (level 0) covers the whole pointcloud with a random sample
+    of up to `capacity` points. Each node's eight children (one level deeper)
+    cover its octants, and hold samples of the points not already taken by
+    their ancestors, and so on until all points are held. Reading nodes down
+    to a given level therefore gives an evenly thinned preview of the data,
+    which is refined by reading further levels.
+
+    The octree is stored in a directory containing:
+    - 'points.npy': (3*n) coordinates, ordered by node
+    - 'nodes.npy': table (`_NODE_DTYPE`) of the level, position and slice of
+      points of each node
+    - 'cube.npy': (minx, miny, minz, size) of the cube covered by the root
+
+    Points are memory-mapped when queried, so that only the nodes required
+    are read.
+    """
+    def __init__(self, path):
+        """Open octree previously built (see `Octree.build`) at `path`."""
+        self.path = path
+        self.nodes = np.load(os.path.join(path, 'nodes.npy'))
+        self.cube = np.load(os.path.join(path, 'cube.npy'))
+        self._points = np.load(os.path.join(path, 'points.npy'), mmap_mode='r')
+
+        # Morton key of each node's cell within its level (nodes are sorted
+        # by these within each level), and where each level's nodes start
+        icells = np.stack([self.nodes[field] for field in ('ix', 'iy', 'iz')])
+        self._keys = simulocloud.pointcloud._morton_keys(icells.astype(np.uint64), _MAX_LEVEL)
+        self._level_starts = np.searchsorted(self.nodes['level'],
+                                             np.arange(self.depth + 2))
+
+    def __len__(self):
+        """Number of points in octree."""
+        return self._points.shape[1]
+
+    @classmethod
+    def build(cls, pcs, path, capacity=10000, seed=None):
+        """Build octree of pointcloud(s) and store it at `path`.
+
+        Arguments
+        ---------
+        pcs: `PointCloud` or `simulocloud.tiles.TilesGrid`
+            points to build octree of (tiles of a grid are merged)
+        path: str
+            directory in which to store octree (created if needed)
+        capacity: int (default: 10000)
+            maximum number of points held by each node (bar those at the
+            deepest level, `_MAX_LEVEL`)
+        seed: int, `numpy.random.RandomState` or None (optional)
+            seed or generator of the random sampling of points to nodes
+            (see `PointCloud.downsample`)
+
+        Returns
+        -------
+        `Octree`
+
+        Raises
+        ------
+        EmptyPointCloud
+            if there are no points to build the octree of
+
+        """
+        if isinstance(pcs, simulocloud.tiles.TilesGrid):
+            pcs = simulocloud.pointcloud.merge(list(pcs.tiles.flat))
+        arr = pcs.arr
+        if not arr.shape[1]:
+            raise simulocloud.exceptions.EmptyPointCloud(
+                'Cannot build an octree of an empty pointcloud')
+
+        # Enclose points in a cube
+        origin = arr.min(axis=1)
+        size = (arr.max(axis=1) - origin).max() * (1 + 1e-9) or 1.
+        icells = ((arr - origin[:, None]) * (2**_MAX_LEVEL / size)).astype(np.uint64)
+        keys = simulocloud.pointcloud._morton_keys(icells, _MAX_LEVEL)
+        rand = simulocloud.pointcloud._random_state(seed).random_sample(arr.shape[1])
+
+        # Assign random points to each node, level by level
+        levels = np.full(arr.shape[1], _MAX_LEVEL, dtype=np.int8)
+        remaining = np.arange(arr.shape[1])
+        for level in xrange(_MAX_LEVEL):
+            nodes = keys[remaining] >> np.uint64(3*(_MAX_LEVEL - level))
+            order = np.lexsort((rand[remaining], nodes))
+            nodes = nodes[order]
+            starts = simulocloud.pointcloud._group_starts(nodes)
+            ranks = np.arange(len(nodes)) - np.repeat(starts, np.diff(np.append(starts, len(nodes))))
+            taken = remaining[order[ranks < capacity]]
+            levels[taken] = level
+            remaining = remaining[order[ranks >= capacity]]
+            if not len(remaining):
+                break
+
+        # Order points by level, then node (Morton order within level)
+        node_keys = keys >> (np.uint64(3)*(_MAX_LEVEL - levels).astype(np.uint64))
+        order = np.lexsort((node_keys, levels))
+        levels, node_keys = levels[order], node_keys[order]
+        starts = simulocloud.pointcloud._group_starts(levels, node_keys)
+
+        nodes = np.empty(len(starts), dtype=_NODE_DTYPE)
+        nodes['level'] = levels[starts]
+        shift = (_MAX_LEVEL - nodes['level']).astype(np.uint64)
+        for axis, field in enumerate(('ix', 'iy', 'iz')):
+            nodes[field] = icells[axis][order[starts]] >> shift
+        nodes['start'] = starts
+        nodes['count'] = np.diff(np.append(starts, len(order)))
+
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        np.save(os.path.join(path, 'points.npy'), arr[:, order])
+        np.save(os.path.join(path, 'nodes.npy'), nodes)
+        np.save(os.path.join(path, 'cube.npy'), np.append(origin, size))
+        return cls(path)
+
+    @property
+    def depth(self):
+        """Deepest level of any node."""
+        return int(self.nodes['level'].max()) if len(self.nodes) else 0
+
+    def node_bounds(self, nodes=None):
+        """Return (nnodes*6) array of the bounds of each node's cube."""
+        nodes = self.nodes if nodes is None else nodes
+        origin, size = self.cube[:3], self.cube[3]
+        sizes = size / 2.**nodes['level']
+        mins = np.stack([nodes[field] for field in ('ix', 'iy', 'iz')], axis=1) * sizes[:, None] + origin
+        return np.concatenate([mins, mins + sizes[:, None]], axis=1)
+
+    def query(self, bounds=None, level=None, pctype=simulocloud.pointcloud.PointCloud):
+        """Return the points within `bounds` held by nodes down to `level`.
+
+        Arguments
+        ---------
+        bounds: `Bounds` or similiar (optional)
+            (minx, miny, minz, maxx, maxy, maxz) bounds to crop points to
+            `None` values (default) are unbounded
+        level: int (optional)
+            deepest level of nodes to read (default: all levels)
+            the number of points returned is at most `capacity` times the
+            number of nodes intersecting `bounds` down to `level`
+        pctype: subclass of `PointCloud` (optional)
+            type of pointcloud to return
+
+        Returns
+        -------
+        instance of `pctype`
+
+        Notes
+        -----
+        Nodes are found by descending from the root, only visiting the
+        children of nodes which intersect `bounds`, and only the slices of
+        points of intersecting nodes are read from disk.
+
+        """
+        bounds = simulocloud.pointcloud.InfBounds(*(bounds or (None,)*6))
+        depth = self.depth if level is None else min(level, self.depth)
+        octants = np.arange(8, dtype=np.uint64)
+        selected = []
+        candidates = np.arange(min(len(self.nodes), 1)) # the root
+        for lvl in xrange(depth + 1):
+            if lvl:
+                # Look up which of the selected nodes' children exist
+                start, stop = self._level_starts[lvl:lvl+2]
+                keys = ((self._keys[candidates, None] << np.uint64(3)) | octants).ravel()
+                level_keys = self._keys[start:stop]
+                pos = np.searchsorted(level_keys, keys)
+                found = pos < len(level_keys)
+                found[found] = level_keys[pos[found]] == keys[found]
+                candidates = start + pos[found]
+            nbounds = self.node_bounds(self.nodes[candidates])
+            candidates = candidates[np.all((nbounds[:, :3] <= bounds[3:]) &
+                                           (nbounds[:, 3:] >= bounds[:3]), axis=1)]
+            if not len(candidates):
+                break
+            selected.append(candidates)
+
+        nodes = self.nodes[np.concatenate(selected)] if selected else self.nodes[:0]
+        pieces = [self._points[:, start:start+count] for start, count in
+                  zip(nodes['start'], nodes['count'])]
+        if not pieces:
+            return pctype(None)
+        arr = np.concatenate(pieces, axis=1)
+        inside = ~simulocloud.pointcloud.points_out_of_bounds(arr, bounds)
+        return pctype._from_arr(arr[:, inside] if not inside.all() else arr)
@@ -0,0 +1,217 @@
+"""
+pipeline
+
+Lazily record operations on a pointcloud and run them in a single pass.
+"""
+import numpy as np
+import simulocloud.pointcloud
+import simulocloud.exceptions
+
+class Pipeline(object):
+    """A lazily evaluated sequence of operations on a source of points.
+    
+    Operations (`crop`, `downsample`) are recorded rather than performed, and
+    are only run when `compute` or `to_las` is called. Any leading `crop`s are
+    fused into a single mask which is applied to the source chunk by chunk as
+    it is read, so that neither the full source nor any intermediate
+    pointcloud is ever materialised. Subsequent operations are applied to the
+    (much smaller) streamed result.
+    
+    Example
+    -------
+    >>> pipe = Pipeline.from_las(*fpaths, bounds=bounds)
+    >>> pc = pipe.crop(plot_bounds).downsample(10000).compute()
+    
+    which gives the same points as
+    
+    >>> pc = PointCloud.from_las(*fpaths, bounds=bounds).crop(plot_bounds).downsample(10000)
+    
+    Unlike the eager equivalent, only point coordinates are streamed: the
+    pointcloud computed has no per-point attributes (see
+    `simulocloud.pointcloud.Attributes`), and nor do .las files written.
+    
+    """
+    def __init__(self, chunks, ops=()):
+        """Directly initialise `Pipeline` from a source of chunks.
+        
+        Arguments
+        ---------
+        chunks: callable
+            returns an iterable of (3*n) point coordinate arrays when called
+        ops: sequence of tuple (optional)
+            (method, args) operations to apply to the points
+        
+        Instantiation by constructor classmethods is preferred.
+        
+        """
+        self._chunks = chunks
+        self._ops = tuple(ops)
+
+    def __repr__(self):
+        return 'Pipeline({})'.format(' -> '.join(
+                   ['source'] + [method for method, args in self._ops]))
+
+    """ Constructor methods """
+
+    @classmethod
+    def from_las(cls, *fpaths, **kwargs):
+        """Initialise `Pipeline` reading from one or more .las files.
+        
+        Arguments
+        ---------
+        *fpaths: str
+            filepaths of .las files containing 3D point coordinates
+        bounds: `Bounds` or similiar (optional)
+            if supplied, only points within `bounds` are kept (and files not
+            intersecting `bounds` are never read)
+        where: dict (optional)
+            {attribute: condition} predicates which points must satisfy to be
+            decoded (see `simulocloud.pointcloud.las_where`)
+        chunksize: int (optional)
+            maximum number of points to decode from a file at a time
+        
+        """
+        bounds = kwargs.pop('bounds', None)
+        where = kwargs.pop('where', None)
+        chunksize = kwargs.pop('chunksize', simulocloud.pointcloud._CHUNKSIZE)
+        if kwargs:
+            raise TypeError('Invalid keyword arguments {}'.format(kwargs.values()))
+        
+        if bounds is not None:
+            fpaths = simulocloud.pointcloud.filter_fpaths(fpaths, bounds)
+        
+        def chunks():
+            for fpath in fpaths:
+                for arr in simulocloud.pointcloud._iter_las_xyz(fpath, chunksize, where):
+                    yield arr
+        
+        pipe = cls(chunks)
+        return pipe if bounds is None else pipe.crop(bounds)
+
+    @classmethod
+    def from_pointcloud(cls, pc, chunksize=simulocloud.pointcloud._CHUNKSIZE):
+        """Initialise `Pipeline` reading from an in-memory pointcloud."""
+        def chunks():
+            for i in xrange(0, len(pc), chunksize):
+                yield pc.arr[:, i:i+chunksize]
+        return cls(chunks)
+
+    """ Recorded operations """
+
+    def crop(self, bounds):
+        """Record cropping to (lower-inclusive, upper-exclusive) `bounds`.
+        
+        See documentation for `simulocloud.pointcloud.PointCloud.crop`.
+        """
+        return self._then('crop', simulocloud.pointcloud.Bounds(*bounds))
+
+    def downsample(self, n, seed=None):
+        """Record random sampling of `n` points.
+        
+        See documentation for `simulocloud.pointcloud.PointCloud.downsample`.
+        """
+        return self._then('downsample', n, seed)
+
+    def _then(self, method, *args):
+        """Return a new `Pipeline` with an additional operation."""
+        return type(self)(self._chunks, self._ops + ((method, args),))
+
+    """ Evaluation """
+
+    def compute(self, pctype=simulocloud.pointcloud.PointCloud, allow_empty=False):
+        """Run the pipeline, returning the resulting pointcloud.
+        
+        Arguments
+        ---------
+        pctype: subclass of `PointCloud` (optional)
+            type of pointcloud to return
+        allow_empty: bool (default: False)
+            whether to allow an empty pointcloud to result, or raise
+            `simulocloud.exceptions.EmptyPointCloud`
+        
+        Returns
+        -------
+        instance of `pctype`
+        
+        """
+        bounds, ops = self._fuse_crops()
+        kept = list(self._stream(bounds))
+        if kept:
+            pc = pctype._from_arr(np.concatenate(kept, axis=1))
+        elif bounds is None or allow_empty:
+            pc = pctype(None)
+        else:
+            raise simulocloud.exceptions.EmptyPointCloud(
+                      "No points in crop bounds:\n{}".format(bounds))
+        
+        # Apply the remaining operations eagerly
+        for method, args in ops:
+            if method == 'crop':
+                pc = pc.crop(*args, allow_empty=allow_empty)
+            else:
+                pc = getattr(pc, method)(*args)
+        return pc
+
+    def to_las(self, fpath):
+        """Run the pipeline, writing the result to a .las file.
+        
+        Raises
+        ------
+        EmptyPointCloud
+            if no points result (in which case no file is written)
+        
+        Notes
+        -----
+        Where the pipeline consists only of crops, each chunk of points is
+        written to the file as soon as it is read and masked, so the result
+        is never held in memory. The header's offset is taken from the first
+        chunk written, so points must lie within about 500km of it (the range
+        of the .las integer coordinates at the default scale). Operations
+        which need every point (i.e. `downsample`) are computed before the
+        result is written.
+        
+        """
+        bounds, ops = self._fuse_crops()
+        if ops:
+            self.compute().to_las(fpath)
+            return
+        
+        writer = None
+        try:
+            for arr in self._stream(bounds):
+                if writer is None:
+                    writer = simulocloud.pointcloud._LasWriter(fpath, arr.min(axis=1))
+                writer.write(arr)
+        finally:
+            if writer is not None:
+                writer.close()
+        if writer is None:
+            raise simulocloud.exceptions.EmptyPointCloud(
+                      "No points to write to {}".format(fpath))
+
+    def _fuse_crops(self):
+        """Return bounds fusing the leading crops, and the remaining operations."""
+        ops = list(self._ops)
+        bounds = None
+        while ops and ops[0][0] == 'crop':
+            bounds = _intersect_bounds(bounds, ops.pop(0)[1][0])
+        return bounds, ops
+
+    def _stream(self, bounds=None):
+        """Yield the non-empty chunks of the source, masked to `bounds`."""
+        for arr in self._chunks():
+            if bounds is not None:
+                arr = arr[:, ~simulocloud.pointcloud.points_out_of_bounds(arr, bounds)]
+            if arr.shape[1]:
+                yield arr
+
+def _intersect_bounds(A, B):
+    """Return the bounds of the intersection of bounds `A` and `B`.
+    
+    `None` (i.e. unbounded) values are coerced to infs; `A` may be None.
+    """
+    B = simulocloud.pointcloud.InfBounds(*B)
+    if A is None:
+        return B
+    return simulocloud.pointcloud.Bounds(*(np.concatenate([
+               np.maximum(A[:3], B[:3]), np.minimum(A[3:], B[3:])])))
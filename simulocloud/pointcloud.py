@@ -9,6 +9,13 @@ import string
 import laspy.file
 import laspy.header
 import collections
+import itertools
+import multiprocessing.pool
+import os
+import shutil
+import struct
+import tempfile
+import warnings
 import simulocloud.exceptions
 
 _HEADER_DEFAULT = {'data_format_id': 3,
@@ -28,12 +35,38 @@ _VLR_DEFAULT = {'user_id': 'LASF_Projection\x00',
 
 _DTYPE = np.float64
 
+# Per-point attributes readable from .las files, and the raw record field
+# (of laspy point formats) from which each is decoded
+_LAS_ATTRIBUTES = {'intensity': 'intensity',
+                   'return_num': 'flag_byte',
+                   'num_returns': 'flag_byte',
+                   'classification': 'raw_classification',
+                   'scan_angle_rank': 'scan_angle_rank',
+                   'user_data': 'user_data',
+                   'pt_src_id': 'pt_src_id',
+                   'gps_time': 'gps_time'}
+
+# Number of points decoded at a time when streaming .las files
+_CHUNKSIZE = 2**20
+
+# Maximum number of .las files held open at once when reading
+_MAX_OPEN_FILES = 256
+
+# Maximum number of Morton key ranges to search when cropping sorted points
+_MAX_KEY_RANGES = 512
+
 class PointCloud(object):
     """ Contains point cloud data """
     
     dtype = _DTYPE
+    
+    # Memory-map mode of arrays opened by `from_shared` (copy-on-write)
+    _shared_mode = 'c'
+    
+    # Whether `bounds` are cached (in `_bounds`), i.e. the array is immutable
+    _caches_bounds = False
 
-    def __init__(self, xyz, header=None):
+    def __init__(self, xyz, header=None, attrs=None):
         """Create PointCloud with 3D point coordinates stored in a (3*n) array.
         
         Arguments
@@ -42,6 +75,8 @@ class PointCloud(object):
             equal sized sequences specifying 3D point coordinates (xs, ys, zs)
         header: laspy.header.Header instance
             base header to use for output
+        attrs: `Attributes` or dict (optional)
+            per-point attributes, e.g. {'intensity': intensities}
         
         Example
         -------
@@ -68,6 +103,9 @@ class PointCloud(object):
         # Store points as 3*n array
         x, y, z = xyz # ensure only 3 coordinates
         self._arr = np.stack([x, y, z])
+        self._attrs = _coerce_attributes(attrs, len(self))
+        self._morton = None
+        self.__dict__.pop('_bounds', None) # (re)initialisation
 
         if header is not None:
             self._header = header
@@ -78,7 +116,8 @@ class PointCloud(object):
 
     def __add__(self, other):
         """Concatenate two PointClouds."""
-        return type(self)(np.concatenate([self._arr, other.arr], axis=1))
+        return type(self)(np.concatenate([self._arr, other.arr], axis=1),
+                          attrs=Attributes.concatenate([self._attrs, other.attrs]))
 
     """ Constructor methods """
  
@@ -94,6 +133,17 @@ class PointCloud(object):
             if supplied, pointcloud will contain only points within `bounds
         allow_empty: bool
             if `bounds` specified, allows resultant pointcloud to be empty
+        where: dict (optional)
+            {attribute: condition} predicates which points must all satisfy
+            to be read (see `las_where`), e.g. {'classification': {2}}
+        sort_spatial: bool (default: False)
+            whether to sort points into Morton order (see `sort_spatial`)
+        trust_header: bool (default: False)
+            whether to rely on the files' headers without checking them
+            against the points: the cached `bounds` of immutable
+            pointclouds (i.e. tiles) are seeded from the headers, so that
+            they need not be calculated from the points, and files whose
+            headers lie inside `bounds` are read without masking
         
         Notes
         -----
@@ -102,31 +152,72 @@ class PointCloud(object):
         will be skipped, making it possible to supply a large number of file
         paths for which the spatial locations of the data are not known.
         
+        `where` predicates are evaluated on the raw point records, before
+        coordinates are decoded, so that rejected points are never decoded.
+        
+        Each file is opened once, from which its header bounds, point count
+        and coordinates are all read. Points outside `bounds` are rejected by
+        comparing the raw records against `bounds` converted to the file's
+        integer coordinates; files whose header bounds lie inside `bounds`
+        need no such mask.
+        
+        The output array is sized from the files' point counts before any
+        are decoded. Unless `trust_header`, a header relied upon to skip a
+        file's mask is verified as the file is decoded, by checking that each
+        chunk of raw records lies within the header's bounds, so there is no
+        separate pass over the points. Should any point lie outside them, a
+        `simulocloud.exceptions.BadHeaderWarning` (whose `fpath` is that of
+        the file) is issued, and the file masked and decoded again. Headers
+        whose bounds are loose, but contain every point, are not bad. Bounds
+        are not seeded if any points are masked by `where` or `bounds`, nor
+        on mutable pointclouds (whose bounds are never cached).
+        
+        """
+        return cls._from_las(fpaths, **kwargs)[0]
+
+    @classmethod
+    def _from_las(cls, fpaths, **kwargs):
+        """Initialise pointcloud from .las files (see `from_las`).
+        
+        Returns
+        -------
+        pc: instance of `cls`
+        read: list of (fpath, n, mask)
+            files read (see `_read_las`), omitting those outside `bounds`
         """
         bounds = kwargs.pop('bounds', None)
         allow_empty = kwargs.pop('allow_empty', None)
+        where = kwargs.pop('where', None)
+        sort_spatial = kwargs.pop('sort_spatial', False)
+        trust_header = kwargs.pop('trust_header', False)
         if bounds is None and allow_empty is not None:
             raise TypeError('Argument `allow_empty` is meaningless without `bounds`')
         if kwargs:
            raise TypeError('Invalid keyword arguments {}'.format(kwargs.values()))
         
-        # Read only relevant files
+        # Read relevant points of relevant files
         if bounds is not None:
-            fpaths = filter_fpaths(fpaths, bounds)
+            bounds = InfBounds(*bounds)
+        arr, read, points_bounds = _read_las(fpaths, bounds, where, trust_header)
+        pc = cls(None) if arr is None else cls._from_arr(arr)
+        if points_bounds is not None and cls._caches_bounds:
+            pc._bounds = points_bounds
         
-        # Build pointcloud
-        if len(fpaths) > 1:
-            pc = cls(_combine_las(*fpaths))
-        else:
-            try:
-                 pc = cls(_get_las_xyz(*fpaths))
-            except(TypeError):
-                 pc = cls(None)
+        # Attach attributes of points read
+        if any(mask is not None for _, _, mask in read):
+            mask = np.concatenate([np.ones(n, dtype=bool) if mask is None else mask
+                                   for _, n, mask in read])
+            pc._attrs = Attributes.from_las([fpath for fpath, _, _ in read], len(mask)).take(mask)
+        elif read:
+            pc._attrs = Attributes.from_las([fpath for fpath, _, _ in read], len(pc))
         
-        if bounds is not None:
-            pc = pc.crop(bounds, allow_empty=allow_empty)
+        if bounds is not None and not len(pc) and not allow_empty:
+            raise simulocloud.exceptions.EmptyPointCloud(
+                      "No points in crop bounds:\n{}".format(Bounds(*bounds)))
+        if sort_spatial:
+            pc = pc.sort_spatial()
         
-        return pc
+        return pc, read
 
     @classmethod
     def from_laspy_File(cls, f):
@@ -161,6 +252,45 @@ class PointCloud(object):
         """Initialise an empty PointCloud."""
         return cls(None)
 
+    @classmethod
+    def _from_arr(cls, arr, header=None, attrs=None):
+        """Initialise PointCloud around an existing (3*n) array without copying.
+        
+        The new pointcloud takes ownership of `arr`, which must already be of
+        type `dtype`.
+        """
+        pc = cls.__new__(cls)
+        pc._arr = arr
+        pc._attrs = _coerce_attributes(attrs, arr.shape[1])
+        pc._morton = None
+        if header is not None:
+            pc._header = header
+        return pc
+
+    @classmethod
+    def from_shared(cls, shared):
+        """Initialise PointCloud from the memory-mapped file of `to_shared`.
+        
+        Arguments
+        ---------
+        shared: `SharedPointCloud`
+            handle returned by `to_shared` (possibly in another process)
+        
+        Notes
+        -----
+        Neither points nor in-memory attributes are copied: arrays map the
+        file copy-on-write, so that modifications remain private to the new
+        pointcloud (subclasses may map their arrays read-only).
+        """
+        arrays = [np.memmap(shared.fpath, dtype=dtype, mode=cls._shared_mode,
+                            offset=offset, shape=shape) if np.prod(shape)
+                  else np.empty(shape, dtype=dtype)
+                  for dtype, shape, offset in shared.layout]
+        segments = [_AttributeSegment(fpaths, None if idx is None else np.asarray(arrays[idx]), n,
+                                      {name: np.asarray(arrays[i]) for name, i in columns})
+                    for fpaths, idx, n, columns in shared.segments]
+        return cls._from_arr(np.asarray(arrays[0]), attrs=Attributes(segments))
+
     """ Instance methods """
     @property
     def arr(self):
@@ -170,6 +300,7 @@ class PointCloud(object):
     @arr.setter
     def arr(self, value):
         self._arr = value
+        self._morton = None
     
     @property
     def x(self):
@@ -186,6 +317,11 @@ class PointCloud(object):
         """The z component of point coordinates."""
         return self._arr[2]
 
+    @property
+    def attrs(self):
+        """Per-point attributes (see `Attributes`), e.g. `pc.attrs['intensity']`."""
+        return self._attrs
+
     @property
     def points(self):
         """Get point coordinates as a structured n*3 array).
@@ -210,6 +346,12 @@ class PointCloud(object):
         ------
         `simulocloud.exceptions.EmptyPointCloud`
             if there are no points
+        
+        Notes
+        -----
+        Bounds are calculated from the points on each access, as the array
+        may be modified in place. Immutable pointclouds (see
+        `simulocloud.tiles.Tile`) cache them instead.
         """
         x,y,z = self._arr
         try:
@@ -265,18 +407,30 @@ class PointCloud(object):
         
         """
         bounds = Bounds(*bounds)
-        oob = points_out_of_bounds(self, bounds)
+        morton = self._morton
+        if morton is not None and not destructive:
+            # Test only points in Morton key ranges intersecting bounds
+            key = morton.candidates(bounds)
+            inside = ~points_out_of_bounds(self._arr[:, key], bounds)
+            key = key[inside]
+            empty = not len(key)
+        else:
+            oob = points_out_of_bounds(self, bounds)
+            key = ~oob
+            empty = oob.all()
+        
         # Deal with empty pointclouds
-        if oob.all():
-            if allow_empty:
-                return type(self)(None)
-            else:
-                raise simulocloud.exceptions.EmptyPointCloud(
-                          "No points in crop bounds:\n{}".format(bounds))
+        if empty and not allow_empty:
+            raise simulocloud.exceptions.EmptyPointCloud(
+                      "No points in crop bounds:\n{}".format(bounds))
          
-        cropped = type(self)(self._arr[:, ~oob])
+        cropped = self._take(key)
+        if morton is not None:
+            cropped._morton = morton.take(key)
         if destructive:
-            self.__init__(self._arr[:, oob])
+            self.__init__(self._arr[:, oob], attrs=self._attrs.take(oob))
+            if morton is not None:
+                self._morton = morton.take(oob)
         return cropped
 
     def to_txt(self, fpath):
@@ -290,48 +444,239 @@ class PointCloud(object):
         """
         np.savetxt(fpath, self._arr.T)
 
+    def to_shared(self, directory=None):
+        """Write points to a file which other processes can memory-map.
+        
+        Arguments
+        ---------
+        directory: str (optional)
+            directory in which to write the file (default: system temporary)
+        
+        Returns
+        -------
+        `SharedPointCloud`
+            small, picklable handle from which `from_shared` initialises a
+            pointcloud (of any type) without copying the points
+        
+        Notes
+        -----
+        Points, and attributes held in memory, are written once to the file.
+        Passing the handle to another process, rather than the pointcloud
+        itself, avoids pickling (and so copying) them; attributes yet to be
+        loaded from .las files stay so. The file is removed when the handle
+        (in this process) is garbage collected, or by `SharedPointCloud.remove`.
+        """
+        fd, fpath = tempfile.mkstemp(suffix='.bin', prefix='simulocloud_', dir=directory)
+        layout = []
+        with os.fdopen(fd, 'wb') as f:
+            def write(arr):
+                arr = np.ascontiguousarray(arr)
+                layout.append((arr.dtype.str, arr.shape, f.tell()))
+                arr.tofile(f)
+                return len(layout) - 1
+            write(self._arr)
+            segments = tuple((seg.fpaths, None if seg.idx is None else write(seg.idx), seg.n,
+                              tuple((name, write(arr)) for name, arr in seg.columns.iteritems()))
+                             for seg in self._attrs._segments)
+        return SharedPointCloud(_OwnedPath(fpath), tuple(layout), segments)
+
     def to_las(self, fpath):
-        """Export point cloud coordinates to .las file.
+        """Export point cloud coordinates (and attributes) to .las file.
 
         Arguments
         ---------
         fpath: str
             path to file to write
         
+        Notes
+        -----
+        Only attributes which are dimensions of the .las point format written
+        (see `_LAS_ATTRIBUTES`) can be stored; a warning is issued naming any
+        others, which are not written.
+        
         """
         with laspy.file.File(fpath, mode='w', header=self.header,
                              vlrs=[laspy.header.VLR(**_VLR_DEFAULT)]) as f:
             f.x, f.y, f.z = self._arr
+            names = self._attrs.names
+            writable = sorted(name for name in names
+                              if _LAS_ATTRIBUTES.get(name) in f.point_format.lookup)
+            if len(writable) < len(names):
+                warnings.warn('Attributes {} are not dimensions of .las point format {}, '
+                              'so are not written to {}'.format(
+                                  sorted(names.difference(writable)),
+                                  f.header.data_format_id, fpath))
+            for name in writable:
+                setattr(f, name, self._attrs[name])
 
-    def downsample(self, n):
+    def downsample(self, n, seed=None):
         """Randomly sample the point cloud.
         
         Arguments
         ---------
         n: int
             number of points in sample
+        seed: int, `numpy.random.RandomState` or None (optional)
+            seed or generator of the random sample
+            None (default) uses numpy's global generator
         
         Returns
         -------
         PointCloud
-            of len n (or len of this pointcloud if it is <=n)
+            of len n (or len of this pointcloud if it is <=n), in random order
+        
+        Notes
+        -----
+        Where `n` is much smaller than the pointcloud, indices are drawn with
+        replacement until `n` are distinct, rather than shuffling an index
+        array as long as the pointcloud. To sample pointclouds too large to
+        hold in memory, see `reservoir_sample`.
         
         """
         n = min(n, len(self))
-        idx = np.random.choice(len(self), n, replace=False)
-        return type(self)(self._arr[:, idx])
+        idx = _sample_indices(len(self), n, _random_state(seed))
+        return self._take(idx)
+
+    def stratified_sample(self, n, dims='xy', seed=None):
+        """Sample the point cloud such that points are spread evenly over space.
+        
+        Arguments
+        ---------
+        n: int
+            number of points in sample
+        dims: str (default: 'xy')
+            dimensions over which to spread the sample (2 or 3 of 'xyz')
+        seed: int, `numpy.random.RandomState` or None (optional)
+            seed or generator of the random choice of points within each cell
+            (see `downsample`); a fixed seed makes the sample reproducible
+        
+        Returns
+        -------
+        PointCloud
+            of len n (or len of this pointcloud if it is <=n)
+        
+        Notes
+        -----
+        `dims` are divided into a grid of at least `n` cells, and one random
+        point is taken from each occupied cell in Morton (Z-order) order;
+        should fewer than `n` cells be occupied, further rounds of one point
+        per cell are taken until `n` points are sampled.
+        
+        """
+        if n >= len(self):
+            return type(self)(self._arr, attrs=self._attrs)
+        if n <= 0:
+            return self._take(np.empty(0, dtype=int))
+        
+        # Morton key of grid cell containing each point
+        ndims = len(dims)
+        ncells = int(np.ceil(n ** (1./ndims)))
+        bits = max(int(np.ceil(np.log2(ncells))), 1)
+        icoords = []
+        for dim in dims:
+            coords = getattr(self, dim)
+            min_, max_ = coords.min(), coords.max()
+            spacing = (max_ - min_) / ncells or 1.
+            icoords.append(np.minimum((coords - min_) / spacing, ncells - 1))
+        keys = _morton_keys(np.array(icoords, dtype=np.uint64), bits)
+        
+        # Rank points randomly within cells
+        rand = _random_state(seed).random_sample(len(self))
+        order = np.lexsort((rand, keys))
+        keys = keys[order]
+        starts = _group_starts(keys)
+        ranks = np.arange(len(keys)) - np.repeat(starts, np.diff(np.append(starts, len(keys))))
+        
+        # Take lowest ranks first, in Morton order of cells
+        idx = order[np.lexsort((keys, ranks))[:n]]
+        return self._take(idx)
+
+    def thin_to_density(self, density, cell_size=1., seed=None):
+        """Thin the point cloud to at most a density of points per unit area.
+        
+        Arguments
+        ---------
+        density: float
+            target number of points per unit area (e.g. per square metre)
+        cell_size: float (default: 1.)
+            edge length of the square xy cells to which density is capped
+            cells are aligned to multiples of `cell_size`
+        seed: int, `numpy.random.RandomState` or None (optional)
+            seed of the random choice of points within each cell (a generator,
+            or None for numpy's global generator, draws one); a fixed seed
+            makes the sample reproducible
+        
+        Returns
+        -------
+        PointCloud
+            containing, in their original order, no more than
+            `density * cell_size**2` random points of each cell (rounded up or
+            down at random for fractional numbers, so the mean is exact);
+            sparser cells keep all of their points
+        
+        Notes
+        -----
+        Points are sorted once by cell and a random key, and the first of
+        each cell taken. Keys are hashes of the points' (quantised)
+        coordinates and `seed`, rather than draws from a random stream, so
+        that the same points are chosen whichever pointcloud (or tile) holds
+        them (see `simulocloud.tiles.TilesGrid.thin_to_density`).
+        
+        """
+        seed = _int_seed(seed)
+        idx, _, _ = _thin_to_density(self._arr, density, cell_size, seed)
+        if len(idx) == len(self):
+            return type(self)(self._arr, attrs=self._attrs)
+        return self._take(idx)
 
 
-    def merge(self, pointclouds):
+    def deduplicate(self, tolerance=2.5e-4):
+        """Remove duplicate and near-duplicate points.
+        
+        Arguments
+        ---------
+        tolerance: float (default: 2.5e-4)
+            quantisation step of coordinates: points whose coordinates round
+            to the same multiples of `tolerance` are duplicates
+            0 removes only exactly identical points
+        
+        Returns
+        -------
+        PointCloud
+            containing the first occurrence of each (near-)duplicate point,
+            with points in their original order
+        
+        Notes
+        -----
+        Points are quantised to integer keys and sorted once, so no more
+        than O(n log n) time and a few arrays of n integers are needed. The
+        default `tolerance` matches the coordinate scale of written .las files.
+        
+        """
+        if tolerance:
+            keys = np.round(self._arr / tolerance).astype(np.int64)
+        else:
+            keys = self._arr
+        order = np.lexsort(keys[::-1])
+        keys = keys[:, order]
+        starts = _group_starts(keys)
+        if len(starts) == len(order):
+            return type(self)(self._arr, attrs=self._attrs)
+        return self._take(np.sort(order[starts]))
+
+    def merge(self, pointclouds, deduplicate=None):
         """Merge this pointcloud with other instances.
         
         Arguments
         ---------
         pointclouds: sequence of `PointCloud`
+        deduplicate: float (optional)
+            tolerance with which to remove duplicate points once merged
+            (see `deduplicate`)
         
         """
         pointclouds = [self] + [pc for pc in pointclouds]
-        return merge(pointclouds, pctype=type(self))
+        return merge(pointclouds, pctype=type(self), deduplicate=deduplicate)
 
     def split(self, axis, locs, pctype=None, allow_empty=True):
         """Split this pointcloud at specified locations along axis.
@@ -357,7 +702,7 @@ class PointCloud(object):
         # Copy pointcloud
         if pctype is None:
             pctype = type(self)
-        pc = pctype(self._arr)
+        pc = pctype(self._arr, attrs=self._attrs)
         
         # Sequentially (high -> low) split pointcloud
         none_bounds = Bounds(*(None,)*6)
@@ -368,6 +713,427 @@ class PointCloud(object):
         
         return pcs[::-1]
 
+    def sort_spatial(self, bits=21):
+        """Return pointcloud with points sorted along a Morton (Z-order) curve.
+        
+        Arguments
+        ---------
+        bits: int (default: 21)
+            resolution of the curve: bounds are divided into 2**bits cells
+            along each axis
+        
+        Returns
+        -------
+        PointCloud
+            containing the same points, such that points close in space are
+            mostly close in the array
+        
+        Notes
+        -----
+        The sorted keys are retained, so that `crop` need only test points
+        within the runs of keys covering the crop bounds, rather than every
+        point. Keys are discarded if the pointcloud's array is replaced.
+        
+        """
+        morton = _MortonIndex.from_arr(self._arr, bits)
+        order = np.argsort(morton.keys, kind='mergesort')
+        pc = self._take(order)
+        pc._morton = morton.take(order)
+        return pc
+
+    def transform(self, matrix, chunk_size=_CHUNKSIZE, inplace=False):
+        """Apply a linear or affine transformation to point coordinates.
+        
+        Arguments
+        ---------
+        matrix: array_like (shape=(3, 3), (3, 4) or (4, 4))
+            linear (3*3) or affine (3*4, or 4*4 in homogeneous coordinates
+            with a last row of (0, 0, 0, 1)) transformation of (x, y, z)
+            column vectors, e.g. a rotation followed by a translation
+        chunk_size: int (optional)
+            number of points transformed at a time
+        inplace: bool (default: False)
+            whether to overwrite the coordinates of this pointcloud rather
+            than returning a transformed copy
+            immutable pointclouds (i.e. tiles) are always copied
+        
+        Returns
+        -------
+        PointCloud
+            this pointcloud, if transformed in place, or a new instance
+        
+        Notes
+        -----
+        Points are transformed block by block into a preallocated buffer, so
+        no more than `chunk_size` points of temporary storage are needed
+        beyond the output (the only copy made, if any). Where the
+        transformation only scales, flips and swaps axes, cached bounds (of
+        immutable pointclouds) are mapped directly; otherwise they are gathered
+        block by block as points are transformed, so are never calculated in a
+        separate pass.
+        
+        """
+        linear, translation = _split_affine(matrix)
+        arr = self._arr
+        n = arr.shape[1]
+        inplace = inplace and arr.flags.writeable
+        out = arr if inplace else np.empty_like(arr)
+        
+        # Map cached bounds directly, where possible
+        bounds = self.__dict__.get('_bounds')
+        if bounds is not None:
+            bounds = _transform_bounds(bounds, linear, translation)
+        gather = bounds is None and self._caches_bounds
+        lower, upper = np.full(3, np.inf), np.full(3, -np.inf)
+        
+        buf = np.empty((3, min(chunk_size, n)), dtype=arr.dtype)
+        for i in xrange(0, n, chunk_size):
+            block = arr[:, i:i+chunk_size]
+            work = buf if block.shape[1] == buf.shape[1] else np.empty_like(block)
+            np.dot(linear, block, out=work)
+            work += translation[:, None]
+            if gather:
+                np.minimum(lower, work.min(axis=1), out=lower)
+                np.maximum(upper, work.max(axis=1), out=upper)
+            out[:, i:i+chunk_size] = work
+        if n and gather:
+            bounds = Bounds(*np.concatenate([lower, upper]))
+        
+        if inplace:
+            pc = self
+            pc._morton = None
+        else:
+            pc = type(self)._from_arr(out, attrs=self._attrs)
+        if bounds is not None:
+            pc._bounds = bounds
+        return pc
+
+    def voxelise(self, size, **kwargs):
+        """Count hits of points in, and passes of rays through, voxels.
+        
+        Arguments
+        ---------
+        size: float
+            voxel edge length
+        **kwargs:
+            see `simulocloud.voxels.voxelise`
+        
+        Returns
+        -------
+        `simulocloud.voxels.SparseVoxels` or `simulocloud.voxels.DenseVoxels`
+        
+        """
+        import simulocloud.voxels
+        return simulocloud.voxels.voxelise(self, size, **kwargs)
+
+    def _take(self, key):
+        """Return new pointcloud of points selected by boolean mask or indices."""
+        return type(self)(self._arr[:, key], attrs=self._attrs.take(key))
+
+
+class _MortonIndex(collections.namedtuple('_MortonIndex',
+                        ['keys', 'origin', 'spacing', 'bits'])):
+    """Morton keys of points quantised to a grid of 2**bits cells per axis.
+    
+    Attributes
+    ----------
+    keys: `numpy.ndarray` (dtype=uint64)
+        key of each point (sorted, for a spatially sorted pointcloud)
+    origin: `numpy.ndarray`
+        (x, y, z) coordinates of the lower corner of the grid
+    spacing: `numpy.ndarray`
+        (x, y, z) size of grid cells
+    bits: int
+        number of bits per axis in keys
+    """
+    __slots__ = ()
+
+    @classmethod
+    def from_arr(cls, arr, bits):
+        """Compute keys of (3*n) point coordinates `arr`."""
+        if not arr.shape[1]:
+            return cls(np.empty(0, dtype=np.uint64), np.zeros(3), np.ones(3), bits)
+        origin = arr.min(axis=1)
+        spacing = (arr.max(axis=1) - origin) / (2**bits - 1)
+        spacing[spacing == 0] = 1.
+        index = cls(None, origin, spacing, bits)
+        return index._replace(keys=_morton_keys(index.cells(arr), bits))
+
+    def cells(self, coords):
+        """Return (3*n) uint64 grid cell indices of (3*n) `coords`."""
+        cells = (coords - self.origin[:, None]) / self.spacing[:, None]
+        return np.clip(cells, 0, 2**self.bits - 1).astype(np.uint64)
+
+    def take(self, key):
+        """Return index of points selected by boolean mask or indices."""
+        return self._replace(keys=self.keys[key])
+
+    def candidates(self, bounds):
+        """Return indices of (sorted) points which may be within `bounds`.
+        
+        The cell ranges covering `bounds` are decomposed into (at most
+        `_MAX_KEY_RANGES`) contiguous runs of keys by descending the implicit
+        octree of Morton order, and each run is located in the sorted keys by
+        binary search.
+        """
+        bounds = InfBounds(*bounds)
+        lo = self.cells(np.array(bounds[:3])[:, None])[:, 0].astype(np.int64)
+        hi = self.cells(np.array(bounds[3:])[:, None])[:, 0].astype(np.int64)
+        
+        # Descend octree, keeping nodes partially within bounds
+        partial = np.zeros((1, 3), dtype=np.int64) # node origins (in cells)
+        ranges = []
+        for level in xrange(self.bits, -1, -1):
+            size = 2**level
+            node_lo, node_hi = partial, partial + size - 1
+            overlaps = np.all((node_lo <= hi) & (node_hi >= lo), axis=1)
+            inside = np.all((node_lo >= lo) & (node_hi <= hi), axis=1)
+            straddling = overlaps & ~inside
+            if level == 0 or 8*np.count_nonzero(straddling) > _MAX_KEY_RANGES:
+                keep = overlaps # take straddling nodes whole
+            else:
+                keep = inside
+            if keep.any():
+                starts = _morton_keys(partial[keep].T.astype(np.uint64), self.bits)
+                ranges.append((starts, starts + np.uint64(size**3)))
+            partial = partial[overlaps & ~keep]
+            if not len(partial):
+                break
+            # Split remaining nodes into octants
+            half = size // 2
+            octants = np.array(list(np.ndindex(2, 2, 2))) * half
+            partial = (partial[:, None, :] + octants[None, :, :]).reshape(-1, 3)
+        
+        if not ranges:
+            return np.empty(0, dtype=np.intp)
+        starts, ends = [np.concatenate(r) for r in zip(*ranges)]
+        order = np.argsort(starts)
+        first = np.searchsorted(self.keys, starts[order], side='left')
+        last = np.searchsorted(self.keys, ends[order], side='left')
+        
+        # Concatenate runs of indices
+        lengths = last - first
+        nonempty = lengths > 0
+        first, lengths = first[nonempty], lengths[nonempty]
+        offsets = np.repeat(first - np.cumsum(np.append(0, lengths[:-1])), lengths)
+        return np.arange(lengths.sum()) + offsets
+
+class Attributes(object):
+    """Per-point attributes stored as columns parallel to point coordinates.
+    
+    Each attribute (e.g. 'intensity', 'classification') is a 1D array with an
+    element per point, accessed by name: `attrs['intensity']`. Only the
+    attributes common to all points are available (see `names`).
+    
+    Attributes of points read from .las files are loaded lazily, upon first
+    access. Until then, only the files and the indices of the points within
+    them are recorded; selections of points (masks or indices, as in
+    `PointCloud.crop`) are composed onto these indices, and concatenations
+    (as in `merge`) append them, so that carrying attributes through
+    pointcloud operations costs no extra passes over the points.
+    """
+    def __init__(self, segments):
+        """Directly initialise from a sequence of `_AttributeSegment`.
+        
+        Instantiation by the constructor classmethods is preferred.
+        """
+        self._segments = list(segments)
+        self._cache = {}
+
+    def __len__(self):
+        """Number of points described."""
+        return sum(seg.n for seg in self._segments)
+
+    def __contains__(self, name):
+        return name in self.names
+
+    def __getitem__(self, name):
+        """Return the array of attribute `name` for every point."""
+        if name not in self.names:
+            raise KeyError(name)
+        if len(self._segments) == 1:
+            return self._segments[0].get(name)
+        try:
+            return self._cache[name]
+        except KeyError:
+            self._cache[name] = np.concatenate(
+                [seg.get(name) for seg in self._segments])
+            return self._cache[name]
+
+    def __repr__(self):
+        return 'Attributes({})'.format(sorted(self.names))
+
+    @classmethod
+    def from_columns(cls, columns):
+        """Initialise from a dict of {name: array} of equal lengths."""
+        columns = {name: np.asarray(arr) for name, arr in columns.iteritems()}
+        sizes = set(len(arr) for arr in columns.values())
+        if len(sizes) != 1:
+            raise ValueError('Attribute arrays must be of equal length')
+        return cls([_AttributeSegment(None, None, sizes.pop(), columns)])
+
+    @classmethod
+    def from_None(cls, n):
+        """Initialise without any attributes for `n` points."""
+        return cls([_AttributeSegment(None, None, n, {})])
+
+    @classmethod
+    def from_las(cls, fpaths, n):
+        """Initialise lazily from all `n` points of .las files at `fpaths`."""
+        return cls([_AttributeSegment(tuple(fpaths), None, n, {})])
+
+    @classmethod
+    def concatenate(cls, iattrs):
+        """Concatenate the attributes of consecutive pointclouds."""
+        segments = [seg for attrs in iattrs for seg in attrs._segments]
+        if not segments:
+            return cls.from_None(0)
+        return cls([seg for seg in segments if seg.n] or segments[:1])
+
+    @property
+    def names(self):
+        """Names of attributes available for every point."""
+        return frozenset.intersection(*[seg.names for seg in self._segments])
+
+    def take(self, key):
+        """Return attributes of points selected by boolean mask or indices."""
+        if len(self._segments) == 1:
+            return type(self)([self._segments[0].take(key)])
+        
+        key = np.asarray(key)
+        offsets = np.cumsum([0] + [seg.n for seg in self._segments])
+        if key.dtype == bool:
+            return type(self)([seg.take(key[i:j]) for seg, i, j in
+                               zip(self._segments, offsets[:-1], offsets[1:])])
+        
+        # Split ascending indices into runs within each segment
+        if not np.all(key[1:] >= key[:-1]):
+            # Arbitrary order: load and index in memory
+            return type(self).from_columns({name: self[name][key]
+                                            for name in self.names})
+        bounds = np.searchsorted(key, offsets)
+        return type(self)([seg.take(key[a:b] - i) for seg, i, a, b in
+                           zip(self._segments, offsets, bounds[:-1], bounds[1:])
+                           if b > a] or [self._segments[0].take(key)])
+
+class _AttributeSegment(object):
+    """Attributes of a run of points, either in memory or lazily from files.
+    
+    Attributes
+    ----------
+    fpaths: tuple of str or None
+        .las files from which to load attributes (None if only in memory)
+    idx: `numpy.ndarray` or None
+        indices of the points within the concatenated points of `fpaths`
+        (None for all points, in order)
+    n: int
+        number of points
+    columns: dict
+        {name: array} of loaded attributes
+    """
+    def __init__(self, fpaths, idx, n, columns):
+        self.fpaths = fpaths
+        self.idx = idx
+        self.n = n
+        self.columns = columns
+        self._file_names = None
+
+    @property
+    def names(self):
+        """Names of attributes available in memory or from files."""
+        if self._file_names is None:
+            self._file_names = (frozenset.intersection(
+                                    *[_get_las_attribute_names(fpath)
+                                      for fpath in self.fpaths])
+                                if self.fpaths else frozenset())
+        return self._file_names.union(self.columns)
+
+    def get(self, name):
+        """Return (loading if required) the array of attribute `name`."""
+        try:
+            return self.columns[name]
+        except KeyError:
+            arr = _get_las_attribute(self.fpaths, name, self.idx)
+            self.columns[name] = arr
+            return arr
+
+    def take(self, key):
+        """Return segment of points selected by boolean mask or indices."""
+        key = np.asarray(key)
+        columns = {name: arr[key] for name, arr in self.columns.iteritems()}
+        idx = None
+        if self.fpaths:
+            if self.idx is None:
+                idx = np.flatnonzero(key) if key.dtype == bool else key
+            else:
+                idx = self.idx[key]
+        n = np.count_nonzero(key) if key.dtype == bool else len(key)
+        seg = type(self)(self.fpaths, idx, n, columns)
+        seg._file_names = self._file_names
+        return seg
+
+def _coerce_attributes(attrs, n):
+    """Return `attrs` of `n` points as `Attributes` (None for no attributes)."""
+    if attrs is None:
+        return Attributes.from_None(n)
+    elif isinstance(attrs, Attributes):
+        return attrs
+    else:
+        return Attributes.from_columns(attrs)
+
+
+class SharedPointCloud(collections.namedtuple('SharedPointCloud', ['file', 'layout', 'segments'])):
+    """Picklable handle to points written by `PointCloud.to_shared`.
+    
+    Attributes
+    ----------
+    file: `_OwnedPath`
+        file of arrays (removed with the handle that wrote it)
+    layout: tuple
+        (dtype, shape, offset) of each array in the file, the first being
+        the (3*n) point coordinates
+    segments: tuple
+        (fpaths, idx, n, columns) of each `_AttributeSegment` of the
+        pointcloud's attributes, with `idx` (or None) and each of the
+        (name, array) `columns` indexing `layout`
+    """
+    __slots__ = ()
+
+    @property
+    def fpath(self):
+        """Path of the file of arrays."""
+        return self.file.path
+
+    def remove(self):
+        """Delete file of points (pointclouds already mapping it are unaffected)."""
+        self.file.remove()
+
+class _OwnedPath(object):
+    """Temporary file or directory, removed along with this object if `owned`.
+    
+    Copies (e.g. pickled to worker processes) never own the path, so it is
+    removed only by the process which created it.
+    """
+    def __init__(self, path, owned=True):
+        self.path = path
+        self.owned = owned
+
+    def __reduce__(self):
+        return type(self), (self.path, False)
+
+    def __del__(self):
+        if self.owned:
+            try:
+                self.remove()
+            except (AttributeError, TypeError, OSError): # e.g. modules torn down at exit
+                pass
+
+    def remove(self):
+        """Delete the file or directory (if it still exists)."""
+        if os.path.isdir(self.path):
+            shutil.rmtree(self.path, ignore_errors=True)
+        elif os.path.exists(self.path):
+            os.remove(self.path)
 
 class NoneFormatter(string.Formatter):
     """Handle an attempt to apply decimal formatting to `None`.
@@ -457,33 +1223,467 @@ def filter_fpaths(fpaths, bounds):
     return [fpath for fpath in fpaths
             if _intersects_3D(bounds, _get_las_bounds(fpath))]
 
-def _combine_las(*fpaths):
-    """Efficiently combine las files to a single [xs, ys, zs] array."""
-    sizes = {fpath: _get_las_npoints(fpath) for fpath in fpaths}
-    npoints = sum(sizes.values())
-    arr = np.empty((3, npoints), dtype = _DTYPE) # initialise array
-    
-    # Fill array piece by piece
-    i = 0 # start point
-    for fpath, size in sizes.iteritems():
-        j = i + size # end point
-        arr[:,i:j] = _get_las_xyz(fpath)
+def iter_las(fpaths, prefetch=2, pctype=PointCloud, **kwargs):
+    """Yield a pointcloud from each .las file, reading ahead in the background.
+    
+    Arguments
+    ---------
+    fpaths: iterable of str
+        filepaths of .las files
+    prefetch: int (default: 2)
+        number of files to read ahead (in threads) while the caller processes
+        the current pointcloud; at most `prefetch` + 1 pointclouds are held
+        0 reads each file only when it is requested, without threads
+    pctype: subclass of `PointCloud`
+        type of pointclouds to yield
+    allow_empty: bool (default: False)
+        if `bounds` specified, whether to yield empty pointclouds of files
+        (intersecting `bounds`) with no points within `bounds`, or raise
+        `simulocloud.exceptions.EmptyPointCloud`, as `PointCloud.from_las`
+    **kwargs
+        passed to `pctype.from_las` (e.g. `bounds`, `where`)
+    
+    Yields
+    ------
+    fpath: str
+        filepath of .las file
+    pc: instance of `pctype`
+        pointcloud read from `fpath`
+    
+    Notes
+    -----
+    Pointclouds are yielded in the order of `fpaths`. If `bounds` is passed,
+    files which do not intersect it (according to their headers) are skipped;
+    as each file is opened only once, by the thread reading it, skipped files
+    are only known once reached.
+    
+    """
+    allow_empty = kwargs.pop('allow_empty', None)
+    if kwargs.get('bounds') is None:
+        if allow_empty is not None:
+            raise TypeError('Argument `allow_empty` is meaningless without `bounds`')
+    else:
+        kwargs['allow_empty'] = True # raised below, naming the file
+    
+    read_las = lambda fpath: pctype._from_las([fpath], **kwargs)
+    if prefetch:
+        reads = _iter_prefetched(read_las, fpaths, prefetch)
+    else:
+        reads = ((fpath, read_las(fpath)) for fpath in fpaths)
+    for fpath, (pc, read) in reads:
+        if not read: # outside bounds
+            continue
+        if not len(pc) and kwargs.get('bounds') is not None and not allow_empty:
+            raise simulocloud.exceptions.EmptyPointCloud(
+                      "No points of {} in crop bounds".format(fpath))
+        yield fpath, pc
+
+def _iter_prefetched(func, items, prefetch):
+    """Yield (item, func(item)) in order, computing up to `prefetch` ahead in threads."""
+    pool = multiprocessing.pool.ThreadPool(prefetch)
+    pending = collections.deque()
+    try:
+        # (trailing Nones drain the items computed ahead)
+        for item in itertools.chain(items, [None]*prefetch):
+            if item is not None:
+                pending.append((item, pool.apply_async(func, (item,))))
+            if len(pending) > prefetch or (item is None and pending):
+                item, result = pending.popleft()
+                yield item, result.get()
+    finally:
+        pool.terminate()
+
+def reservoir_sample(pcs, n, seed=None, pctype=PointCloud):
+    """Randomly sample `n` points from a stream of pointclouds in one pass.
+    
+    Arguments
+    ---------
+    pcs: iterable of `PointCloud`
+        e.g. the chunks of a survey too large to hold in memory:
+        >>> pcs = (pc for _, pc in iter_las(fpaths))
+    n: int
+        number of points in sample
+    seed: int, `numpy.random.RandomState` or None (optional)
+        seed or generator of the random sample (see `PointCloud.downsample`)
+    pctype: subclass of `PointCloud`
+        type of pointcloud to return
+    
+    Returns
+    -------
+    instance of `pctype`
+        uniform random sample of `n` points (or all points, if fewer), in the
+        order they were streamed
+    
+    Notes
+    -----
+    Each point is given a uniform random key, and the `n` points of lowest
+    key are kept. Only points keyed below the highest key in the reservoir
+    are added as each pointcloud is streamed, so memory is bounded by `n`
+    plus the largest pointcloud.
+    
+    """
+    rs = _random_state(seed)
+    reservoir, keys = pctype(None), np.empty(0)
+    if n <= 0:
+        return reservoir
+    for pc in pcs:
+        pc_keys = _random_uniform(rs, len(pc))
+        if len(reservoir) == n:
+            candidates = pc_keys < keys.max()
+            pc, pc_keys = pc._take(candidates), pc_keys[candidates]
+        if not len(pc):
+            continue
+        reservoir = merge([reservoir, pc], pctype=pctype)
+        keys = np.concatenate([keys, pc_keys])
+        if len(reservoir) > n:
+            kept = np.sort(np.argpartition(keys, n - 1)[:n])
+            reservoir, keys = reservoir._take(kept), keys[kept]
+    return reservoir
+
+def _read_las(fpaths, bounds=None, where=None, trust_header=False):
+    """Read and combine the points of .las files, opening each file once.
+    
+    Files whose headers do not intersect `bounds` (`InfBounds`) are skipped.
+    Points outside `bounds` or not satisfying `where` predicates are masked
+    out of the raw records before decoding.
+    
+    Returns
+    -------
+    arr: `numpy.ndarray` (shape=(3, n)) or None
+        coordinates of points read (None if no files were read)
+    read: list of (fpath, n, mask)
+        files read, with their number of point records and boolean mask of
+        records read (None if all were read)
+    bounds: `Bounds` or None
+        bounds of the files' headers, if `trust_header` and no points were
+        masked
+    
+    Notes
+    -----
+    Files are opened up to `_MAX_OPEN_FILES` at a time, and the points to
+    read from every file selected (and counted) before any are decoded, so
+    that the array is allocated once to fit them exactly. Each file is then
+    decoded directly into its slice; if there are more files than can be
+    held open at once, they are reopened (in groups) to be decoded. The
+    array is only left longer than the points read (a view of it returned)
+    should a bad header be found as a file is decoded.
+    """
+    fpaths = list(fpaths)
+    opened = collections.OrderedDict() # {fpath: open `laspy.file.File`}
+    try:
+        # Select points of every file
+        selections = []
+        for g in xrange(0, len(fpaths), _MAX_OPEN_FILES):
+            group = fpaths[g:g+_MAX_OPEN_FILES]
+            _open_las_group(opened, group)
+            for fpath in group:
+                selection = _select_las_points(opened[fpath], fpath, bounds, where, trust_header)
+                if selection is not None:
+                    selections.append(selection)
+        
+        # Decode each file into its slice, verifying headers relied upon
+        arr = np.empty((3, sum(selection.count for selection in selections)), dtype=_DTYPE)
+        reopen = len(fpaths) > _MAX_OPEN_FILES
+        n = 0 # number of points filled
+        read, all_bounds = [], []
+        for i, selection in enumerate(selections):
+            if reopen:
+                if selection.fpath not in opened:
+                    _open_las_group(opened, [s.fpath for s in selections[i:i+_MAX_OPEN_FILES]])
+                f = opened[selection.fpath]
+                selection = selection._replace(header=f.header, raw=[f.reader.get_dimension(dim)
+                                                                     for dim in 'XYZ'])
+            selection = _decode_las(selection, arr[:, n:], bounds)
+            n += selection.count
+            read.append((selection.fpath, len(selection.raw[0]), selection.mask))
+            all_bounds.append(selection.header_bounds)
+    finally:
+        _open_las_group(opened, [])
+    
+    if not read:
+        return None, read, None
+    if n < arr.shape[1]: # bad header masked points counted
+        arr = arr[:, :n]
+    bounds = None
+    if trust_header and n and all(mask is None for _, _, mask in read):
+        bounds = merge_bounds([b for b, (_, count, _) in zip(all_bounds, read) if count])
+    return arr, read, bounds
+
+def _open_las_group(opened, fpaths):
+    """Close the .las files in `opened` (dict), and open those of `fpaths` in it."""
+    while opened:
+        opened.popitem(last=False)[1].close()
+    for fpath in fpaths:
+        if fpath not in opened:
+            opened[fpath] = laspy.file.File(fpath)
+
+class _LasSelection(collections.namedtuple('_LasSelection', ['fpath', 'header', 'header_bounds',
+                                                             'raw', 'mask', 'count', 'verify'])):
+    """Points selected to be read from an open .las file (see `_read_las`).
+    
+    `verify` is whether the header's bounds are relied upon (but not
+    trusted), so must be checked against the points as they are decoded.
+    """
+    __slots__ = ()
+
+def _select_las_points(f, fpath, bounds, where, trust_header):
+    """Return `_LasSelection` of points of open .las file `f` to read.
+    
+    Returns None if the file's header does not intersect `bounds`. Points
+    are not masked by `bounds` if the header lies inside them.
+    """
+    header = f.header
+    header_bounds = Bounds(*(header.min + header.max))
+    if bounds is not None and not _intersects_3D(bounds, header_bounds):
+        return None
+    raw = [f.reader.get_dimension(dim) for dim in 'XYZ']
+    
+    mask = None if where is None else las_where(f, where)
+    inside = bounds is not None and _inside_bounds(header_bounds, bounds)
+    if bounds is not None and not inside:
+        in_bounds = _raw_in_bounds(raw, header.scale, header.offset, bounds)
+        mask = in_bounds if mask is None else mask & in_bounds
+    count = header.count if mask is None else np.count_nonzero(mask)
+    verify = inside and not trust_header
+    return _LasSelection(fpath, header, header_bounds, raw, mask, count, verify)
+
+def _decode_las(selection, out, bounds=None):
+    """Decode selected points of a .las file into (3*n) `out`, chunk by chunk.
+    
+    Where the header's bounds are relied upon to skip masking by `bounds`
+    (`selection.verify`), each chunk of raw records is checked to lie within
+    them as it is decoded. Should any point not, the header is reported (see
+    `_warn_bad_header`), and the points masked and decoded again.
+    
+    Returns
+    -------
+    selection: `_LasSelection`
+        of the points decoded
+    """
+    header, raw, mask = selection.header, selection.raw, selection.mask
+    scale, offset = np.array(header.scale), np.array(header.offset)
+    if selection.verify:
+        lo = [_raw_threshold(v, s, o) for v, s, o in zip(header.min, scale, offset)]
+        hi = [_raw_threshold(v, s, o) for v, s, o in zip(header.max, scale, offset)]
+        hi = [r - (r * s + o > v) for r, v, s, o in zip(hi, header.max, scale, offset)]
+    i = 0
+    for start in xrange(0, len(raw[0]), _CHUNKSIZE):
+        key = slice(start, start + _CHUNKSIZE)
+        chunk_mask = None if mask is None else mask[key]
+        for axis in range(3):
+            values = raw[axis][key] if chunk_mask is None else raw[axis][key][chunk_mask]
+            if selection.verify and len(values) and (values.min() < lo[axis] or
+                                                     values.max() > hi[axis]):
+                _warn_bad_header(selection.fpath, 'points lie outside header bounds {}'.format(
+                                     tuple(selection.header_bounds)))
+                in_bounds = _raw_in_bounds(raw, scale, offset, bounds)
+                mask = in_bounds if mask is None else mask & in_bounds
+                return _decode_las(selection._replace(mask=mask, count=np.count_nonzero(mask),
+                                                      verify=False), out)
+            j = i + len(values)
+            np.multiply(values, scale[axis], out=out[axis, i:j])
+            out[axis, i:j] += offset[axis]
         i = j
-    return arr
+    return selection
 
-def _get_las_npoints(fpath):
-    """Return the number of points in a .las file.
+def _raw_in_bounds(raw, scale, offset, bounds):
+    """Return whether each point's raw integer record decodes to within `bounds`.
     
-    Note: npoints is read from the file's header, which is not guuaranteed
-          to be at all accurate. This may be a source of error.
+    `bounds` (`InfBounds`) are converted to thresholds of raw records, so that
+    no coordinates need be decoded to test them.
+    """
+    inside = np.ones(len(raw[0]), dtype=bool)
+    for axis in range(3):
+        min_, max_ = bounds[axis], bounds[axis+3]
+        if np.isfinite(min_):
+            inside &= raw[axis] >= _raw_threshold(min_, scale[axis], offset[axis])
+        if np.isfinite(max_):
+            inside &= raw[axis] < _raw_threshold(max_, scale[axis], offset[axis])
+    return inside
+
+def _raw_threshold(value, scale, offset):
+    """Return the smallest raw integer record decoding to a coordinate >= `value`."""
+    r = int(np.ceil((value - offset) / scale))
+    while (r - 1) * scale + offset >= value:
+        r -= 1
+    while r * scale + offset < value:
+        r += 1
+    return r
+
+def _warn_bad_header(fpath, problem):
+    """Issue a `BadHeaderWarning` of a problem with a .las file's header.
+    
+    The warning's `fpath` and `problem` attributes identify the file and
+    problem, e.g. for `warnings.catch_warnings(record=True)` to collect.
+    """
+    warning = simulocloud.exceptions.BadHeaderWarning('{}: {}'.format(fpath, problem))
+    warning.fpath, warning.problem = fpath, problem
+    warnings.warn(warning)
+
+def _iter_las_xyz(fpath, chunksize=_CHUNKSIZE, where=None):
+    """Yield (3*n) arrays of successive chunks of points in .las file.
+    
+    Coordinates are decoded from the raw (memory-mapped) integer records one
+    chunk at a time, so that only `chunksize` points are held in memory.
+    Points not satisfying `where` predicates (see `las_where`) are skipped
+    before decoding.
     """
     with laspy.file.File(fpath) as f:
-        return f.header.count
+        raw = [f.reader.get_dimension(dim) for dim in 'XYZ']
+        scale, offset = f.header.scale, f.header.offset
+        npoints = len(raw[0])
+        for i in xrange(0, npoints, chunksize):
+            j = min(i + chunksize, npoints)
+            key = slice(i, j)
+            if where is not None:
+                key = np.flatnonzero(las_where(f, where, key)) + i
+            arr = np.empty((3, len(raw[0][key])), dtype=_DTYPE)
+            for axis in range(3):
+                np.multiply(raw[axis][key], scale[axis], out=arr[axis])
+                arr[axis] += offset[axis]
+            yield arr
+
+class _LasWriter(object):
+    """Write points to a .las file chunk by chunk, as they are produced.
+    
+    The header (see `PointCloud.header`) is written when the writer is
+    created, with its offset taken from `origin` (e.g. the minimum of the
+    first chunk), and point records are appended as each chunk is written.
+    The point count and bounds are filled into the header on `close`.
+    Only coordinates are written; the other fields of each record are zero.
+    """
+    def __init__(self, fpath, origin):
+        header = _HEADER_DEFAULT.copy()
+        header.update(zip(('x_offset', 'y_offset', 'z_offset'), np.round(origin)))
+        with laspy.file.File(fpath, mode='w', header=laspy.header.Header(**header),
+                             vlrs=[laspy.header.VLR(**_VLR_DEFAULT)]) as f:
+            self._dtype = np.dtype([(spec.name, spec.np_fmt)
+                                    for spec in f.point_format.specs])
+            self._scale = np.array(f.header.scale)
+            self._offset = np.array(f.header.offset)
+        self.fpath = fpath
+        self.count = 0
+        self._mins = np.full(3, np.inf)
+        self._maxs = np.full(3, -np.inf)
+        self._file = open(fpath, 'ab')
 
-def _get_las_xyz(fpath):
-    """Return [x, y, z] list of coordinate arrays from .las file."""
+    def write(self, arr):
+        """Append (3*n) array of point coordinates to file."""
+        records = np.zeros(arr.shape[1], dtype=self._dtype)
+        for axis, dim in enumerate('XYZ'):
+            records[dim] = np.round((arr[axis] - self._offset[axis]) / self._scale[axis])
+        records.tofile(self._file)
+        self.count += arr.shape[1]
+        if arr.shape[1]:
+            self._mins = np.minimum(self._mins, arr.min(axis=1))
+            self._maxs = np.maximum(self._maxs, arr.max(axis=1))
+
+    def close(self):
+        """Fill the point count and bounds into the header, and close file."""
+        if self._file.closed:
+            return
+        self._file.close()
+        # Offsets of fields in the LAS public header block
+        with open(self.fpath, 'r+b') as f:
+            f.seek(107)
+            f.write(struct.pack('<6I', self.count, self.count, 0, 0, 0, 0))
+            f.seek(179)
+            f.write(struct.pack('<6d', *np.stack([self._maxs, self._mins], axis=1).ravel()))
+
+def las_where(f, where, key=slice(None)):
+    """Evaluate attribute predicates on the raw point records of a .las file.
+    
+    Arguments
+    ---------
+    f: `laspy.file.File` instance
+        open .las file
+    where: dict
+        {attribute: condition} where attribute is one of `_LAS_ATTRIBUTES`
+        (e.g. 'classification', 'return_num', 'intensity') and condition is:
+        - a set (or list) of values, e.g. {2, 9}
+        - an inclusive (min, max) tuple, with None for no limit, e.g. (1, 1)
+        - a callable accepting an array of values and returning a boolean
+          array, e.g. `lambda intensity: intensity > 200`
+    key: slice or indices (optional)
+        points to evaluate (default: all)
+    
+    Returns
+    -------
+    `numpy.ndarray` (dtype=bool)
+        whether each point satisfies all predicates
+    
+    """
+    mask = None
+    for name, condition in where.iteritems():
+        values = _get_las_record_attribute(f, name, key)
+        if callable(condition):
+            satisfied = np.asarray(condition(values), dtype=bool)
+        elif isinstance(condition, tuple):
+            min_, max_ = condition
+            satisfied = np.ones(len(values), dtype=bool)
+            if min_ is not None:
+                satisfied &= values >= min_
+            if max_ is not None:
+                satisfied &= values <= max_
+        else:
+            satisfied = np.in1d(values, list(condition))
+        mask = satisfied if mask is None else mask & satisfied
+    
+    if mask is None: # no predicates
+        mask = np.ones(len(f.reader.get_dimension('X')[key]), dtype=bool)
+    return mask
+
+def _get_las_record_attribute(f, name, key=slice(None)):
+    """Return attribute `name` of points `key` decoded from raw records."""
+    try:
+        field = _LAS_ATTRIBUTES[name]
+    except KeyError:
+        raise ValueError('Unknown attribute {!r}; must be one of {}'.format(
+                             name, sorted(_LAS_ATTRIBUTES)))
+    raw = f.reader.get_dimension(field)[key]
+    if name == 'return_num':
+        return raw & 0b111
+    elif name == 'num_returns':
+        return (raw >> 3) & 0b111
+    elif name == 'classification':
+        return raw & 0b11111
+    return raw
+
+def _get_las_attribute_names(fpath):
+    """Return the names of per-point attributes stored in .las file."""
     with laspy.file.File(fpath) as f:
-        return [f.x, f.y, f.z]
+        fields = f.point_format.lookup
+    return frozenset(name for name, field in _LAS_ATTRIBUTES.iteritems()
+                     if field in fields)
+
+def _get_las_attribute(fpaths, name, idx=None):
+    """Return array of per-point attribute `name` from .las files.
+    
+    Only the records of points `idx` (indices into the concatenated points
+    of `fpaths`; default: all) are decoded.
+    """
+    order = None
+    if idx is not None and not np.all(idx[1:] >= idx[:-1]):
+        order = np.argsort(idx, kind='mergesort')
+        idx = idx[order]
+    pieces = []
+    offset = 0
+    for fpath in fpaths:
+        with laspy.file.File(fpath) as f:
+            n = len(f.reader.get_dimension('X'))
+            if idx is None:
+                key = slice(None)
+            else:
+                start, end = np.searchsorted(idx, [offset, offset + n])
+                key = idx[start:end] - offset
+            pieces.append(np.array(_get_las_record_attribute(f, name, key)))
+        offset += n
+    arr = np.concatenate(pieces)
+    if order is not None:
+        unsorted = np.empty_like(arr)
+        unsorted[order] = arr
+        arr = unsorted
+    return arr
 
 def _get_las_bounds(fpath):
     """Return the bounds of file at fpath."""
@@ -499,6 +1699,160 @@ def _intersects_3D(A, B):
     return all([_intersects_1D((A[i], A[i+3]), (B[i], B[i+3]))
                 for i in range(3)])
 
+# (shift, mask) steps spreading the bits of an integer to every 2nd/3rd bit
+_MORTON_SPREAD = {2: [(16, 0x0000ffff0000ffff), (8, 0x00ff00ff00ff00ff),
+                      (4, 0x0f0f0f0f0f0f0f0f), (2, 0x3333333333333333),
+                      (1, 0x5555555555555555)],
+                  3: [(32, 0x001f00000000ffff), (16, 0x001f0000ff0000ff),
+                      (8, 0x100f00f00f00f00f), (4, 0x10c30c30c30c30c3),
+                      (2, 0x1249249249249249)]}
+
+def _morton_keys(icoords, bits):
+    """Interleave the bits of integer coordinates to Morton (Z-order) keys.
+    
+    Arguments
+    ---------
+    icoords: `numpy.ndarray` (shape=(ndims, n), dtype=uint64)
+        non-negative integer coordinates in 2 or 3 dimensions
+    bits: int
+        number of low bits of each coordinate to interleave
+        (at most 32 for 2 dimensions, or 21 for 3 dimensions)
+    
+    Returns
+    -------
+    `numpy.ndarray` (shape=(n,), dtype=uint64)
+        keys whose sort order traces a Z-shaped curve through space
+    
+    """
+    ndims = len(icoords)
+    if bits * ndims > 64:
+        raise ValueError('Cannot interleave {} bits in {} dimensions to 64 '
+                         'bit keys'.format(bits, ndims))
+    keys = np.zeros(icoords.shape[1], dtype=np.uint64)
+    for d, coords in enumerate(icoords):
+        spread = coords & np.uint64((1 << bits) - 1)
+        for shift, mask in _MORTON_SPREAD[ndims]:
+            spread = (spread | (spread << np.uint64(shift))) & np.uint64(mask)
+        keys |= spread << np.uint64(d)
+    return keys
+
+def _split_affine(matrix):
+    """Return (3*3) linear part and (3,) translation of an affine `matrix`."""
+    matrix = np.asarray(matrix, dtype=float)
+    if matrix.shape == (4, 4):
+        if not np.array_equal(matrix[3], [0, 0, 0, 1]):
+            raise ValueError('Projective transformations (last row of matrix not '
+                             '(0, 0, 0, 1)) are not supported')
+        matrix = matrix[:3]
+    if matrix.shape == (3, 3):
+        return np.ascontiguousarray(matrix), np.zeros(3)
+    elif matrix.shape == (3, 4):
+        return np.ascontiguousarray(matrix[:, :3]), matrix[:, 3].copy()
+    raise ValueError('Transformation matrix must be of shape (3, 3), (3, 4) or '
+                     '(4, 4), not {}'.format(matrix.shape))
+
+def _transform_bounds(bounds, linear, translation):
+    """Return `bounds` mapped by an affine transformation, if it only scales,
+    flips and swaps axes (i.e. `linear` has one nonzero per row and column),
+    else None."""
+    nonzero = linear != 0
+    if not (np.all(nonzero.sum(axis=0) == 1) and np.all(nonzero.sum(axis=1) == 1)):
+        return None
+    source = nonzero.argmax(axis=1)
+    scale = linear[np.arange(3), source]
+    ends = np.array([np.asarray(bounds[:3])[source], np.asarray(bounds[3:])[source]])
+    ends = ends * scale + translation
+    return Bounds(*np.concatenate([ends.min(axis=0), ends.max(axis=0)]))
+
+def _random_state(seed):
+    """Return generator for `seed` (int, generator, or None for global)."""
+    if seed is None:
+        return np.random.mtrand._rand
+    if isinstance(seed, (int, long, np.integer)):
+        return np.random.RandomState(seed)
+    return seed
+
+def _int_seed(seed):
+    """Return `seed` as an int, drawing one if it is a generator or None (global)."""
+    if isinstance(seed, (int, long, np.integer)):
+        return seed
+    return _random_state(seed).randint(2**31)
+
+def _random_uniform(rs, size):
+    """Return `size` uniform [0, 1) floats from generator `rs`."""
+    sample = getattr(rs, 'random_sample', None) or rs.random
+    return sample(size)
+
+def _sample_indices(npoints, n, rs):
+    """Return `n` distinct random indices below `npoints`, in random order."""
+    if n > npoints // 4:
+        return rs.choice(npoints, n, replace=False)
+    # Draw with replacement, keeping the first occurrence of each index
+    draws = rs.choice(npoints, n + n*n // npoints + 16)
+    while True:
+        _, first = np.unique(draws, return_index=True)
+        if len(first) >= n:
+            return draws[np.sort(first)[:n]]
+        draws = np.append(draws, rs.choice(npoints, n - len(first) + 16))
+
+def _hash_keys(arr, seed, tolerance=2.5e-4):
+    """Return a pseudo-random uint64 key for each point of (3*n) `arr`.
+    
+    Keys depend only on the coordinates (quantised to `tolerance`) and `seed`
+    so, unlike random draws, they do not depend on the points' order or the
+    pointcloud holding them.
+    """
+    keys = _mix64(np.full(arr.shape[1], seed, dtype=np.uint64))
+    for coords in arr:
+        icoords = np.round(coords / tolerance).astype(np.int64).view(np.uint64)
+        keys = _mix64(keys ^ icoords)
+    return keys
+
+def _mix64(x):
+    """Scramble uint64 array `x` (the SplitMix64 finaliser)."""
+    x = x ^ (x >> np.uint64(30))
+    x = x * np.uint64(0xbf58476d1ce4e5b9)
+    x = x ^ (x >> np.uint64(27))
+    x = x * np.uint64(0x94d049bb133111eb)
+    return x ^ (x >> np.uint64(31))
+
+def _thin_to_density(arr, density, cell_size, seed):
+    """Thin (3*n) `arr` to a density of points per xy cell.
+    
+    Returns
+    -------
+    idx: `numpy.ndarray` (dtype=int)
+        sorted indices of points kept
+    cells: `numpy.ndarray` (shape=(2, len(idx)), dtype=int64)
+        (ix, iy) cell of each point kept
+    keys: `numpy.ndarray` (dtype=uint64)
+        random key of each point kept
+    """
+    cells = np.floor(arr[:2] / cell_size).astype(np.int64)
+    keys = _hash_keys(arr, seed)
+    idx = np.sort(_first_per_cell(cells, keys, density * cell_size**2, seed))
+    return idx, cells[:, idx], keys[idx]
+
+def _first_per_cell(cells, keys, per_cell, seed):
+    """Return indices of the points of lowest `keys` in each of (2*n) `cells`.
+    
+    Each cell keeps floor(`per_cell`) points, plus one more with probability
+    of the fractional part of `per_cell` (decided by hashing the cell).
+    """
+    if not len(keys):
+        return np.empty(0, dtype=np.intp)
+    order = np.lexsort((keys, cells[1], cells[0]))
+    cells = cells[:, order]
+    starts = _group_starts(cells)
+    counts = np.diff(np.append(starts, len(order)))
+    ranks = np.arange(len(order)) - np.repeat(starts, counts)
+    caps = np.full(len(starts), int(np.floor(per_cell)), dtype=np.int64)
+    fraction = per_cell - np.floor(per_cell)
+    if fraction:
+        rand = _hash_keys(cells[:, starts].astype(float), seed, tolerance=1.) / 2.**64
+        caps += rand < fraction
+    return order[ranks < np.repeat(caps, counts)]
+
 def _iter_points_out_of_bounds(pc, bounds):
     """Iteratively determine point coordinates outside of bounds.
 
@@ -523,7 +1877,7 @@ def _iter_points_out_of_bounds(pc, bounds):
     Comparisons to `None` are skipped (generator will be empty if all bounds
     are `None`)
     """
-    for i, axis_coords in enumerate(pc.arr):
+    for i, axis_coords in enumerate(getattr(pc, 'arr', pc)):
         for compare, bound in zip((np.less, np.greater_equal),
                                   (bounds[i], bounds[i+3])):
             if bound is not None:
@@ -534,7 +1888,7 @@ def points_out_of_bounds(pc, bounds):
     
     Arguments
     ---------
-    pc: `PointCloud` instance
+    pc: `PointCloud` instance (or (3*n) array of point coordinates)
     bounds: `Bounds`
         (minx, miny, minz, maxx, maxy, maxz) to test point coordinates against
     
@@ -545,7 +1899,7 @@ def points_out_of_bounds(pc, bounds):
         coordinates in `pc` are outside of the specified `bounds`
     
     """
-    oob = np.zeros(len(pc), dtype=bool)
+    oob = np.zeros(getattr(pc, 'arr', pc).shape[1], dtype=bool)
     for comparison in _iter_points_out_of_bounds(pc, bounds):
         oob = np.logical_or(comparison, oob)
     return oob
@@ -585,21 +1939,42 @@ def merge_bounds(ibounds):
     """
     # Coerce Nones to Infs
     all_bounds = [InfBounds(*bounds) for bounds in ibounds]
+    if not all_bounds:
+        raise ValueError('No bounds to merge')
     
     # Extract mins/maxs of axes
     all_bounds = np.array(all_bounds)
     return Bounds(all_bounds[:,0].min(), all_bounds[:,1].min(), all_bounds[:,2].min(),
                   all_bounds[:,3].max(), all_bounds[:,4].max(), all_bounds[:,5].max())
 
+def _group_starts(*keys):
+    """Return indices at which runs of equal values start in sorted `keys`.
+    
+    Each of `keys` is a 1D array, or a 2D array with a row per component of
+    the key (e.g. (3*n) coordinates); a new run starts wherever any changes.
+    """
+    n = np.shape(keys[0])[-1]
+    if not n:
+        return np.empty(0, dtype=np.intp)
+    change = np.zeros(n - 1, dtype=bool)
+    for k in keys:
+        k = np.asarray(k)
+        differs = k[..., 1:] != k[..., :-1]
+        change |= differs.any(axis=0) if differs.ndim == 2 else differs
+    return np.concatenate([[0], np.flatnonzero(change) + 1])
+
 """PointCloud manipulation"""
 
-def merge(pointclouds, pctype=PointCloud):
+def merge(pointclouds, pctype=PointCloud, deduplicate=None):
     """Return `pointclouds` merged to a single instance of `pctype`.
     
     Arguments
     ---------
     pointclouds: sequence of `PointCloud` (or subclass)
     pctype: type of pointcloud to return (default=`PointCloud`)
+    deduplicate: float (optional)
+        tolerance with which to remove duplicate points (e.g. where flight
+        lines overlap) once merged (see `PointCloud.deduplicate`)
     
     Returns
     -------
@@ -616,4 +1991,8 @@ def merge(pointclouds, pctype=PointCloud):
         j = i + size
         arr[:,i:j] = pc.arr
         i = j
-    return pctype(arr)
+    attrs = Attributes.concatenate([pc.attrs for pc in pointclouds])
+    pc = pctype._from_arr(arr, attrs=attrs)
+    if deduplicate is not None:
+        pc = pc.deduplicate(deduplicate)
+    return pc
@@ -0,0 +1,163 @@
+"""
+raster
+
+Rasterise pointclouds to per-cell statistics of z (e.g. canopy height models).
+"""
+import numpy as np
+import simulocloud.pointcloud
+import simulocloud.tiles
+import simulocloud.exceptions
+
+# Statistics which can be accumulated cell by cell across pointclouds
+_STATS = ('count', 'min', 'max', 'sum', 'mean')
+
+def rasterize(pcs, cellsize=None, edges=None, stats=('count', 'min', 'max', 'mean')):
+    """Compute statistics of the z of points falling in each cell of a 2D grid.
+
+    Arguments
+    ---------
+    pcs: `PointCloud`, sequence of `PointCloud` or `simulocloud.tiles.TilesGrid`
+        points to rasterise; the points of multiple pointclouds (or tiles)
+        are pooled, so there are no seams where cells straddle them
+    cellsize: float or (float, float) (optional)
+        size of square (or (x, y) sized) raster cells
+        cells are aligned to multiples of `cellsize`, so that rasters of
+        neighbouring areas line up
+    edges: (sequence of float, sequence of float) (optional)
+        sorted x and y coordinates of the edges between cells
+        if neither `cellsize` nor `edges` are given for a `TilesGrid`, the
+        x and y edges of the grid are used (i.e. one cell per column of tiles)
+    stats: sequence of str
+        statistics to compute, any of 'count', 'min', 'max', 'sum', 'mean' and
+        percentiles specified as 'p' followed by a number, e.g. 'p95'
+
+    Returns
+    -------
+    raster: `numpy.ndarray` (shape=(nx, ny), structured)
+        with a field per statistic in `stats`, indexed by cell such that
+        `raster[ix, iy]` describes the cell between `xedges[ix:ix+2]` and
+        `yedges[iy:iy+2]` (`nan` where cells contain no points)
+    xedges, yedges: `numpy.ndarray`
+        coordinates of the edges of the raster cells
+
+    Notes
+    -----
+    Cells are lower-inclusive and upper-exclusive, like cropping; points
+    outside `edges` are ignored. All statistics bar percentiles are
+    accumulated pointcloud by pointcloud with `numpy.bincount` and sorted
+    `reduceat`s; percentiles require the cell and z of every point to be held
+    until all pointclouds have been read, then sorted once.
+
+    """
+    stats = list(stats)
+    percentiles = [stat for stat in stats if stat not in _STATS]
+    try:
+        qs = [float(stat[1:]) for stat in percentiles if stat[0] == 'p']
+    except ValueError:
+        qs = []
+    if len(qs) != len(percentiles):
+        raise ValueError('Unknown statistics {}'.format(percentiles))
+
+    grid = pcs if isinstance(pcs, simulocloud.tiles.TilesGrid) else None
+    if grid is not None:
+        pcs = list(grid.tiles.flat)
+    elif isinstance(pcs, simulocloud.pointcloud.PointCloud):
+        pcs = [pcs]
+    else:
+        pcs = list(pcs)
+    xedges, yedges = _raster_edges(pcs, grid, cellsize, edges)
+    shape = (len(xedges)-1, len(yedges)-1)
+    size = shape[0]*shape[1]
+
+    # Accumulate statistics pointcloud by pointcloud
+    count = np.zeros(size, dtype=np.int64)
+    sum_ = np.zeros(size)
+    min_ = np.full(size, np.inf)
+    max_ = np.full(size, -np.inf)
+    gathered = []
+    for pc in pcs:
+        icells, z = _locate_cells(pc, xedges, yedges)
+        count += np.bincount(icells, minlength=size)
+        sum_ += np.bincount(icells, weights=z, minlength=size)
+        if percentiles:
+            gathered.append((icells, z))
+        elif {'min', 'max'}.intersection(stats) and len(icells):
+            order = np.argsort(icells, kind='mergesort')
+            icells, z = icells[order], z[order]
+            starts = simulocloud.pointcloud._group_starts(icells)
+            cells = icells[starts]
+            min_[cells] = np.fmin(min_[cells], np.minimum.reduceat(z, starts))
+            max_[cells] = np.fmax(max_[cells], np.maximum.reduceat(z, starts))
+
+    # Sort all z by cell for percentiles (and, in passing, min and max)
+    if percentiles:
+        icells, z = [np.concatenate(arrs) for arrs in zip(*gathered)] or [
+                         np.empty(0, dtype=np.intp), np.empty(0)]
+        del gathered
+        order = np.lexsort((z, icells))
+        icells, z = icells[order], z[order]
+        starts = simulocloud.pointcloud._group_starts(icells)
+        cells = icells[starts]
+        ends = np.append(starts[1:], len(z)) - 1
+        min_[cells], max_[cells] = z[starts], z[ends]
+
+    # Gather statistics into raster
+    raster = np.empty(size, dtype=[(stat, np.float64) for stat in stats])
+    empty = count == 0
+    values = {'count': count, 'sum': sum_, 'min': min_, 'max': max_,
+              'mean': sum_ / np.where(empty, 1, count)}
+    for stat in stats:
+        if stat in values:
+            raster[stat] = values[stat]
+            if stat != 'count':
+                raster[stat][empty] = np.nan
+    for stat, q in zip(percentiles, qs):
+        raster[stat] = np.nan
+        if len(z):
+            raster[stat][cells] = _sorted_percentile(z, starts, ends, q)
+
+    return raster.reshape(shape), xedges, yedges
+
+def _raster_edges(pcs, grid, cellsize, edges):
+    """Determine x and y edges of raster cells (see `rasterize`)."""
+    if edges is not None:
+        return tuple(np.asarray(axis_edges, dtype=float) for axis_edges in edges)
+
+    if cellsize is None:
+        if grid is None:
+            raise TypeError('Either `cellsize` or `edges` must be specified')
+        return grid.edges[:,0,0,0], grid.edges[0,:,0,1]
+
+    if grid is not None:
+        bounds = grid.bounds
+    else:
+        nonempty = [pc.bounds for pc in pcs if len(pc)]
+        if not nonempty:
+            raise simulocloud.exceptions.EmptyPointCloud(
+                      'Raster edges of empty pointclouds must be specified')
+        bounds = simulocloud.pointcloud.merge_bounds(nonempty)
+    edges = []
+    for axis, size in zip('xy', np.broadcast_to(cellsize, (2,))):
+        min_, max_ = simulocloud.pointcloud.axis_bounds(bounds, axis)
+        start = np.floor(min_ / size)
+        n = int(np.floor(max_ / size) - start) + 1
+        edges.append((start + np.arange(n+1)) * size)
+    return tuple(edges)
+
+def _locate_cells(pc, xedges, yedges):
+    """Return flat index of raster cell and z of each point within edges."""
+    ix = np.searchsorted(xedges, pc.x, side='right') - 1
+    iy = np.searchsorted(yedges, pc.y, side='right') - 1
+    nx, ny = len(xedges)-1, len(yedges)-1
+    inside = (ix >= 0) & (ix < nx) & (iy >= 0) & (iy < ny)
+    return (ix*ny + iy)[inside], pc.z[inside]
+
+def _sorted_percentile(a, starts, ends, q):
+    """Return (linearly interpolated) qth percentile of sorted runs in `a`.
+
+    Equivalent to `numpy.percentile(a[start:end+1], q)` for each run.
+    """
+    pos = starts + (ends - starts) * (q / 100.)
+    lo = np.floor(pos).astype(np.intp)
+    hi = np.ceil(pos).astype(np.intp)
+    return a[lo] + (a[hi] - a[lo]) * (pos - lo)
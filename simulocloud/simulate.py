@@ -0,0 +1,312 @@
+"""
+simulate
+
+Simulate airborne lidar scanning of scenes to produce pointclouds.
+"""
+import numpy as np
+import collections
+import multiprocessing
+import simulocloud.pointcloud
+import simulocloud.voxels
+
+class ScanPattern(collections.namedtuple('ScanPattern', ['scan_angle', 'pulse_rate',
+                                                         'scan_rate', 'footprint'])):
+    """Parameters of an oscillating mirror lidar scanner.
+
+    Attributes
+    ----------
+    scan_angle: float
+        maximum angle (degrees) of pulses from nadir, to either side of track
+    pulse_rate: float
+        number of pulses emitted per second
+    scan_rate: float
+        number of scan lines (sweeps from one side to the other) per second
+    footprint: float
+        diameter of the beam where it meets the scene; detail smaller than
+        the footprint is not resolved, so it is the default voxel size of
+        scenes made from pointclouds
+    """
+    __slots__ = ()
+
+class Scene(collections.namedtuple('Scene', ['keys', 'occupancy', 'centroids',
+                                             'origin', 'size', 'shape'])):
+    """Voxelised target scene, storing only occupied voxels.
+
+    Attributes
+    ----------
+    keys: `numpy.ndarray` (dtype=int64)
+        sorted flat indices (see `numpy.ravel_multi_index`) of occupied voxels
+    occupancy: `numpy.ndarray`
+        fraction (0-1] of the energy of a pulse intercepted by each voxel
+    centroids: `numpy.ndarray` (shape=(n, 3))
+        (x, y, z) of the surface in each voxel, at which returns are placed
+    origin: `numpy.ndarray`
+        (x, y, z) of the lower corner of the voxel grid
+    size: float
+        length of the edges of (cubic) voxels
+    shape: tuple of int
+        (nx, ny, nz) number of voxels in each axis
+    """
+    __slots__ = ()
+
+    @classmethod
+    def from_pointcloud(cls, pc, size, saturation=4.):
+        """Voxelise the points of a pointcloud.
+
+        Arguments
+        ---------
+        pc: `simulocloud.pointcloud.PointCloud`
+            points of surfaces (e.g. a previous scan) making up the scene
+        size: float
+            voxel edge length
+        saturation: float (default: 4.)
+            number of points in a voxel at which it intercepts 1-1/e (63%) of
+            the energy of pulses, such that occupancy = 1 - exp(-n/saturation)
+
+        Returns
+        -------
+        `Scene`
+            with returns placed at the centroid of the points in each voxel
+        """
+        arr = pc.arr.T
+        origin = arr.min(axis=0)
+        shape = tuple(np.floor((arr.max(axis=0) - origin) / size).astype(int) + 1)
+        ijk = np.floor((arr - origin) / size).astype(np.int64)
+        keys, inverse, counts = np.unique(np.ravel_multi_index(ijk.T, shape),
+                                          return_inverse=True, return_counts=True)
+        centroids = np.stack([np.bincount(inverse, weights=coords) / counts
+                              for coords in arr.T], axis=1)
+        occupancy = 1. - np.exp(-counts / float(saturation))
+        return cls(keys, occupancy, centroids, origin, float(size), shape)
+
+    @classmethod
+    def from_occupancy(cls, occupancy, origin, size):
+        """Initialise from a dense grid of voxel occupancies.
+
+        Arguments
+        ---------
+        occupancy: `numpy.ndarray` (ndim=3)
+            fraction (0-1) of pulse energy intercepted by each voxel, indexed
+            by (ix, iy, iz); voxels of occupancy 0 are empty
+        origin: sequence of float
+            (x, y, z) of the lower corner of the grid
+        size: float
+            voxel edge length
+
+        Returns
+        -------
+        `Scene`
+            with returns placed at the centre of each voxel
+        """
+        occupancy = np.asarray(occupancy, dtype=float)
+        keys = np.flatnonzero(occupancy)
+        origin = np.asarray(origin, dtype=float)
+        ijk = np.stack(np.unravel_index(keys, occupancy.shape), axis=1)
+        centroids = origin + (ijk + .5) * size
+        return cls(keys.astype(np.int64), occupancy.ravel()[keys], centroids,
+                   origin, float(size), occupancy.shape)
+
+    @classmethod
+    def from_voxels(cls, voxels):
+        """Initialise from counts of hits and passes of a previous scan.
+
+        Arguments
+        ---------
+        voxels: `simulocloud.voxels.SparseVoxels` or `simulocloud.voxels.DenseVoxels`
+            counts of points in, and rays through, voxels (see
+            `simulocloud.voxels.voxelise`)
+
+        Returns
+        -------
+        `Scene`
+            with occupancy the fraction of rays entering each voxel which hit
+            it, and returns placed at the centre of each voxel
+        """
+        voxels = voxels.to_dense()
+        occupancy = np.where(voxels.hits > 0, 1. - np.nan_to_num(voxels.transmittance()), 0.)
+        return cls.from_occupancy(occupancy, voxels.origin * voxels.size, voxels.size)
+
+    @property
+    def bounds(self):
+        """Return `Bounds` of the voxel grid."""
+        upper = self.origin + np.array(self.shape) * self.size
+        return simulocloud.pointcloud.Bounds(*np.concatenate([self.origin, upper]))
+
+    def lookup(self, ijk):
+        """Return index (into `keys` etc.) of voxels at (n*3) `ijk`, or -1 if empty."""
+        keys = np.ravel_multi_index(ijk.T, self.shape)
+        if not len(self.keys):
+            return np.full(len(keys), -1, dtype=np.intp)
+        idx = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+        return np.where(self.keys[idx] == keys, idx, -1)
+
+def simulate(scene, trajectory, pattern, speed=50., max_returns=4, min_energy=0.05,
+             workers=1, batchsize=2**18, pctype=simulocloud.pointcloud.PointCloud):
+    """Simulate scanning of a scene by a lidar flown along a trajectory.
+
+    Arguments
+    ---------
+    scene: `Scene` or `simulocloud.pointcloud.PointCloud`
+        target scene; pointclouds are voxelised at `pattern.footprint`
+    trajectory: `numpy.ndarray` (shape=(3, m))
+        (x, y, z) waypoints of the sensor, flown in straight lines
+    pattern: `ScanPattern`
+        scanner parameters
+    speed: float (default: 50.)
+        speed (m/s) of the sensor along the trajectory
+    max_returns: int (default: 4)
+        maximum number of returns recorded per pulse
+    min_energy: float (default: 0.05)
+        fraction of a pulse's energy which a voxel must intercept for a
+        return to be recorded; pulses with less energy remaining stop
+    workers: int (default: 1)
+        number of processes between which batches of pulses (each within a
+        single segment of the trajectory) are divided
+    batchsize: int
+        number of pulses cast through the scene at once
+    pctype: subclass of `simulocloud.pointcloud.PointCloud`
+        type of pointcloud to return
+
+    Returns
+    -------
+    instance of `pctype`
+        returns, ordered by pulse then return, with attributes 'gps_time'
+        (time since the start of the trajectory), 'return_num',
+        'num_returns' and 'intensity' (energy intercepted, scaled to 0-65535)
+
+    Notes
+    -----
+    Pulses are cast in batches, all stepping through the voxels of the scene
+    together (Amanatides & Woo traversal, vectorised across pulses). Each
+    occupied voxel intercepts its `occupancy` of the pulse's remaining energy,
+    and later returns are recorded until the pulse is spent, leaves the
+    scene or has made `max_returns` returns. Surfaces are taken to be
+    horizontal at the height of each voxel's centroid, so returns are placed
+    where pulses cross that height within the voxel.
+
+    """
+    if isinstance(scene, simulocloud.pointcloud.PointCloud):
+        scene = Scene.from_pointcloud(scene, pattern.footprint)
+    waypoints = np.asarray(trajectory, dtype=float).T
+    lengths = np.linalg.norm(np.diff(waypoints, axis=0), axis=1)
+    times = np.concatenate([[0.], np.cumsum(lengths) / speed])
+
+    # Divide pulses into batches within segments of the trajectory
+    jobs = []
+    for start, end, t0, t1 in zip(waypoints[:-1], waypoints[1:], times[:-1], times[1:]):
+        first, stop = [int(np.ceil(t * pattern.pulse_rate)) for t in (t0, t1)]
+        for i in xrange(first, stop, batchsize):
+            jobs.append((start, end, t0, speed, pattern, i, min(i + batchsize, stop),
+                         max_returns, min_energy))
+
+    if workers == 1:
+        results = [_simulate_batch(scene, job) for job in jobs]
+    else:
+        pool = multiprocessing.Pool(workers, initializer=_set_scene, initargs=(scene,))
+        try:
+            results = pool.map(_simulate_pooled_batch, jobs, chunksize=1)
+        except:
+            pool.terminate()
+            raise
+        else:
+            pool.close()
+        finally:
+            pool.join()
+
+    if not results:
+        return pctype(None)
+    arrs, attrs = zip(*results)
+    attrs = {name: np.concatenate([batch[name] for batch in attrs]) for name in attrs[0]}
+    return pctype._from_arr(np.concatenate(arrs, axis=1), attrs=attrs)
+
+_SCENE = None # scene of worker processes (see `simulate`)
+
+def _set_scene(scene):
+    """Store the scene of a worker process, so it is not pickled per batch."""
+    global _SCENE
+    _SCENE = scene
+
+def _simulate_pooled_batch(job):
+    """Simulate a batch of pulses of a worker process (see `simulate`)."""
+    return _simulate_batch(_SCENE, job)
+
+def _simulate_batch(scene, job):
+    """Return (3*n) returns and attributes of a batch of pulses along a segment."""
+    start, end, t0, speed, pattern, first, stop, max_returns, min_energy = job
+    t = np.arange(first, stop) / float(pattern.pulse_rate)
+    origins, dirs = _pulses(start, end, t0, speed, pattern, t)
+    rays, points, return_num, energy = _cast(scene, origins, dirs, max_returns, min_energy)
+    attrs = {'gps_time': t[rays],
+             'return_num': return_num.astype(np.uint8),
+             'num_returns': np.bincount(rays, minlength=len(t))[rays].astype(np.uint8),
+             'intensity': np.round(energy * 65535).astype(np.uint16)}
+    return points.T, attrs
+
+def _pulses(start, end, t0, speed, pattern, t):
+    """Return (n*3) origins and unit directions of pulses at times `t` along a segment.
+
+    The mirror sweeps the pulses across track (a triangular wave in angle),
+    completing a scan line every 1/`pattern.scan_rate` seconds.
+    """
+    heading = (end - start) / np.linalg.norm(end - start)
+    origins = start + heading * ((t - t0) * speed)[:, None]
+    across = np.cross(heading, [0., 0., 1.])
+    across /= np.linalg.norm(across) or 1.
+    phase = (t * pattern.scan_rate / 2.) % 1.
+    angle = np.radians(pattern.scan_angle) * (1. - 4. * np.abs(phase - .5))
+    dirs = np.sin(angle)[:, None] * across + np.cos(angle)[:, None] * [0., 0., -1.]
+    return origins, dirs
+
+def _cast(scene, origins, dirs, max_returns, min_energy):
+    """Cast rays through the voxels of a scene.
+
+    Returns
+    -------
+    rays: `numpy.ndarray` (dtype=int)
+        index of the ray of each return
+    points: `numpy.ndarray` (shape=(n, 3))
+        position of each return
+    return_num: `numpy.ndarray` (dtype=int)
+        number (from 1) of each return of its ray
+    energy: `numpy.ndarray`
+        fraction of the ray's energy intercepted by each return
+    """
+    traversal = simulocloud.voxels.Traversal(origins, dirs, scene.origin, scene.size, scene.shape)
+    ray_ids = traversal.rays
+    origins, dirs = origins[ray_ids], dirs[ray_ids]
+    energy = np.ones(len(ray_ids))
+    nreturns = np.zeros(len(ray_ids), dtype=np.int64)
+
+    returns = []
+    while len(traversal.active):
+        active = traversal.active
+        t_in, t_out = traversal.t_in[active], traversal.t_out()
+
+        # Record returns from occupied voxels
+        voxels = scene.lookup(traversal.ijk[active])
+        occupied = voxels >= 0
+        if occupied.any():
+            hit, voxels = active[occupied], voxels[occupied]
+            intercepted = energy[hit] * scene.occupancy[voxels]
+            energy[hit] -= intercepted
+            returned = intercepted >= min_energy
+            hit, voxels, intercepted = hit[returned], voxels[returned], intercepted[returned]
+            # Place return where the ray crosses the height of the voxel's
+            # surface (or passes closest to it, for horizontal rays)
+            offsets = scene.centroids[voxels] - origins[hit]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                t = np.where(dirs[hit, 2] != 0, offsets[:, 2] / dirs[hit, 2],
+                             np.einsum('ij,ij->i', offsets, dirs[hit]))
+            t = np.clip(t, t_in[occupied][returned], t_out[occupied][returned])
+            nreturns[hit] += 1
+            returns.append((hit, origins[hit] + dirs[hit] * t[:, None],
+                            nreturns[hit], intercepted))
+
+        traversal.step((energy[active] >= min_energy) & (nreturns[active] < max_returns))
+
+    if not returns:
+        return (np.empty(0, dtype=np.intp), np.empty((0, 3)),
+                np.empty(0, dtype=np.int64), np.empty(0))
+    hit, points, return_num, intercepted = [np.concatenate(a) for a in zip(*returns)]
+    order = np.lexsort((return_num, hit))
+    return ray_ids[hit[order]], points[order], return_num[order], intercepted[order]
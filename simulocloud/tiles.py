@@ -2,17 +2,84 @@
 tiles
 """
 import numpy as np
+import collections
 import itertools
+import multiprocessing
+import tempfile
+import shutil
+import os
 import simulocloud.pointcloud
 import simulocloud.exceptions
 
+# Per-tile statistics recorded by `TilesGrid.summaries`
+_SUMMARY_DTYPE = ([('count', np.int64)] +
+                  [(b, np.float64) for b in simulocloud.pointcloud.Bounds._fields])
+
 class Tile(simulocloud.pointcloud.PointCloud):
     """An immmutable pointcloud."""
-    def __init__(self, xyz, header=None):
+    _shared_mode = 'r'
+    _caches_bounds = True
+    
+    def __init__(self, xyz, header=None, attrs=None):
         """See documentation for `simulocloud.pointcloud.Pointcloud`."""
-        super(Tile, self).__init__(xyz, header)
+        super(Tile, self).__init__(xyz, header, attrs)
         self._arr.flags.writeable = False
     
+    @classmethod
+    def _from_arr(cls, arr, header=None, attrs=None):
+        """See documentation for `simulocloud.pointcloud.Pointcloud._from_arr`."""
+        tile = super(Tile, cls)._from_arr(arr, header, attrs)
+        tile._arr.flags.writeable = False
+        return tile
+
+    @classmethod
+    def _from_file(cls, source, bounds):
+        """Initialise tile whose points are memory-mapped from `source` (a `_TileFile`) when needed."""
+        tile = cls.__new__(cls)
+        tile._source = source
+        tile._attrs = simulocloud.pointcloud.Attributes.from_None(source.count)
+        tile._morton = None
+        tile._bounds = bounds
+        return tile
+
+    @classmethod
+    def _from_pieces(cls, pieces):
+        """Initialise tile of the points of non-empty pointclouds `pieces`, merged when needed."""
+        bounds = simulocloud.pointcloud.merge_bounds([pc.bounds for pc in pieces])
+        tile = cls._from_file(_TilePieces(tuple(pieces)), bounds)
+        tile._attrs = simulocloud.pointcloud.Attributes.concatenate([pc.attrs for pc in pieces])
+        return tile
+
+    def __setstate__(self, state):
+        """Restore unpickled tile, keeping its array read-only."""
+        self.__dict__.update(state)
+        if '_arr' in state:
+            self._arr.flags.writeable = False
+
+    def __len__(self):
+        """Number of points in tile (without mapping them from file)."""
+        try:
+            return self.__dict__['_arr'].shape[1]
+        except KeyError:
+            return self._source.count
+
+    @property
+    def _arr(self):
+        """(3*n) array of points, mapped from file (or merged from pieces) on first access."""
+        try:
+            return self.__dict__['_arr']
+        except KeyError:
+            arr = self._source.load()
+            arr.flags.writeable = False
+            self.__dict__['_arr'] = arr
+            if isinstance(self._source, _TilePieces):
+                self._source = None # release pieces once merged
+            return arr
+
+    @_arr.setter
+    def _arr(self, value):
+        self.__dict__['_arr'] = value
+
     @property
     def arr(self):
         """Get, but not set, the underlying (x, y, z) array of point coordinates."""
@@ -22,6 +89,43 @@ class Tile(simulocloud.pointcloud.PointCloud):
     def arr(self, value):
         raise simulocloud.exceptions.TileException("Tile pointcloud cannot be modified")
 
+    @property
+    def bounds(self):
+        """See documentation for `simulocloud.pointcloud.Pointcloud.bounds`.
+        
+        As tiles are immutable, bounds are only calculated once (if not
+        seeded when read, see `from_las`' `trust_header`).
+        """
+        try:
+            return self._bounds
+        except AttributeError:
+            self._bounds = super(Tile, self).bounds
+            return self._bounds
+
+class _TileFile(collections.namedtuple('_TileFile', ['directory', 'fname', 'count'])):
+    """Points of a tile stored in a file of a directory (an `_OwnedPath`, removed
+    along with the last tile referring to it, if owned)."""
+    __slots__ = ()
+
+    def load(self):
+        """Return (3*n) array of points memory-mapped from file."""
+        arr = np.memmap(os.path.join(self.directory.path, self.fname),
+                        dtype=simulocloud.pointcloud._DTYPE, mode='r', shape=(self.count, 3))
+        return np.asarray(arr).T
+
+class _TilePieces(collections.namedtuple('_TilePieces', ['pieces'])):
+    """Points of a tile held as pointclouds yet to be merged (see `TilesGrid.insert`)."""
+    __slots__ = ()
+
+    @property
+    def count(self):
+        """Number of points in pieces."""
+        return sum(len(pc) for pc in self.pieces)
+
+    def load(self):
+        """Return (3*n) array of points of pieces, merged."""
+        return np.concatenate([pc.arr for pc in self.pieces], axis=1)
+
 class TilesGrid(object):
     """Container for grid of tiles described spatially by edges grid.
     
@@ -50,8 +154,9 @@ class TilesGrid(object):
     - negative steps (reverse slicing) is unsupported
     
     Subsetting produces views into, not copies of, the `tiles` and `edge` grid
-    arrays of the parent. This makes subsetting a light operation, but care
-    must be taken not to modify these attributes.
+    arrays of the parent, and of its (cached) `summaries`. This makes
+    subsetting a light operation, but care must be taken not to modify these
+    attributes.
     
     """
     def __init__(self, tiles, edges, validate=True):
@@ -71,6 +176,7 @@ class TilesGrid(object):
         """
         self.tiles = tiles
         self.edges = edges
+        self._summaries = _unsummarised(tiles.shape)
         if validate:
             if not self.validate():
                 msg = "Tiles do not fit into edges grid"
@@ -114,7 +220,9 @@ class TilesGrid(object):
                 else slice(sl.start, sl.stop) # dont create edges where no tiles
                 for sl in key_]
         
-        return type(self)(self.tiles[key_], self.edges[ekey], validate=False)
+        subset = type(self)(self.tiles[key_], self.edges[ekey], validate=False)
+        subset._summaries = self._summaries[tuple(key_)]
+        return subset
 
     def __iter__(self):
         """Iterate over the tiles array."""
@@ -128,6 +236,533 @@ class TilesGrid(object):
         """Return True if there are any tiles."""
         return bool(len(self))
 
+    def insert(self, pcs, deduplicate=None):
+        """Add the points of new pointclouds to the tiles of the grid, in place.
+        
+        Arguments
+        ---------
+        pcs: seq of `simulocloud.pointcloud.PointCloud`
+            pointclouds (e.g. new flight lines) to insert
+        deduplicate: float (optional)
+            tolerance with which to remove duplicate points from each tile
+            into which points are inserted (see `PointCloud.deduplicate`)
+        
+        Notes
+        -----
+        Points are located by the existing `edges` (see `locate`), and points
+        outside of the grid are ignored. Only tiles receiving points are
+        replaced (by new tiles of the same type), and cached `summaries` are
+        updated for those tiles alone.
+        
+        Inserted points are appended lazily to tiles of type `Tile`: each is
+        replaced by a tile holding the existing points and those inserted as
+        pieces, which are only merged when its points are first accessed, so
+        inserting costs only the number of points inserted. Deduplicating,
+        or inserting into tiles of other types, merges each tile receiving
+        points immediately, at a cost of the size of the tiles.
+        
+        As subsets share their parent's `tiles` array and `summaries`,
+        inserting into a subset also inserts into, and updates the summaries
+        of, the parent grid (and vice versa).
+        
+        """
+        shape = self.shape
+        summaries = self._summaries
+        for i, pieces in enumerate(_route_points(pcs, self.edges)):
+            if not pieces:
+                continue
+            index = np.unravel_index(i, shape)
+            tile = self.tiles[index]
+            new = simulocloud.pointcloud.merge(pieces)
+            if deduplicate is None and isinstance(tile, Tile):
+                source = getattr(tile, '_source', None)
+                if isinstance(source, _TilePieces) and '_arr' not in tile.__dict__:
+                    pieces = source.pieces + (new,) # not yet merged
+                else:
+                    pieces = (tile, new) if len(tile) else (new,)
+                merged = type(tile)._from_pieces(pieces)
+            else:
+                merged = simulocloud.pointcloud.merge([tile, new], pctype=type(tile))
+                if deduplicate is not None:
+                    merged = merged.deduplicate(deduplicate)
+            self.tiles[index] = merged
+            
+            if summaries['count'][index] >= 0: # else summarised when needed
+                if deduplicate is not None:
+                    tiles = np.empty(1, dtype=object)
+                    tiles[0] = merged
+                    summary = summarise_tiles(tiles)[0]
+                else:
+                    summary = summaries[index]
+                    summary['count'] += len(new)
+                    for b, value in zip(simulocloud.pointcloud.Bounds._fields, new.bounds):
+                        compare = np.fmin if b.startswith('min') else np.fmax
+                        summary[b] = compare(summary[b], value)
+                summaries[index] = summary
+
+    def locate(self, xyz):
+        """Find the indices of the tiles containing points.
+        
+        Arguments
+        ---------
+        xyz: `numpy.ndarray` (shape=(3, n)) or `simulocloud.pointcloud.PointCloud`
+            (x, y, z) coordinates of points (e.g. plot centres)
+        
+        Returns
+        -------
+        ix, iy, iz: `numpy.ndarray` (shape=(n,), dtype=int)
+            indices into `tiles` of the tile containing each point, or -1 if
+            the point is outside of the grid
+        
+        Notes
+        -----
+        Tiles are lower-inclusive and upper-exclusive, exactly as points are
+        assigned to tiles by `grid_pointclouds`, which shares this kernel.
+        
+        """
+        arr = np.asarray(getattr(xyz, 'arr', xyz), dtype=simulocloud.pointcloud._DTYPE)
+        return _locate(arr.reshape(3, -1), self.edges)
+
+    def select(self, bounds):
+        """Return the subset of tiles whose edges intersect `bounds`.
+        
+        Arguments
+        ---------
+        bounds: `Bounds` or similiar
+            (minx, miny, minz, maxx, maxy, maxz) bounds of area to select
+            None results in no selection at that bound
+        
+        Returns
+        -------
+        `TilesGrid` instance
+            contiguous subset (see Subsetting) containing every tile which
+            may contain points within `bounds`
+        
+        Notes
+        -----
+        Index ranges are found by binary search of the (sorted) edges in
+        each axis, so no tiles are inspected.
+        
+        """
+        bounds = simulocloud.pointcloud.InfBounds(*bounds)
+        key = []
+        for axis, axis_edges in enumerate(self._axis_edges()):
+            n = len(axis_edges) - 1
+            min_, max_ = bounds[axis], bounds[axis+3]
+            start = max(np.searchsorted(axis_edges, min_, side='right') - 1, 0)
+            stop = min(np.searchsorted(axis_edges, max_, side='left'), n)
+            key.append(slice(min(start, stop), stop))
+        return self[key]
+
+    def crop(self, bounds, pctype=simulocloud.pointcloud.PointCloud, allow_empty=False):
+        """Return the points of the grid within `bounds` as a single pointcloud.
+        
+        Arguments
+        ---------
+        bounds: `Bounds` or similiar
+            (minx, miny, minz, maxx, maxy, maxz) to crop points to
+            (lower-inclusive, upper-exclusive, as `PointCloud.crop`)
+        pctype: subclass of `simulocloud.pointcloud.PointCloud` (optional)
+            type of pointcloud to return
+        allow_empty: bool (default: False)
+            whether to allow an empty pointcloud to be returned or raise
+            `simulocloud.exceptions.EmptyPointCloud`
+        
+        Returns
+        -------
+        instance of `pctype`
+        
+        Notes
+        -----
+        Only tiles within `bounds` are read (see `select`), and only those
+        straddling its edges are cropped; tiles entirely within it are merged
+        whole.
+        
+        """
+        subset = self.select(bounds)
+        ibounds = simulocloud.pointcloud.InfBounds(*bounds)
+        pcs = []
+        for index in np.ndindex(*subset.shape):
+            tile = subset.tiles[index]
+            lower, upper = subset.edges[index], subset.edges[tuple(i+1 for i in index)]
+            if not (np.all(lower >= ibounds[:3]) and np.all(upper <= ibounds[3:])):
+                tile = tile.crop(bounds, allow_empty=True)
+            pcs.append(tile)
+        
+        pc = simulocloud.pointcloud.merge(pcs, pctype=pctype)
+        if not len(pc) and not allow_empty:
+            raise simulocloud.exceptions.EmptyPointCloud(
+                      "No points in crop bounds:\n{}".format(
+                          simulocloud.pointcloud.Bounds(*bounds)))
+        return pc
+
+    def map(self, func, workers=None, args=None):
+        """Apply `func` to each tile in a pool of processes.
+        
+        Arguments
+        ---------
+        func: callable
+            picklable (i.e. module-level) function accepting a single tile
+            (and its element of `args`, if given)
+        workers: int (optional)
+            number of worker processes (default: `multiprocessing.cpu_count()`)
+            if 1, `func` is applied serially in this process
+        args: `numpy.ndarray` (ndim=3, dtype=object) (optional)
+            (picklable) second argument of `func` for each tile, gridded in
+            the same order as `tiles`
+        
+        Returns
+        -------
+        results: `numpy.ndarray` (ndim=3, dtype=object)
+            return values of `func`, gridded in the same order as `tiles`
+        
+        Notes
+        -----
+        Tile arrays are not pickled to the workers: tiles already stored in
+        files (see `from_files`) are memory-mapped from them, and each other
+        tile is written once to a temporary file which the worker memory-maps
+        (see `to_shared`). Tiles are written as the pool takes them, so workers
+        start on the first while the rest are written. Tiles are dispatched
+        largest first, so that big tiles do not straggle at the end.
+        
+        """
+        results = np.empty(self.shape, dtype=object)
+        order = sorted(np.ndindex(*self.shape),
+                       key=lambda index: len(self.tiles[index]), reverse=True)
+        if workers == 1:
+            for index in order:
+                extra = () if args is None else (args[index],)
+                results[index] = func(self.tiles[index], *extra)
+            return results
+        
+        tmpdir = tempfile.mkdtemp(prefix='simulocloud_')
+        handles = [] # kept until workers have mapped their files
+        def jobs():
+            for index in order:
+                tile = self.tiles[index]
+                extra = () if args is None else (args[index],)
+                if isinstance(tile, Tile) and isinstance(getattr(tile, '_source', None), _TileFile):
+                    shared = (tile._source, tile.bounds)
+                else:
+                    shared = tile.to_shared(tmpdir)
+                    handles.append(shared)
+                yield index, func, type(tile), shared, extra
+        
+        try:
+            pool = multiprocessing.Pool(workers)
+            try:
+                for index, result in pool.imap_unordered(_map_tile, jobs()):
+                    results[index] = result
+            except:
+                pool.terminate()
+                raise
+            else:
+                pool.close()
+            finally:
+                pool.join()
+        finally:
+            del handles[:]
+            shutil.rmtree(tmpdir)
+        
+        return results
+
+    def coarsen(self, factors):
+        """Return a grid of larger tiles, each merging a block of adjacent tiles.
+        
+        Arguments
+        ---------
+        factors: dict
+            {axis: factor} number of tiles to merge along each axis
+            (omitted axes are not coarsened); where an axis' number of tiles
+            is not a multiple of its factor, the last block is smaller
+        
+        Returns
+        -------
+        `TilesGrid` instance
+            with `edges` taken from those of this grid
+        
+        Notes
+        -----
+        Each new tile is built by a single `merge` of its block of tiles.
+        Summaries already calculated for a whole block are combined rather
+        than recomputed.
+        
+        """
+        starts = [np.arange(0, n, factors.get(axis, 1))
+                  for axis, n in zip('xyz', self.shape)]
+        stops = [np.append(start[1:], n) for start, n in zip(starts, self.shape)]
+        edges = self.edges[np.ix_(*[np.append(start, n) for start, n in zip(starts, self.shape)])]
+        
+        shape = tuple(len(start) for start in starts)
+        tiles = np.empty(shape, dtype=object)
+        new_summaries = _unsummarised(shape)
+        for index in np.ndindex(*shape):
+            block = tuple(slice(start[i], stop[i]) for start, stop, i in zip(starts, stops, index))
+            pcs = list(self.tiles[block].flat)
+            tiles[index] = simulocloud.pointcloud.merge(pcs, pctype=type(pcs[0]))
+            summary = self._summaries[block]
+            if np.all(summary['count'] >= 0):
+                new_summaries['count'][index] = summary['count'].sum()
+                for b in simulocloud.pointcloud.Bounds._fields:
+                    reduce_ = np.fmin if b.startswith('min') else np.fmax
+                    new_summaries[b][index] = reduce_.reduce(summary[b], axis=None)
+        
+        grid = type(self)(tiles, edges, validate=False)
+        grid._summaries = new_summaries
+        return grid
+
+    def refine(self, factors, workers=1):
+        """Return a grid of smaller tiles, splitting each tile evenly.
+        
+        Arguments
+        ---------
+        factors: dict
+            {axis: factor} number of tiles to split each tile into along each
+            axis (omitted axes are not refined)
+        workers: int or None (default: 1)
+            number of worker processes locating the points of tiles in their
+            new, smaller tiles (see `map`); by default tiles are split in this
+            process, as it is only worth starting a pool for large grids
+        
+        Returns
+        -------
+        `TilesGrid` instance
+            whose edges evenly subdivide those of this grid
+        
+        Notes
+        -----
+        Each tile is split on its own against its share of the finer edges,
+        so no points are compared against any other tile's edges; points on
+        the upper edges of a tile (e.g. the outer edges of the grid) are kept
+        in its last new tiles. Summaries (and bounds) of the new tiles are
+        gathered as they are split, rather than in a later pass.
+        
+        """
+        # Subdivide edges along each axis
+        axes_edges = []
+        for axis, axis_edges in zip('xyz', self._axis_edges()):
+            factor = factors.get(axis, 1)
+            fine = (axis_edges[:-1, None] + np.diff(axis_edges)[:, None] *
+                    np.arange(factor) / float(factor)).ravel()
+            axes_edges.append(np.append(fine, axis_edges[-1:]))
+        edges = np.stack(np.meshgrid(*axes_edges, indexing='ij'), axis=-1)
+        fs = [factors.get(axis, 1) for axis in 'xyz']
+        
+        # Locate points of each tile in its block of finer edges
+        blocks = np.empty(self.shape, dtype=object)
+        for index in np.ndindex(*self.shape):
+            blocks[index] = edges[tuple(slice(i*f, (i+1)*f + 1) for i, f in zip(index, fs))]
+        located = self.map(_sort_by_tile, workers=workers, args=blocks)
+        
+        shape = tuple(n*f for n, f in zip(self.shape, fs))
+        tiles = np.empty(shape, dtype=object)
+        summaries = _unsummarised(shape)
+        for index in np.ndindex(*self.shape):
+            tile = self.tiles[index]
+            order, block_summaries = located[index]
+            counts = block_summaries['count']
+            ends = np.cumsum(counts)
+            for subindex, summary, start, end in zip(np.ndindex(*fs), block_summaries,
+                                                     ends - counts, ends):
+                new_index = tuple(i*f + j for i, f, j in zip(index, fs, subindex))
+                tiles[new_index] = tile._take(order[start:end])
+                summaries[new_index] = summary
+                if end > start and type(tile)._caches_bounds:
+                    tiles[new_index]._bounds = simulocloud.pointcloud.Bounds(*tuple(summary)[1:])
+        
+        grid = type(self)(tiles, edges, validate=False)
+        grid._summaries = summaries
+        return grid
+
+    def thin_to_density(self, density, cell_size=1., seed=None, workers=None):
+        """Thin the points of each tile to at most a density per unit area.
+        
+        Arguments
+        ---------
+        density, cell_size, seed:
+            see `PointCloud.thin_to_density`
+        workers: int (optional)
+            number of worker processes thinning tiles (see `map`)
+        
+        Returns
+        -------
+        `TilesGrid` instance
+            with the same `edges`, holding exactly the points that thinning
+            the merged tiles would keep
+        
+        Notes
+        -----
+        Each tile first keeps its own candidates for each cell (at most the
+        target number per cell), which are all that is returned from workers.
+        The candidates of all tiles are then thinned together, ranked by key
+        and, for points of equal key (e.g. duplicates where flight lines
+        overlap), by tile and position within it, exactly as the merged
+        tiles would be.
+        
+        """
+        seed = simulocloud.pointcloud._int_seed(seed)
+        args = np.empty(self.shape, dtype=object)
+        for index in np.ndindex(*self.shape):
+            args[index] = (density, cell_size, seed)
+        candidates = self.map(_thin_candidates, workers=workers, args=args)
+        
+        # Thin candidates of all tiles together, in tile order
+        indices = list(np.ndindex(*self.shape))
+        cells = np.concatenate([candidates[index][1] for index in indices], axis=1)
+        keys = np.concatenate([candidates[index][2] for index in indices])
+        kept = np.zeros(len(keys), dtype=bool)
+        kept[simulocloud.pointcloud._first_per_cell(cells, keys, density * cell_size**2, seed)] = True
+        
+        tiles = np.empty(self.shape, dtype=object)
+        start = 0
+        for index in indices:
+            idx = candidates[index][0]
+            tiles[index] = self.tiles[index]._take(idx[kept[start:start+len(idx)]])
+            start += len(idx)
+        return type(self)(tiles, self.edges, validate=False)
+
+    def voxelise(self, size, **kwargs):
+        """Count hits of points in, and passes of rays through, voxels, tile by tile.
+        
+        Arguments
+        ---------
+        size: float
+            voxel edge length
+        **kwargs:
+            see `simulocloud.voxels.voxelise` (e.g. `workers`)
+        
+        Returns
+        -------
+        `simulocloud.voxels.SparseVoxels` or `simulocloud.voxels.DenseVoxels`
+            spanning the bounds of the grid (by default)
+        
+        """
+        import simulocloud.voxels
+        return simulocloud.voxels.voxelise(self, size, **kwargs)
+
+    @classmethod
+    def from_files(cls, fpaths, edges=None, spacings=None, directory=None,
+                   memory=2**28, chunksize=simulocloud.pointcloud._CHUNKSIZE, where=None):
+        """Construct `TilesGrid` by streaming points from .las files to tiles.
+        
+        Arguments
+        ---------
+        fpaths: sequence of str
+            filepaths of .las files
+        edges: `numpy.ndarray` (ndim=4, dtype=float) (optional)
+            edges of grid (see `make_edges`)
+        spacings: dict (optional)
+            {axis: spacing} of regular grid covering the bounds of the files'
+            headers (see `make_regular_edges`), if `edges` are not specified
+        directory: str (optional)
+            directory in which tile points are stored (created if needed)
+            default: a new temporary directory, removed once no tiles read
+            from it remain
+        memory: int (default: 256MiB)
+            bytes of points to buffer in memory before spilling to disk
+        chunksize: int
+            number of points read from each file at a time
+        where: dict (optional)
+            {attribute: condition} predicates which points must all satisfy
+            to be read (see `simulocloud.pointcloud.las_where`)
+        
+        Returns
+        -------
+        `TilesGrid` instance
+            whose tiles are memory-mapped from a file each in `directory`,
+            upon first access of their points
+        
+        Notes
+        -----
+        Each file is read exactly once, in chunks. The points of each chunk
+        are located in the grid and appended to per-tile buffers, which are
+        written to the end of each tile's file whenever `memory` is exceeded,
+        so that peak memory does not depend on the number of points. Points
+        outside of `edges` are discarded. Tile `summaries` are accumulated in
+        the same pass, and seed the bounds of the tiles, so that summaries of
+        grids of these tiles (e.g. subsets) never read points. Per-point
+        attributes are not gridded.
+        
+        """
+        if edges is None:
+            if spacings is None:
+                raise TypeError('Either `edges` or `spacings` must be specified')
+            bounds = np.array(simulocloud.pointcloud.merge_bounds(
+                         [simulocloud.pointcloud._get_las_bounds(fpath) for fpath in fpaths]))
+            bounds[3:] += 1e-6 # keep points on upper bounds (as `make_edges`)
+            edges = make_regular_edges(simulocloud.pointcloud.Bounds(*bounds), spacings)
+        if directory is None:
+            tdir = simulocloud.pointcloud._OwnedPath(tempfile.mkdtemp(prefix='simulocloud_'))
+        else:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            tdir = simulocloud.pointcloud._OwnedPath(directory, owned=False)
+        
+        shape = tuple(n-1 for n in edges.shape[:3])
+        size = int(np.prod(shape))
+        fnames = ['tile_{}_{}_{}.bin'.format(*index) for index in np.ndindex(*shape)]
+        tpaths = [os.path.join(tdir.path, fname) for fname in fnames]
+        summaries = np.empty(size, dtype=_SUMMARY_DTYPE)
+        summaries['count'] = 0
+        for b in simulocloud.pointcloud.Bounds._fields:
+            summaries[b] = np.inf if b.startswith('min') else -np.inf
+        
+        # Route chunks of points to tile buffers, spilling to disk when full
+        buffers = {}
+        buffered = [0] # bytes
+        written = set()
+        def spill():
+            for i, pieces in buffers.iteritems():
+                with open(tpaths[i], 'ab' if i in written else 'wb') as f:
+                    written.add(i)
+                    np.concatenate(pieces, axis=1).T.astype(simulocloud.pointcloud._DTYPE).tofile(f)
+            buffers.clear()
+            buffered[0] = 0
+        
+        for fpath in fpaths:
+            for arr in simulocloud.pointcloud._iter_las_xyz(fpath, chunksize, where):
+                itiles = _locate_tiles(arr, edges)
+                order = np.argsort(itiles, kind='mergesort')
+                itiles, arr = itiles[order], arr[:, order]
+                starts = simulocloud.pointcloud._group_starts(itiles)
+                ends = np.append(starts[1:], len(itiles))
+                if len(itiles) and itiles[0] < 0: # outside grid
+                    starts, ends = starts[1:], ends[1:]
+                if not len(starts):
+                    continue
+                
+                cells = itiles[starts]
+                summaries['count'][cells] += ends - starts
+                for axis, (minb, maxb) in enumerate(zip(simulocloud.pointcloud.Bounds._fields[:3],
+                                                        simulocloud.pointcloud.Bounds._fields[3:])):
+                    summaries[minb][cells] = np.minimum(summaries[minb][cells],
+                                                        np.minimum.reduceat(arr[axis], starts))
+                    summaries[maxb][cells] = np.maximum(summaries[maxb][cells],
+                                                        np.maximum.reduceat(arr[axis], starts))
+                for i, start, end in zip(cells, starts, ends):
+                    buffers.setdefault(i, []).append(arr[:, start:end])
+                buffered[0] += arr[:, starts[0]:ends[-1]].nbytes
+                if buffered[0] > memory:
+                    spill()
+        spill()
+        
+        # Tiles map their files lazily, with bounds seeded from summaries
+        tiles = np.empty(size, dtype=object)
+        for i, (fname, count) in enumerate(zip(fnames, summaries['count'])):
+            if count:
+                bounds = simulocloud.pointcloud.Bounds(
+                    *[summaries[b][i] for b in simulocloud.pointcloud.Bounds._fields])
+                tiles[i] = Tile._from_file(_TileFile(tdir, fname, count), bounds)
+            else:
+                tiles[i] = Tile(None)
+        empty = summaries['count'] == 0
+        for b in simulocloud.pointcloud.Bounds._fields:
+            summaries[b][empty] = np.nan
+        
+        grid = cls(tiles.reshape(shape), edges, validate=False)
+        grid._summaries = summaries.reshape(shape)
+        return grid
+
     @classmethod
     def from_splitlocs(cls, pcs, splitlocs, inclusive=True):
         """Construct `TilesGrid` instance by retiling pointclouds.
@@ -191,6 +826,25 @@ class TilesGrid(object):
     def shape(self):
         """Return the shape of the grid of tiles."""
         return self.tiles.shape
+
+    def _axis_edges(self):
+        """Return the (sorted) edges of the grid along x, y and z."""
+        return self.edges[:,0,0,0], self.edges[0,:,0,1], self.edges[0,0,:,2]
+
+    @property
+    def summaries(self):
+        """Return summary statistics of each tile (see `summarise_tiles`).
+        
+        Summaries are calculated once, on first access, and cached. They are
+        taken from the known bounds of tiles (e.g. those of `from_files`, or
+        of `Tile.from_las` trusting headers) without reading points, so only
+        tiles whose bounds are unknown are read. Subsets share the summaries
+        of their parent, so tiles are only ever summarised once.
+        """
+        missing = self._summaries['count'] < 0
+        if missing.any():
+            self._summaries[missing] = summarise_tiles(self.tiles[missing])
+        return self._summaries
     
     def validate(self):
         """Return True if grid edges accurately describes tiles."""
@@ -207,7 +861,112 @@ class TilesGrid(object):
         
         return True
 
-def grid_pointclouds(pcs, edges, pctype=Tile):
+def _map_tile(job):
+    """Apply a function to a memory-mapped tile (see `TilesGrid.map`)."""
+    index, func, pctype, shared, extra = job
+    if isinstance(shared, simulocloud.pointcloud.SharedPointCloud):
+        tile = pctype.from_shared(shared)
+    else: # (`_TileFile`, bounds) of tile stored by `from_files`
+        tile = pctype._from_file(*shared)
+    return index, func(tile, *extra)
+
+def _locate(arr, edges, closed=False):
+    """Return (ix, iy, iz) indices of tiles of `edges` containing (3*n) points.
+    
+    Tiles are lower-inclusive and upper-exclusive (as `crop`), unless
+    `closed`, when points on the outer upper edges of the grid are located
+    in its last tiles; points outside of the grid are given indices of -1.
+    """
+    shape = tuple(n-1 for n in edges.shape[:3])
+    inside = np.ones(arr.shape[1], dtype=bool)
+    indices = []
+    for axis, axis_edges in enumerate((edges[:,0,0,0], edges[0,:,0,1], edges[0,0,:,2])):
+        i = np.searchsorted(axis_edges, arr[axis], side='right') - 1
+        if closed:
+            i[arr[axis] == axis_edges[-1]] = shape[axis] - 1
+        inside &= (i >= 0) & (i < shape[axis])
+        indices.append(i)
+    for i in indices:
+        i[~inside] = -1
+    return tuple(indices)
+
+def _locate_tiles(arr, edges, closed=False):
+    """Return flat index of tile of `edges` containing each of (3*n) points.
+    
+    Points outside of the grid are given an index of -1 (see `_locate`).
+    """
+    shape = tuple(n-1 for n in edges.shape[:3])
+    indices = _locate(arr, edges, closed)
+    inside = indices[0] >= 0
+    itiles = np.full(arr.shape[1], -1, dtype=np.intp)
+    itiles[inside] = np.ravel_multi_index([i[inside] for i in indices], shape)
+    return itiles
+
+def _sort_by_tile(pc, edges):
+    """Return order of points of `pc` sorted by tile of `edges`, and summaries per tile.
+    
+    Points on the upper edges of `edges` are kept (see `_locate`), and points
+    outside of them omitted (see `TilesGrid.refine`).
+    """
+    itiles = _locate_tiles(pc.arr, edges, closed=True)
+    order = np.argsort(itiles, kind='mergesort')
+    ntiles = int(np.prod([n-1 for n in edges.shape[:3]]))
+    counts = np.bincount(itiles + 1, minlength=ntiles + 1)
+    order, counts = order[counts[0]:], counts[1:]
+    
+    summaries = _unsummarised(ntiles)
+    summaries['count'] = counts
+    nonempty = np.flatnonzero(counts)
+    starts = (np.cumsum(counts) - counts)[nonempty]
+    for axis, (minb, maxb) in enumerate(zip(simulocloud.pointcloud.Bounds._fields[:3],
+                                            simulocloud.pointcloud.Bounds._fields[3:])):
+        coords = pc.arr[axis][order]
+        if len(coords):
+            summaries[minb][nonempty] = np.minimum.reduceat(coords, starts)
+            summaries[maxb][nonempty] = np.maximum.reduceat(coords, starts)
+    return order, summaries
+
+def _thin_candidates(tile, args):
+    """Return indices, cells and keys of the points of a tile kept by thinning it alone."""
+    density, cell_size, seed = args
+    return simulocloud.pointcloud._thin_to_density(tile.arr, density, cell_size, seed)
+
+def _unsummarised(shape):
+    """Return summaries of `shape` marking tiles as yet to be summarised (count -1)."""
+    summaries = np.empty(shape, dtype=_SUMMARY_DTYPE)
+    summaries['count'] = -1
+    for b in simulocloud.pointcloud.Bounds._fields:
+        summaries[b] = np.nan
+    return summaries
+
+def summarise_tiles(tiles):
+    """Return summary statistics of each pointcloud in a tiles array.
+    
+    Arguments
+    ---------
+    tiles: `numpy.ndarray` (dtype=object)
+        array of pointclouds (usually type `Tile`)
+    
+    Returns
+    -------
+    summaries: `numpy.ndarray` (dtype=`_SUMMARY_DTYPE`)
+        structured array of same shape as `tiles`, with fields:
+        'count': number of points in tile
+        'minx', 'miny', 'minz', 'maxx', 'maxy', 'maxz': bounds of tile's
+        points (`nan` for empty tiles)
+    
+    """
+    summaries = np.empty(tiles.shape, dtype=_SUMMARY_DTYPE)
+    for index in np.ndindex(*tiles.shape):
+        tile = tiles[index]
+        try:
+            bounds = tuple(tile.bounds)
+        except simulocloud.exceptions.EmptyPointCloud:
+            bounds = (np.nan,)*6
+        summaries[index] = (len(tile),) + bounds
+    return summaries
+
+def grid_pointclouds(pcs, edges, pctype=Tile, deduplicate=None):
     """Return a 3D array of (merged) pointclouds gridded to edges.
     
     Arguments
@@ -219,6 +978,9 @@ def grid_pointclouds(pcs, edges, pctype=Tile):
     pctype: subclass of `simulocloud.pointcloud.PointCloud` (optional)
         type of pointclouds to return
         default = `simulocloud.pointcloud.PointCloud`
+    deduplicate: float (optional)
+        tolerance with which to remove duplicate points (e.g. where `pcs`
+        overlap) from each tile (see `PointCloud.deduplicate`)
     
     Returns
     -------
@@ -229,23 +991,41 @@ def grid_pointclouds(pcs, edges, pctype=Tile):
         sorted `locs` align with sequential pointclouds along each array axis:
             0:x, 1:y, 2:z
     
+    Notes
+    -----
+    Points are assigned to tiles by `TilesGrid.locate`'s kernel, with a
+    single stable sort per pointcloud; points outside `edges` are dropped.
+    
+    """
+    shape = tuple(n-1 for n in edges.shape[:3])
+    pieces = _route_points(pcs, edges)
+    tiles = np.empty(len(pieces), dtype=object)
+    for i, tile_pieces in enumerate(pieces):
+        tiles[i] = simulocloud.pointcloud.merge(tile_pieces, pctype=pctype)
+    tiles = tiles.reshape(shape)
+    if deduplicate is not None:
+        for idx, tile in np.ndenumerate(tiles):
+            tiles[idx] = tile.deduplicate(deduplicate)
+    return tiles
+
+def _route_points(pcs, edges):
+    """Return list (per flat tile index) of lists of the points of `pcs` in each tile.
+    
+    Points are located by `_locate_tiles`, and keep their order; those
+    outside of the grid are dropped.
     """
-    # Pre-allocate empty tiles array
-    shape = (len(pcs),) + tuple((n-1 for n in edges.shape[:3]))
-    tiles = np.empty(shape, dtype=object)
-    
-    # Build 4D array with pcs split in x, y and z
-    for i, pc in enumerate(pcs):
-        pcs = pc.split('x', edges[:,0,0,0], pctype=pctype)[1:-1]
-        for ix, pc in enumerate(pcs):
-            pcs = pc.split('y', edges[0,:,0,1])[1:-1]
-            for iy, pc in enumerate(pcs):
-                pcs = pc.split('z', edges[0,0,:,2])[1:-1]
-                # Assign pc to predetermined location
-                tiles[i, ix, iy] = pcs
-    
-    # Flatten to 3D
-    return np.sum(tiles, axis=0)
+    ntiles = int(np.prod([max(n-1, 0) for n in edges.shape[:3]]))
+    pieces = [[] for _ in xrange(ntiles)]
+    for pc in pcs:
+        itiles = _locate_tiles(pc.arr, edges)
+        order = np.argsort(itiles, kind='mergesort')
+        itiles = itiles[order]
+        starts = simulocloud.pointcloud._group_starts(itiles)
+        ends = np.append(starts[1:], len(itiles))
+        for i, start, end in zip(itiles[starts], starts, ends):
+            if i >= 0: # inside grid
+                pieces[i].append(pc._take(order[start:end]))
+    return pieces
 
 def fractional_splitlocs(bounds, nx=None, ny=None, nz=None):
     """Generate locations to split bounds into n even sections per axis.
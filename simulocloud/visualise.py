@@ -7,13 +7,27 @@ import numpy as np
 import matplotlib.pyplot as plt
 import mpl_toolkits.mplot3d
 import itertools
+import collections
+import weakref
+import simulocloud.pointcloud
 import simulocloud.exceptions
 
 # Mapping of dimension to index in bounds
 _IDIM = {'x': 0, 'y': 1, 'z': 2}
 
+# Memoised preview samples {pc: (pc.arr, {(bounds, n, dims): sample})}
+_SAMPLES = weakref.WeakKeyDictionary()
+
+# Maximum number of preview samples memoised per pointcloud
+_MAX_SAMPLES = 8
+
+# Colourbar labels for raster render modes
+_RENDER_LABELS = {'density': 'points per cell',
+                  'height': 'maximum z'}
+
 def scatter(pcs, dims, bounds=None, highlight=None, n=10000,
-            colours=None, labels=None, title=None, figsize=(6,6)):
+            colours=None, labels=None, title=None, figsize=(6,6),
+            render='points', bins=500):
     """Create a scatter plot of one or more point clouds in 2D or 3D.
     
     Arguments:
@@ -38,6 +52,14 @@ def scatter(pcs, dims, bounds=None, highlight=None, n=10000,
         figure title
     figsize: tuple (default: (6,6)
         (width, height) figure dimensions in inches
+    render: str (default: 'points')
+        'points' plots (up to `n`) individual points of each pointcloud
+        'density' (2D only) shows the number of points in each image cell
+        'height' (2D only) shows the maximum z of the points in each cell
+        raster modes bin every point of all pointclouds into a single image,
+        ignoring `n`, `colours` and `labels`
+    bins: int or (int, int) (default: 500)
+        number of image cells along each axis in raster render modes
 
     Returns:
     --------
@@ -55,6 +77,12 @@ def scatter(pcs, dims, bounds=None, highlight=None, n=10000,
         raise simulocloud.exceptions.BadDims('dims must be str (not {})'.format(type(dims))) 
     except(KeyError): 
         raise simulocloud.exceptions.WrongNDims('dims must have either 2 or 3 dims (had {})'.format(ndims))
+    if render != 'points':
+        if render not in _RENDER_LABELS:
+            raise ValueError("render must be one of 'points', {}".format(
+                                 ', '.join(map(repr, sorted(_RENDER_LABELS)))))
+        if ndims != 2:
+            raise simulocloud.exceptions.WrongNDims('{} rendering requires 2 dims (had {})'.format(render, ndims))
      
     # Set up figure
     fig = plt.figure(figsize=figsize)
@@ -62,9 +90,17 @@ def scatter(pcs, dims, bounds=None, highlight=None, n=10000,
     ax.set_aspect('equal')
     
     # Draw plots
-    pcs = _crop_and_sample_pointclouds(pcs, bounds, n)
-    for arrs, kwargs in _iter_scatter_args(pcs, dims, colours, labels):
-        ax.scatter(s=2, edgecolors='none', *arrs, **kwargs)
+    if render == 'points':
+        pcs = _crop_and_sample_pointclouds(pcs, bounds, n, dims[:2])
+        for arrs, kwargs in _iter_scatter_args(pcs, dims, colours, labels):
+            ax.scatter(s=2, edgecolors='none', *arrs, **kwargs)
+    else:
+        if bounds is not None:
+            pcs = [pc.crop(bounds, allow_empty=True) for pc in pcs]
+        image, extent = _raster_image(pcs, dims, bins, render, bounds)
+        im = ax.imshow(image.T, origin='lower', extent=extent,
+                       interpolation='nearest', aspect='equal')
+        fig.colorbar(im, ax=ax, label=_RENDER_LABELS[render])
    
     # Highlight area
     if highlight is not None:
@@ -74,7 +110,8 @@ def scatter(pcs, dims, bounds=None, highlight=None, n=10000,
             ax.plot(*rect, c='fuchsia')
     
     # Annotate figure
-    ax.legend()
+    if render == 'points':
+        ax.legend()
     ax.set_xlabel(dims[0].upper())
     ax.set_ylabel(dims[1].upper())
     if ndims == 3:
@@ -84,6 +121,70 @@ def scatter(pcs, dims, bounds=None, highlight=None, n=10000,
      
     return fig
 
+def grid_overview(grid, stat='count', limit=None, title=None, figsize=(6,6)):
+    """Plot the xy layout of a `TilesGrid`, shading each column of tiles.
+    
+    Arguments
+    ---------
+    grid: `simulocloud.tiles.TilesGrid` instance
+        grid of tiles to plot
+    stat: str (default: 'count')
+        statistic to shade each column of tiles (i.e. summed over z) by:
+        'count': number of points
+        'density': number of points per unit area
+        'height': maximum z of points
+    limit: int (optional)
+        outline columns of tiles containing more than `limit` points
+    title: str (optional)
+        figure title
+    figsize: tuple (default: (6,6)
+        (width, height) figure dimensions in inches
+    
+    Returns
+    -------
+    matplotlib.figure.Figure instance
+    
+    Notes
+    -----
+    Only `grid.edges` and the (cached) `grid.summaries` are used, so no
+    point arrays are read once summaries are known. Columns without points
+    are drawn in grey.
+    
+    """
+    xedges, yedges = grid.edges[:,0,0,0], grid.edges[0,:,0,1]
+    summaries = grid.summaries
+    counts = summaries['count'].sum(axis=2)
+    if stat == 'count':
+        values = counts.astype(float)
+    elif stat == 'density':
+        values = counts / np.outer(np.diff(xedges), np.diff(yedges))
+    elif stat == 'height':
+        maxz = summaries['maxz']
+        values = np.where(np.isnan(maxz), -np.inf, maxz).max(axis=2)
+    else:
+        raise ValueError("stat must be one of 'count', 'density' or 'height'")
+    values = np.ma.masked_where(counts == 0, values)
+    
+    fig = plt.figure(figsize=figsize)
+    ax = fig.add_subplot(111)
+    ax.set_aspect('equal')
+    ax.set_facecolor('lightgrey')
+    mesh = ax.pcolormesh(xedges, yedges, values.T, edgecolors='k', linewidth=0.2)
+    fig.colorbar(mesh, ax=ax, label=stat)
+    
+    # Outline overfull columns
+    if limit is not None:
+        for ix, iy in zip(*np.nonzero(counts > limit)):
+            ax.plot(*_trace_rectangle(xedges[ix], yedges[iy],
+                                      xedges[ix+1], yedges[iy+1]), c='fuchsia')
+    
+    ax.set_xlabel('X')
+    ax.set_ylabel('Y')
+    if title is not None:
+        ax.set_title(title)
+    
+    return fig
+
 def _iter_scatter_args(pcs, dims, colours, labels):
     """Yield plotting arrays and matplotlib scatter kwargs per pointcloud."""
     # Generate defaults
@@ -99,11 +200,106 @@ def _iter_scatter_args(pcs, dims, colours, labels):
                   'label': label}
         yield arrs, kwargs
 
-def _crop_and_sample_pointclouds(pcs, bounds, n):
+def _crop_and_sample_pointclouds(pcs, bounds, n, dims='xy'):
     """Return generator of cropped point clouds with maximum n points."""
-    if bounds is not None:
-        pcs = (pc.crop(bounds) for pc in pcs)
-    return (pc.downsample(n) if len(pc)>n else pc for pc in pcs) 
+    return (_sample_pointcloud(pc, bounds, n, dims) for pc in pcs)
+
+def _sample_pointcloud(pc, bounds, n, dims='xy'):
+    """Crop and stratify sample `pc` to n points spread evenly over `dims`.
+    
+    Samples are memoised per pointcloud, `bounds`, `n` and `dims`, so that
+    repeated plots of the same area are instant and identical. The memo for
+    a pointcloud is discarded when its array is replaced (but not when it is
+    modified in place), and holds only its `_MAX_SAMPLES` latest samples.
+    Pointclouds small enough to plot whole are not memoised, as the memo
+    would then keep them alive.
+    """
+    if bounds is None and len(pc) <= n:
+        return pc
+    try:
+        arr, samples = _SAMPLES[pc]
+    except KeyError:
+        arr = None
+    if arr is not pc.arr:
+        arr, samples = pc.arr, collections.OrderedDict()
+        _SAMPLES[pc] = (arr, samples)
+    
+    key = (None if bounds is None else tuple(bounds), n, dims)
+    try:
+        return samples[key]
+    except KeyError:
+        sample = pc if bounds is None else pc.crop(bounds)
+        if len(sample) > n:
+            sample = sample.stratified_sample(n, dims=dims, seed=0)
+        if sample is not pc:
+            samples[key] = sample
+            while len(samples) > _MAX_SAMPLES:
+                samples.popitem(last=False)
+        return sample
+
+def _raster_image(pcs, dims, bins, render, bounds=None):
+    """Bin all points in `pcs` onto a 2D image in a single vectorised pass.
+    
+    Arguments
+    ---------
+    pcs: iterable of PointCloud instances
+        (already cropped to `bounds`, if given)
+    dims: str
+        two dimensions defining image axes (e.g. 'xy')
+    bins: int or (int, int)
+        number of image cells along each image axis
+    render: str
+        'density' (count of points) or 'height' (max z of points) per cell
+    bounds: `Bounds` or similiar (optional)
+        (minx, miny, minz, maxx, maxy, maxz) extent of image, so that it
+        lines up with the window requested; `None` values (default) are
+        taken from the points
+    
+    Returns
+    -------
+    image: ndarray (shape: bins)
+        value in each cell (`nan` where 'height' cells are empty)
+    extent: tuple or None
+        (left, right, bottom, top) of image, for `matplotlib.pyplot.imshow`
+        (None if there are no points, and `bounds` do not define it)
+    
+    """
+    pcs = [pc for pc in pcs if len(pc)]
+    nbins = np.broadcast_to(bins, (2,))
+    size = nbins[0] * nbins[1]
+    if render == 'density':
+        image = np.zeros(size)
+    else:
+        image = np.full(size, -np.inf)
+    
+    # Image extent, from `bounds` where given
+    extent = _reorient_bounds(bounds or (None,)*6, dims)
+    if pcs:
+        points_extent = _reorient_bounds(simulocloud.pointcloud.merge_bounds(
+                                             [pc.bounds for pc in pcs]), dims)
+        extent = [points if given is None else given
+                  for given, points in zip(extent, points_extent)]
+    if any(value is None for value in extent):
+        return np.full(nbins, np.nan if render == 'height' else 0.), None
+    mins, maxs = np.reshape(extent, (2, 2))
+    
+    # Flat cell index of every point (upper bounds inclusive)
+    for pc in pcs:
+        icell = 0
+        for i, dim in enumerate(dims):
+            coords = getattr(pc, dim)
+            spacing = (maxs[i] - mins[i]) / float(nbins[i]) or 1.
+            icoord = np.clip(((coords - mins[i]) / spacing).astype(np.intp),
+                             0, nbins[i] - 1)
+            icell = icell * nbins[i] + icoord
+        if render == 'density':
+            image += np.bincount(icell, minlength=size)
+        else:
+            np.maximum.at(image, icell, pc.z)
+    
+    if render == 'height':
+        image[np.isneginf(image)] = np.nan
+    return image.reshape(nbins), (mins[0], maxs[0], mins[1], maxs[1])
 
 def _iternones():
     """Return infinite generator yielding None."""
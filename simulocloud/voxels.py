@@ -0,0 +1,346 @@
+"""
+voxels
+
+Count the hits of points in, and passes of rays through, voxels.
+"""
+import numpy as np
+import collections
+import simulocloud.pointcloud
+import simulocloud.tiles
+import simulocloud.exceptions
+
+class SparseVoxels(collections.namedtuple('SparseVoxels', ['size', 'ijk', 'hits', 'passes'])):
+    """Counts of voxels stored as a dictionary of keys (of observed voxels only).
+
+    Voxels are the cubes of a global lattice of edge length `size`, such that
+    the point (x, y, z) lies in voxel (floor(x/size), floor(y/size),
+    floor(z/size)); grids of neighbouring areas therefore line up.
+
+    Attributes
+    ----------
+    size: float
+        voxel edge length
+    ijk: `numpy.ndarray` (shape=(n, 3), dtype=int64)
+        integer keys of voxels, sorted (by i, then j, then k) and unique
+    hits: `numpy.ndarray` (dtype=int64)
+        number of points in each voxel
+    passes: `numpy.ndarray` (dtype=int64)
+        number of rays passing through each voxel (to points beyond it)
+    """
+    __slots__ = ()
+
+    def __len__(self):
+        """Number of voxels observed."""
+        return len(self.ijk)
+
+    def transmittance(self):
+        """Return fraction of rays entering each voxel which pass through it."""
+        return self.passes / (self.hits + self.passes).astype(float)
+
+    def to_dense(self, origin=None, shape=None):
+        """Return `DenseVoxels` spanning the voxels observed (or a given extent).
+
+        Arguments
+        ---------
+        origin: sequence of int (optional)
+            integer key (i, j, k) of the first voxel of the dense arrays
+        shape: sequence of int (optional)
+            (ni, nj, nk) number of voxels spanned in each axis; `origin` and
+            `shape` must span every observed voxel
+
+        """
+        if origin is None:
+            if not len(self):
+                origin, shape = np.zeros(3, dtype=np.int64), (0, 0, 0)
+            else:
+                origin = self.ijk.min(axis=0)
+                shape = self.ijk.max(axis=0) - origin + 1
+        origin, shape = np.asarray(origin, dtype=np.int64), tuple(shape)
+        hits, passes = np.zeros(shape, dtype=np.int64), np.zeros(shape, dtype=np.int64)
+        if not len(self):
+            return DenseVoxels(self.size, origin, hits, passes)
+        index = tuple((self.ijk - origin).T)
+        hits[index], passes[index] = self.hits, self.passes
+        return DenseVoxels(self.size, origin, hits, passes)
+
+    def to_sparse(self):
+        """Return self."""
+        return self
+
+class DenseVoxels(collections.namedtuple('DenseVoxels', ['size', 'origin', 'hits', 'passes'])):
+    """Counts of voxels stored in dense 3D arrays.
+
+    Attributes
+    ----------
+    size: float
+        voxel edge length (see `SparseVoxels`)
+    origin: `numpy.ndarray` (dtype=int64)
+        integer key (i, j, k) of the voxel at index [0, 0, 0] of the arrays
+    hits: `numpy.ndarray` (ndim=3, dtype=int64)
+        number of points in each voxel
+    passes: `numpy.ndarray` (ndim=3, dtype=int64)
+        number of rays passing through each voxel (to points beyond it)
+    """
+    __slots__ = ()
+
+    @property
+    def bounds(self):
+        """Return `Bounds` of the voxels of the arrays."""
+        lower = self.origin * self.size
+        upper = (self.origin + self.hits.shape) * self.size
+        return simulocloud.pointcloud.Bounds(*np.concatenate([lower, upper]))
+
+    def transmittance(self):
+        """Return fraction of rays entering each voxel which pass through it."""
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return self.passes / (self.hits + self.passes).astype(float)
+
+    def to_sparse(self):
+        """Return `SparseVoxels` of the observed (hit or passed) voxels."""
+        observed = (self.hits > 0) | (self.passes > 0)
+        ijk = np.stack(np.nonzero(observed), axis=1) + self.origin
+        return SparseVoxels(self.size, ijk, self.hits[observed], self.passes[observed])
+
+    def to_dense(self):
+        """Return self."""
+        return self
+
+class Traversal(object):
+    """Amanatides & Woo traversal of rays through a grid of voxels, vectorised across rays.
+
+    All rays step through one voxel at a time together. After each `step`,
+    `active` indexes the rays still within the grid, whose current voxel is
+    at `ijk[active]`, entered at `t_in[active]` and left at `t_out()` (in
+    units of distance along each ray's (unit) direction).
+
+    Attributes
+    ----------
+    rays: `numpy.ndarray` (dtype=int)
+        indices (into the rays initialised with) of the rays entering the grid;
+        all other attributes are indexed as `rays`
+    ijk: `numpy.ndarray` (shape=(n, 3), dtype=int64)
+        index into the grid of the current voxel of each ray
+    t_in: `numpy.ndarray`
+        distance along each ray at which it entered its current voxel
+    active: `numpy.ndarray` (dtype=int)
+        indices of rays yet to leave the grid (or be stopped)
+    """
+    def __init__(self, origins, dirs, lower, size, shape):
+        """Find the voxels at which rays enter a grid.
+
+        Arguments
+        ---------
+        origins: `numpy.ndarray` (shape=(n, 3))
+            (x, y, z) origin of each ray
+        dirs: `numpy.ndarray` (shape=(n, 3))
+            (x, y, z) unit direction of each ray
+        lower: sequence of float
+            (x, y, z) of the lower corner of the grid
+        size: float
+            voxel edge length
+        shape: sequence of int
+            (nx, ny, nz) number of voxels of the grid in each axis
+        """
+        lower = np.asarray(lower, dtype=float)
+        self.shape = np.asarray(shape, dtype=np.int64)
+        upper = lower + self.shape * size
+
+        # Find entry and exit of rays into grid
+        with np.errstate(divide='ignore', invalid='ignore'):
+            inv = 1. / dirs
+            t_lower, t_upper = (lower - origins) * inv, (upper - origins) * inv
+            t_near = np.nanmax(np.minimum(t_lower, t_upper), axis=1)
+            t_far = np.nanmin(np.maximum(t_lower, t_upper), axis=1)
+        t_near = np.maximum(t_near, 0.)
+        self.rays = np.flatnonzero(t_near < t_far)
+        origins, dirs, inv = origins[self.rays], dirs[self.rays], inv[self.rays]
+        self.t_in = t_near[self.rays]
+
+        # Initialise stepping
+        entry = origins + dirs * self.t_in[:, None]
+        self.ijk = np.clip(np.floor((entry - lower) / size).astype(np.int64), 0, self.shape - 1)
+        self._step = np.where(dirs > 0, 1, -1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self._t_delta = np.where(dirs != 0, size * np.abs(inv), np.inf)
+            self._t_max = np.where(dirs != 0, ((self.ijk + (self._step > 0)) * size +
+                                               lower - origins) * inv, np.inf)
+        self.active = np.arange(len(self.rays))
+
+    def t_out(self):
+        """Return distance along each active ray at which it leaves its current voxel."""
+        return self._t_max[self.active].min(axis=1)
+
+    def step(self, keep=None):
+        """Step each active ray into its next voxel.
+
+        Arguments
+        ---------
+        keep: `numpy.ndarray` (dtype=bool) (optional)
+            whether each active ray continues; rays not kept are stopped
+        """
+        active = self.active
+        axis = self._t_max[active].argmin(axis=1)
+        self.t_in[active] = self._t_max[active, axis]
+        self.ijk[active, axis] += self._step[active, axis]
+        self._t_max[active, axis] += self._t_delta[active, axis]
+        alive = np.all((self.ijk[active] >= 0) & (self.ijk[active] < self.shape), axis=1)
+        if keep is not None:
+            alive &= keep
+        self.active = active[alive]
+
+def voxelise(pcs, size, sensors=None, bounds=None, dense=False, workers=None, batchsize=2**16):
+    """Count hits of points in, and passes of rays through, voxels.
+
+    Arguments
+    ---------
+    pcs: `PointCloud`, sequence of `PointCloud` or `simulocloud.tiles.TilesGrid`
+        points (e.g. lidar returns) hitting voxels
+    size: float
+        voxel edge length
+    sensors: `numpy.ndarray` or callable (optional)
+        (x, y, z) position of the sensor from which the rays to points were
+        cast: either a single (3,) position, a (3, n) position per point (of
+        a single pointcloud), or a picklable function returning either for a
+        pointcloud (e.g. interpolating a trajectory at the points' 'gps_time')
+        if omitted, only hits are counted
+    bounds: `Bounds` or similiar (optional)
+        volume in which to count (default: bounds of `pcs`)
+    dense: bool (default: False)
+        whether to return `DenseVoxels` spanning `bounds` rather than
+        `SparseVoxels` of observed voxels only
+    workers: int (optional)
+        number of worker processes between which to divide the tiles of a
+        `TilesGrid` (see `TilesGrid.map`)
+    batchsize: int
+        number of rays traversed at once
+
+    Returns
+    -------
+    `SparseVoxels` or `DenseVoxels`
+
+    Notes
+    -----
+    Rays are traversed from sensor to point, counting a pass through each
+    voxel before the one containing the point. As voxels lie on a global
+    lattice, the counts of pointclouds (or tiles) are simply summed (see
+    `combine`) as long as the same `bounds` are used for each, which is how
+    grids of tiles are processed. Each pointcloud (or tile) is counted
+    sparsely; dense arrays are only allocated once, for the combined counts.
+
+    """
+    grid = pcs if isinstance(pcs, simulocloud.tiles.TilesGrid) else None
+    if isinstance(pcs, simulocloud.pointcloud.PointCloud):
+        pcs = [pcs]
+    if bounds is None:
+        if grid is not None:
+            bounds = grid.bounds
+        else:
+            nonempty = [pc.bounds for pc in pcs if len(pc)]
+            if not nonempty:
+                raise simulocloud.exceptions.EmptyPointCloud(
+                          'Bounds of empty pointclouds must be specified')
+            bounds = simulocloud.pointcloud.merge_bounds(nonempty)
+    args = (size, sensors, tuple(bounds), batchsize)
+
+    # Count sparsely (per pointcloud or tile), and densify only once combined
+    if grid is not None:
+        tile_args = np.empty(grid.shape, dtype=object)
+        for index in np.ndindex(*grid.shape):
+            tile_args[index] = args
+        results = list(grid.map(_voxelise_pointcloud, workers=workers, args=tile_args).flat)
+    else:
+        results = [_voxelise_pointcloud(pc, args) for pc in pcs]
+    if not results:
+        results = [_voxelise_pointcloud(simulocloud.pointcloud.PointCloud(None), args)]
+    voxels = combine(results)
+    if dense:
+        return voxels.to_dense(*_lattice_extent(bounds, size))
+    return voxels
+
+def combine(voxels):
+    """Sum the counts of voxels (e.g. of neighbouring tiles).
+
+    Arguments
+    ---------
+    voxels: sequence of `SparseVoxels` or `DenseVoxels`
+        counts of voxels of the same `size`
+
+    Returns
+    -------
+    `SparseVoxels` or `DenseVoxels` (of the first of `voxels`)
+        dense arrays span all of `voxels`
+
+    """
+    voxels = list(voxels)
+    if len(set(v.size for v in voxels)) > 1:
+        raise ValueError('Voxels of different sizes cannot be combined')
+    sparse = [v.to_sparse() for v in voxels]
+    combined = SparseVoxels(voxels[0].size, *_sum_by_key(
+                   np.concatenate([v.ijk for v in sparse]),
+                   np.concatenate([v.hits for v in sparse]),
+                   np.concatenate([v.passes for v in sparse])))
+    if not isinstance(voxels[0], DenseVoxels):
+        return combined
+
+    # Span all dense arrays
+    dense = [v for v in voxels if isinstance(v, DenseVoxels)]
+    origin = np.min([v.origin for v in dense], axis=0)
+    shape = np.max([v.origin + v.hits.shape for v in dense], axis=0) - origin
+    return combined.to_dense(origin, shape)
+
+def _voxelise_pointcloud(pc, args):
+    """Count hits and passes of a single pointcloud (see `voxelise`)."""
+    size, sensors, bounds, batchsize = args
+    origin, shape = _lattice_extent(bounds, size)
+    ijk = np.floor(pc.arr.T / size).astype(np.int64) - origin
+    inside = np.all((ijk >= 0) & (ijk < shape), axis=1)
+    arr, ijk = pc.arr[:, inside], ijk[inside]
+    if callable(sensors):
+        sensors = sensors(pc)
+    if sensors is not None:
+        sensors = np.asarray(sensors, dtype=float)
+        if sensors.ndim == 2:
+            sensors = sensors[:, inside]
+
+    # Hits
+    pieces = [(ijk, 1, 0)]
+
+    # Passes of rays from sensors to points, batch by batch
+    if sensors is not None:
+        for i in xrange(0, arr.shape[1], batchsize):
+            ends = arr[:, i:i+batchsize].T
+            starts = np.broadcast_to(sensors.T if sensors.ndim == 2 else sensors,
+                                     (arr.shape[1], 3))[i:i+batchsize]
+            lengths = np.linalg.norm(ends - starts, axis=1)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                dirs = (ends - starts) / lengths[:, None]
+            traversal = Traversal(starts, dirs, origin * size, size, shape)
+            lengths = lengths[traversal.rays]
+            passed = []
+            while len(traversal.active):
+                before = traversal.t_out() < lengths[traversal.active]
+                passed.append(traversal.ijk[traversal.active[before]])
+                traversal.step(keep=before)
+            if passed:
+                pieces.append((np.concatenate(passed), 0, 1))
+
+    ijk = np.concatenate([p[0] for p in pieces])
+    hits = np.concatenate([np.full(len(p[0]), p[1], dtype=np.int64) for p in pieces])
+    passes = np.concatenate([np.full(len(p[0]), p[2], dtype=np.int64) for p in pieces])
+    return SparseVoxels(size, *_sum_by_key(ijk + origin, hits, passes))
+
+def _lattice_extent(bounds, size):
+    """Return origin and shape of the voxels covering `bounds` (inclusive of upper bounds)."""
+    origin = np.floor(np.array(bounds[:3], dtype=float) / size).astype(np.int64)
+    shape = np.floor(np.array(bounds[3:], dtype=float) / size).astype(np.int64) + 1 - origin
+    return origin, shape
+
+def _sum_by_key(ijk, *counts):
+    """Return unique, sorted (n*3) `ijk` keys and `counts` summed over each."""
+    if not len(ijk):
+        return (np.empty((0, 3), dtype=np.int64),) + tuple(np.empty(0, dtype=np.int64)
+                                                           for _ in counts)
+    order = np.lexsort(ijk.T[::-1])
+    ijk = ijk[order]
+    starts = simulocloud.pointcloud._group_starts(ijk.T)
+    return (ijk[starts],) + tuple(np.add.reduceat(c[order], starts) for c in counts)
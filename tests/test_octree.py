@@ -0,0 +1,73 @@
+import pytest
+import numpy as np
+import simulocloud.octree
+import simulocloud.tiles
+import simulocloud.pointcloud
+import simulocloud.exceptions
+
+@pytest.fixture
+def octree(pc_las, tmpdir):
+    """An `Octree` of `pc_las` with small nodes."""
+    return simulocloud.octree.Octree.build(pc_las, str(tmpdir.join('octree')), capacity=200, seed=0)
+
+def _sorted_points(pc):
+    return pc.arr[:, np.lexsort(pc.arr)]
+
+def test_octree_holds_all_points(pc_las, octree):
+    """Does querying all levels without bounds return every point?"""
+    assert len(octree) == len(pc_las)
+    assert np.array_equal(_sorted_points(octree.query()), _sorted_points(pc_las))
+
+def test_octree_levels_bound_point_count(octree):
+    """Do shallower levels return fewer points, at most `capacity` per node?"""
+    counts = [len(octree.query(level=level)) for level in range(octree.depth+1)]
+    assert counts[0] == 200
+    assert all(np.diff(counts) > 0)
+    for level, count in enumerate(counts):
+        assert count <= 200 * (octree.nodes['level'] <= level).sum()
+
+def test_octree_query_matches_crop(pc_las, octree):
+    """Does a full depth query of bounds match cropping, and shallower ones a subset?"""
+    bounds = pc_las.bounds._replace(maxx=pc_las.bounds.minx + 10, maxy=pc_las.bounds.miny + 7)
+    cropped = pc_las.crop(bounds)
+    assert np.array_equal(_sorted_points(octree.query(bounds)), _sorted_points(cropped))
+    coarse = octree.query(bounds, level=1)
+    assert 0 < len(coarse) < len(cropped)
+    assert coarse.bounds.maxx <= bounds.maxx and coarse.bounds.maxy <= bounds.maxy
+
+def test_octree_query_descends_to_intersecting_nodes(pc_las, octree):
+    """Does descending from the root read the same nodes as testing every node?"""
+    bounds = pc_las.bounds._replace(maxx=pc_las.bounds.minx + 10, maxy=pc_las.bounds.miny + 7)
+    level = octree.depth - 1
+    nodes = octree.nodes[octree.nodes['level'] <= level]
+    nbounds = octree.node_bounds(nodes)
+    nodes = nodes[np.all((nbounds[:, :3] <= bounds[3:]) & (nbounds[:, 3:] >= bounds[:3]), axis=1)]
+    assert 0 < len(nodes) < (octree.nodes['level'] <= level).sum()
+    arr = np.concatenate([octree._points[:, start:start+count] for start, count in
+                          zip(nodes['start'], nodes['count'])], axis=1)
+    expected = simulocloud.pointcloud.PointCloud(arr).crop(bounds)
+    assert np.array_equal(_sorted_points(octree.query(bounds, level=level)), _sorted_points(expected))
+
+def test_octree_query_outside(pc_las, octree):
+    """Does querying bounds which miss every node return an empty pointcloud?"""
+    bounds = pc_las.bounds._replace(minx=pc_las.bounds.maxx + 100, maxx=None)
+    assert not len(octree.query(bounds))
+
+def test_octree_build_empty(tmpdir):
+    """Does building an octree of an empty pointcloud raise `EmptyPointCloud`?"""
+    with pytest.raises(simulocloud.exceptions.EmptyPointCloud):
+        simulocloud.octree.Octree.build(simulocloud.pointcloud.PointCloud(None), str(tmpdir.join('octree')))
+
+def test_octree_reopen(pc_las, octree):
+    """Can an octree be reopened from disk?"""
+    reopened = simulocloud.octree.Octree(octree.path)
+    assert np.array_equal(reopened.nodes, octree.nodes)
+    assert len(reopened.query(level=2)) == len(octree.query(level=2))
+
+def test_octree_from_grid(pc_las, tmpdir):
+    """Does an octree built from a grid of tiles hold all their points?"""
+    edges = simulocloud.tiles.make_edges(pc_las.bounds, simulocloud.tiles.fractional_splitlocs(
+                                             pc_las.bounds, nx=2, ny=2, nz=1), inclusive=True)
+    grid = simulocloud.tiles.TilesGrid(simulocloud.tiles.grid_pointclouds([pc_las], edges), edges)
+    octree = simulocloud.octree.Octree.build(grid, str(tmpdir.join('octree')), capacity=500)
+    assert len(octree.query()) == len(pc_las)
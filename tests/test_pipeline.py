@@ -0,0 +1,86 @@
+import pytest
+import numpy as np
+import laspy.file
+import simulocloud.pointcloud
+import simulocloud.pipeline
+import simulocloud.exceptions
+from test_pointcloud import fpaths, half_bounds, same_len_and_bounds
+
+def test_pipeline_reads_same_points_as_from_las(pc_las, fpaths):
+    """Does computing a `Pipeline` over .las files produce all their points?"""
+    pc = simulocloud.pipeline.Pipeline.from_las(*fpaths, chunksize=1000).compute()
+    assert same_len_and_bounds(pc, pc_las)
+
+def test_pipeline_fuses_crops(pc_las, fpaths, half_bounds):
+    """Are chained crops in a `Pipeline` equivalent to eager cropping?"""
+    inner = half_bounds._replace(minz=pc_las.bounds.minz + 1.)
+    pipe = simulocloud.pipeline.Pipeline.from_las(*fpaths, bounds=half_bounds,
+                                                  chunksize=1000).crop(inner)
+    expected = simulocloud.pointcloud.PointCloud.from_las(
+                   *fpaths, bounds=half_bounds).crop(inner)
+    assert same_len_and_bounds(pipe.compute(), expected)
+
+def test_pipeline_matches_eager_downsample(pc_las, half_bounds):
+    """Does a seeded `Pipeline` downsample select the same points as eager evaluation?"""
+    pipe = simulocloud.pipeline.Pipeline.from_pointcloud(pc_las, chunksize=1000)
+    np.random.seed(0)
+    lazy = pipe.crop(half_bounds).downsample(100).compute(pctype=type(pc_las))
+    np.random.seed(0)
+    eager = pc_las.crop(half_bounds).downsample(100)
+    assert type(lazy) is type(pc_las) and np.array_equal(lazy.arr, eager.arr)
+
+def test_pipeline_downsample_takes_seed(pc_las, half_bounds):
+    """Does a `Pipeline` downsample with a seed match eager evaluation?"""
+    pipe = simulocloud.pipeline.Pipeline.from_pointcloud(pc_las, chunksize=1000)
+    lazy = pipe.crop(half_bounds).downsample(100, seed=5).compute()
+    eager = pc_las.crop(half_bounds).downsample(100, seed=5)
+    assert np.array_equal(lazy.arr, eager.arr)
+
+def test_pipeline_crop_to_nothing_raises(pc_las, fpaths):
+    """Does computing a `Pipeline` cropped to nothing raise unless allowed?"""
+    bounds = pc_las.bounds._replace(minz=pc_las.bounds.maxz + 1.)
+    pipe = simulocloud.pipeline.Pipeline.from_las(*fpaths).crop(bounds)
+    with pytest.raises(simulocloud.exceptions.EmptyPointCloud):
+        pipe.compute()
+    assert not pipe.compute(allow_empty=True)
+
+def test_pipeline_from_las_where(pc_las, fpaths):
+    """Are `where` predicates applied when streaming from .las files?"""
+    where = {'return_num': (1, 1)}
+    pipe = simulocloud.pipeline.Pipeline.from_las(*fpaths, where=where, chunksize=500)
+    pc = simulocloud.pointcloud.PointCloud.from_las(*fpaths, where=where)
+    assert same_len_and_bounds(pipe.compute(), pc)
+
+def test_pipeline_streams_to_las(pc_las, fpaths, half_bounds, tmpdir):
+    """Does streaming a cropped `Pipeline` to .las write the same points as eager cropping?"""
+    fpath = str(tmpdir.join('streamed.las'))
+    pipe = simulocloud.pipeline.Pipeline.from_las(*fpaths, bounds=half_bounds, chunksize=1000)
+    pipe.to_las(fpath)
+    expected = pipe.compute()
+    written = simulocloud.pointcloud.PointCloud.from_las(fpath)
+    assert np.allclose(written.arr, expected.arr, atol=2.5e-4)
+    with laspy.file.File(fpath) as f:
+        assert f.header.count == len(expected)
+        assert np.allclose(f.header.min + f.header.max, expected.bounds, atol=2.5e-4)
+
+def test_pipeline_to_las_downsample(pc_las, tmpdir):
+    """Is a `Pipeline` which downsamples written to .las in full?"""
+    fpath = str(tmpdir.join('sampled.las'))
+    pipe = simulocloud.pipeline.Pipeline.from_pointcloud(pc_las, chunksize=1000).downsample(100, seed=5)
+    pipe.to_las(fpath)
+    assert len(simulocloud.pointcloud.PointCloud.from_las(fpath)) == 100
+
+def test_pipeline_to_las_nothing_raises(pc_las, fpaths, tmpdir):
+    """Does streaming a `Pipeline` cropped to nothing raise without writing a file?"""
+    fpath = tmpdir.join('empty.las')
+    bounds = pc_las.bounds._replace(minz=pc_las.bounds.maxz + 1.)
+    with pytest.raises(simulocloud.exceptions.EmptyPointCloud):
+        simulocloud.pipeline.Pipeline.from_las(*fpaths).crop(bounds).to_las(str(fpath))
+    assert not fpath.check()
+
+def test_pipeline_drops_attributes(pc_las, fpaths, half_bounds):
+    """Unlike eager cropping, does a `Pipeline` stream coordinates without attributes?"""
+    pipe = simulocloud.pipeline.Pipeline.from_las(*fpaths, bounds=half_bounds)
+    eager = simulocloud.pointcloud.PointCloud.from_las(*fpaths, bounds=half_bounds)
+    assert 'intensity' in eager.attrs.names
+    assert not pipe.compute().attrs.names
@@ -1,11 +1,18 @@
 import pytest
 import simulocloud.pointcloud
 import simulocloud.exceptions
+import simulocloud.tiles
 import laspy.file
 import numpy as np
+import multiprocessing.pool
+import gc
+import collections
 import cPickle as pkl
 import os
 import math
+import shutil
+import struct
+import warnings
 
 """ Constants and fixtures """
 # Data type used for arrays
@@ -133,6 +140,37 @@ def test_PointCloud_from_multiple_las_with_bounds(pc_las, half_bounds, fpaths):
     pc = simulocloud.pointcloud.PointCloud.from_las(*fpaths, bounds=half_bounds)
     assert same_len_and_bounds(pc, pc_las.crop(half_bounds))
 
+def test_PointCloud_from_las_with_bounds_opens_files_once(fpaths, monkeypatch):
+    """Does reading with `bounds` open each file once, keeping exactly the points of a crop?"""
+    whole = simulocloud.pointcloud.PointCloud.from_las(*fpaths)
+    opened = []
+    File = laspy.file.File
+    def counting_File(fpath, *args, **kwargs):
+        opened.append(fpath)
+        return File(fpath, *args, **kwargs)
+    monkeypatch.setattr(laspy.file, 'File', counting_File)
+    x = np.sort(whole.x)
+    for bounds in [(x[100], None, None, x[-100], None, None), # bounds on points
+                   (None, None, None, x[len(x)//3], None, None),
+                   whole.bounds._replace(maxx=whole.bounds.maxx + 1),
+                   np.array(whole.bounds) + ([-1]*3 + [1]*3)]: # all files inside
+        del opened[:]
+        pc = simulocloud.pointcloud.PointCloud.from_las(*fpaths, bounds=bounds)
+        assert sorted(opened) == sorted(set(opened))
+        assert np.array_equal(pc.arr, whole.crop(bounds).arr)
+
+@pytest.mark.parametrize('max_open', (1, 2, 3))
+def test_PointCloud_from_las_reads_files_in_groups(fpaths, half_bounds, monkeypatch, max_open):
+    """Are points read identically, into an exactly sized array, when files are opened a few at a time?"""
+    whole = simulocloud.pointcloud.PointCloud.from_las(*fpaths, bounds=half_bounds)
+    monkeypatch.setattr(simulocloud.pointcloud, '_MAX_OPEN_FILES', max_open)
+    for bounds in (half_bounds, None):
+        pc = simulocloud.pointcloud.PointCloud.from_las(*fpaths, bounds=bounds)
+        assert pc.arr.flags.c_contiguous and pc.arr.shape[1] == len(pc.attrs['intensity'])
+        assert pc.arr.base is None
+    assert np.array_equal(simulocloud.pointcloud.PointCloud.from_las(
+                              *fpaths, bounds=half_bounds).arr, whole.arr)
+
 def test_PointCloud_can_be_instantiated_empty_from_las(pc_las, fpaths):
     """Does `from_las` allow empty files to be created?."""
     # Create bounds guaranteed to be outside of fpaths
@@ -140,6 +178,99 @@ def test_PointCloud_can_be_instantiated_empty_from_las(pc_las, fpaths):
     bounds = bounds._replace(minx=bounds.maxx+1., maxx=bounds.maxx+100.)
     assert not simulocloud.pointcloud.PointCloud.from_las(*fpaths, bounds=bounds, allow_empty=True)
 
+@pytest.mark.parametrize('prefetch', [0, 3])
+def test_iter_las_yields_in_order(fpaths, prefetch):
+    """Does `iter_las` yield each file's pointcloud in order, however far it reads ahead?"""
+    for fpath, (fpath_, pc) in zip(fpaths, simulocloud.pointcloud.iter_las(fpaths, prefetch=prefetch)):
+        assert fpath_ == fpath
+        assert np.array_equal(pc.arr, simulocloud.pointcloud.PointCloud.from_las(fpath).arr)
+
+def test_iter_las_with_bounds(pc_las, half_bounds, fpaths, monkeypatch):
+    """Does `iter_las` open each file once, skipping those outside `bounds` and cropping the others?"""
+    opened = []
+    File = laspy.file.File
+    def counting_File(fpath, *args, **kwargs):
+        opened.append(fpath)
+        return File(fpath, *args, **kwargs)
+    monkeypatch.setattr(laspy.file, 'File', counting_File)
+    pcs = [pc for _, pc in simulocloud.pointcloud.iter_las(fpaths, bounds=half_bounds,
+                                                           pctype=type(pc_las))]
+    assert sorted(opened) == sorted(fpaths)
+    assert all(isinstance(pc, type(pc_las)) for pc in pcs)
+    assert len(pcs) == len(simulocloud.pointcloud.filter_fpaths(fpaths, half_bounds))
+    assert sum(len(pc) for pc in pcs) == len(pc_las.crop(half_bounds))
+
+def test_iter_las_without_prefetch_reads_inline(fpaths, monkeypatch):
+    """Does `iter_las` read files without a thread pool when not prefetching?"""
+    def no_pool(*args, **kwargs):
+        raise AssertionError('ThreadPool created')
+    monkeypatch.setattr(multiprocessing.pool, 'ThreadPool', no_pool)
+    assert len(list(simulocloud.pointcloud.iter_las(fpaths, prefetch=0))) == len(fpaths)
+
+@pytest.mark.parametrize('prefetch', [0, 2])
+def test_iter_las_empty_crop(pc_las, fpaths, prefetch):
+    """Does `iter_las` raise on files with no points in `bounds` unless `allow_empty`, as `from_las`?"""
+    kwargs = {'bounds': pc_las.bounds, 'where': {'classification': {31}}, 'prefetch': prefetch}
+    with pytest.raises(simulocloud.exceptions.EmptyPointCloud):
+        list(simulocloud.pointcloud.iter_las(fpaths, **kwargs))
+    pcs = [pc for _, pc in simulocloud.pointcloud.iter_las(fpaths, allow_empty=True, **kwargs)]
+    assert pcs and not any(len(pc) for pc in pcs)
+    with pytest.raises(TypeError):
+        list(simulocloud.pointcloud.iter_las(fpaths, allow_empty=True))
+
+def test_PointCloud_from_las_trusting_headers(pc_las, fpaths):
+    """Are bounds of tiles seeded from headers when trusted, and equal to those of the points?"""
+    tile = simulocloud.tiles.Tile.from_las(*fpaths, trust_header=True)
+    assert '_bounds' in tile.__dict__
+    assert tile.bounds == simulocloud.pointcloud.merge_bounds(
+                              simulocloud.pointcloud._get_las_bounds(fpath) for fpath in fpaths)
+    assert tile.bounds == simulocloud.pointcloud.PointCloud(tile.arr).bounds
+    assert len(tile) == len(pc_las)
+
+def test_PointCloud_bounds_follow_inplace_edits(fpaths):
+    """Are bounds of a mutable pointcloud never stale, even when its array is edited in place?"""
+    pc = simulocloud.pointcloud.PointCloud.from_las(*fpaths, trust_header=True)
+    assert '_bounds' not in pc.__dict__
+    pc.arr[0, 0] = pc.bounds.maxx + 10.
+    assert pc.bounds.maxx == pc.arr[0, 0]
+
+def shift_header_maxx(fpath, shift):
+    """Shift the max x of the header of .las file at `fpath` (at byte 179)."""
+    with open(fpath, 'r+b') as f:
+        f.seek(179)
+        maxx, = struct.unpack('<d', f.read(8))
+        f.seek(179)
+        f.write(struct.pack('<d', maxx + shift))
+
+def test_PointCloud_from_las_trusts_loose_headers(tmpdir):
+    """Are loose header bounds, which contain every point, neither flagged nor masked?"""
+    fpath = str(tmpdir.join('loose.las'))
+    shutil.copy(abspath('ALS.las'), fpath)
+    shift_header_maxx(fpath, 5.)
+    header_bounds = simulocloud.pointcloud._get_las_bounds(fpath)
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter('always')
+        tile = simulocloud.tiles.Tile.from_las(fpath, trust_header=True)
+        pc = simulocloud.pointcloud.PointCloud.from_las(
+                 fpath, bounds=np.array(header_bounds) + ([-1]*3 + [1]*3))
+    assert not caught
+    assert tile.bounds == header_bounds
+    assert np.array_equal(pc.arr, tile.arr)
+
+def test_PointCloud_from_las_masks_points_outside_lying_header(tmpdir):
+    """Are points outside `bounds` dropped when a bad header claims they lie inside?"""
+    fpath = str(tmpdir.join('bad.las'))
+    shutil.copy(abspath('ALS.las'), fpath)
+    whole = simulocloud.pointcloud.PointCloud.from_las(fpath)
+    shift_header_maxx(fpath, -5.) # understate max x
+    bounds = np.array(whole.bounds) + ([-1]*3 + [1]*3)
+    bounds[3] = whole.bounds.maxx - 4.
+    with pytest.warns(simulocloud.exceptions.BadHeaderWarning) as caught:
+        pc = simulocloud.pointcloud.PointCloud.from_las(fpath, bounds=bounds)
+    assert [w.message.fpath for w in caught] == [fpath]
+    assert np.array_equal(pc.arr, whole.crop(bounds).arr)
+    assert len(pc.attrs['intensity']) == len(pc)
+
 def test_empty_PointCloud():
     """Is the PointCloud generated from `None` empty?"""
     assert not len(simulocloud.pointcloud.PointCloud(None))
@@ -276,18 +407,100 @@ def test_PointCloud_exports_transparently_to_las(pc_las, tmpdir):
     
     assert np.allclose(pc_las.arr, simulocloud.pointcloud.PointCloud.from_las(fpath).arr)
 
+def test_PointCloud_shares_points_through_file(pc_las, tmpdir):
+    """Can a pointcloud be rebuilt from a (pickled) shared handle without copying its points?"""
+    handle = pc_las.to_shared(str(tmpdir))
+    shared = pkl.loads(pkl.dumps(handle))
+    pc = type(pc_las).from_shared(shared)
+    assert np.array_equal(pc.arr, pc_las.arr)
+    assert attributes_match(pc, pc_las)
+    assert not pc.arr.flags.owndata
+    if type(pc) is not simulocloud.pointcloud.PointCloud: # `Tile`
+        assert not pc.arr.flags.writeable
+    else:
+        pc.arr[0] += 1. # copy-on-write
+        assert np.array_equal(np.fromfile(shared.fpath, count=pc_las.arr.size).reshape(3, -1),
+                              pc_las.arr)
+    shared.remove()
+    assert not tmpdir.listdir()
+
+def test_PointCloud_shares_attributes_through_file(pc_las, tmpdir):
+    """Are in-memory attributes shared through the file, which is removed along with its handle?"""
+    pc_las = pc_las.crop(pc_las.bounds._replace(maxx=pc_las.bounds.minx + 10.))
+    pc_las.attrs['intensity'] # loaded into memory
+    shared = pc_las.to_shared(str(tmpdir))
+    pc = type(pc_las).from_shared(pkl.loads(pkl.dumps(shared)))
+    segment = pc.attrs._segments[0]
+    assert 'intensity' in segment.columns and not segment.columns['intensity'].flags.owndata
+    assert attributes_match(pc, pc_las, 'intensity') and attributes_match(pc, pc_las)
+    empty = type(pc_las)(None, attrs={'intensity': np.empty(0)}).to_shared(str(tmpdir))
+    assert len(type(pc_las).from_shared(empty).attrs['intensity']) == 0
+    del shared, empty
+    gc.collect()
+    assert not tmpdir.listdir()
+
 def test_PointCloud_can_downsample(pc_las):
     """Does downsampling a pointcloud to len n preserve n points?"""
     n = int(len(pc_las)/10) # decimate pointcloud
     pc = pc_las.downsample(n)
     assert len(pc) == n and len(np.intersect1d(pc_las.points, np.unique(pc.points))) == len(pc.points)
 
+@pytest.mark.parametrize('n', (20, 3000))
+def test_downsample_is_reproducible_with_seed(pc_las, n):
+    """Does downsampling with a seed or generator give a reproducible sample of distinct points?"""
+    pc = pc_las.downsample(n, seed=7)
+    assert np.array_equal(pc.arr, pc_las.downsample(n, np.random.RandomState(7)).arr)
+    assert len(pc) == n and len(np.intersect1d(pc_las.points, np.unique(pc.points))) == n
+
+def test_reservoir_sample_is_uniform_over_stream():
+    """Is every chunk of a stream equally represented in reservoir samples?"""
+    arr = np.tile(np.arange(1000, dtype=float), (3, 1))
+    chunks = [simulocloud.pointcloud.PointCloud(arr[:, i:i+100]) for i in xrange(0, 1000, 100)]
+    rs = np.random.RandomState(0)
+    counts = np.zeros(10)
+    for _ in xrange(400):
+        sample = simulocloud.pointcloud.reservoir_sample(chunks, 50, seed=rs)
+        assert len(sample) == 50 and np.all(np.diff(sample.x) > 0)
+        counts += np.bincount((sample.x // 100).astype(int), minlength=10)
+    assert np.all(np.abs(counts / 2000. - 1) < .1)
+
+def test_reservoir_sample_keeps_all_of_short_stream(fpaths):
+    """Does reservoir sampling a stream of fewer than n points keep them all, with attributes?"""
+    pcs = [pc for _, pc in simulocloud.pointcloud.iter_las(fpaths)]
+    sample = simulocloud.pointcloud.reservoir_sample(iter(pcs), 10**6)
+    merged = simulocloud.pointcloud.merge(pcs)
+    assert np.array_equal(sample.arr, merged.arr)
+    assert np.array_equal(sample.attrs['intensity'], merged.attrs['intensity'])
+
 def test_pointclouds_merged_by_function(pc_las, fpaths):
     """Does the merge function preserve the input points?"""
     pcs = [simulocloud.pointcloud.PointCloud.from_las(fpath) for fpath in fpaths]
     merged = simulocloud.pointcloud.merge(pcs)
     assert same_len_and_bounds(merged, pc_las)
 
+def test_group_starts_of_sorted_keys():
+    """Are the starts of runs of equal keys found, across key components and arrays?"""
+    group_starts = simulocloud.pointcloud._group_starts
+    assert np.array_equal(group_starts(np.array([1, 1, 2, 5, 5])), [0, 2, 3])
+    assert np.array_equal(group_starts(np.array([[1, 1, 1], [0, 0, 3]])), [0, 2])
+    assert np.array_equal(group_starts(np.array([0, 0, 1]), np.array([2, 3, 3])), [0, 1, 2])
+    assert not len(group_starts(np.empty(0))) and not len(group_starts(np.empty((3, 0))))
+
+def test_merge_bounds_rejects_no_bounds():
+    """Is an error raised when merging no bounds?"""
+    with pytest.raises(ValueError):
+        simulocloud.pointcloud.merge_bounds([])
+
+def test_deduplicate_removes_exact_and_near_duplicates(pc_las):
+    """Are exact and within-tolerance copies of points removed, keeping the originals?"""
+    unique = pc_las.deduplicate()
+    assert len(unique) <= len(pc_las)
+    assert len(unique.deduplicate()) == len(unique)
+    nudged = type(pc_las)(pc_las.arr + 5e-5)
+    merged = simulocloud.pointcloud.merge([unique, pc_las, nudged], deduplicate=2.5e-4)
+    assert np.array_equal(merged.arr, unique.arr)
+    assert len(simulocloud.pointcloud.merge([unique, nudged], deduplicate=0)) == 2*len(unique)
+
 def test_pointclouds_merged_by_method(pc_las, fpaths):
     """Does the merge method preserve the input points?"""
     pcs = [simulocloud.pointcloud.PointCloud.from_las(fpath) for fpath in fpaths]
@@ -312,3 +525,211 @@ def test_pointcloud_split_along_locs(pc_las, axis):
     for pc, (min_split, max_split) in zip(pcs, splitbounds):
         min_, max_ = simulocloud.pointcloud.axis_bounds(pc, axis)
         assert min_ >= min_split and max_ <= max_split
+
+def test_stratified_sample_is_reproducible_subset(pc_las):
+    """Is a seeded stratified sample a reproducible subset of n points?"""
+    n = int(len(pc_las)/10)
+    pc = pc_las.stratified_sample(n, seed=1)
+    assert len(pc) == n and np.array_equal(pc.arr, pc_las.stratified_sample(n, seed=1).arr)
+    assert len(np.intersect1d(pc_las.points, np.unique(pc.points))) == n
+
+def test_stratified_sample_spreads_points(pc_las):
+    """Does a stratified sample place one point in each occupied cell of a coarse grid?"""
+    pc = pc_las.stratified_sample(16, dims='xy', seed=0)
+    minx, miny, _, maxx, maxy, _ = pc_las.bounds
+    ix = np.minimum((pc.x - minx) / ((maxx - minx)/4.), 3).astype(int)
+    iy = np.minimum((pc.y - miny) / ((maxy - miny)/4.), 3).astype(int)
+    assert len(set(zip(ix, iy))) == 16
+
+@pytest.mark.parametrize('n', [0, -1])
+def test_stratified_sample_of_nothing(pc_las, n):
+    """Is a stratified sample of no points an empty pointcloud, like `downsample`?"""
+    pc = pc_las.stratified_sample(n, seed=0)
+    assert not len(pc) and type(pc) is type(pc_las.downsample(0))
+
+@pytest.mark.parametrize('method, args', [('downsample', (100,)),
+                                          ('stratified_sample', (100,)),
+                                          ('thin_to_density', (.5,))])
+def test_sampling_takes_seed_or_generator(pc_las, method, args):
+    """Do all sampling methods take a `seed`, as an int or a generator, reproducibly?"""
+    sample = lambda seed: getattr(pc_las, method)(*args, seed=seed).arr
+    assert np.array_equal(sample(3), sample(3))
+    assert np.array_equal(sample(np.random.RandomState(3)), sample(np.random.RandomState(3)))
+
+def test_thin_to_density_caps_points_per_cell(pc_las):
+    """Does thinning keep at most the target number of points in each cell?"""
+    pc = pc_las.thin_to_density(2., cell_size=2., seed=0)
+    cells = lambda pc: map(tuple, np.floor(pc.arr[:2].T / 2.).astype(int))
+    before = collections.Counter(cells(pc_las))
+    after = collections.Counter(cells(pc))
+    assert all(after[cell] == min(n, 8) for cell, n in before.iteritems())
+    assert np.array_equal(pc.arr, pc_las.thin_to_density(2., cell_size=2., seed=0).arr)
+    assert len(np.intersect1d(pc_las.points, pc.points)) == len(pc)
+
+def test_thin_to_density_rounds_fractional_caps_at_random(pc_las):
+    """Is the mean number of points kept per cell a fractional target density?"""
+    pc = pc_las.thin_to_density(.3, cell_size=1., seed=3)
+    ncells = len(set(map(tuple, np.floor(pc_las.arr[:2].T).astype(int))))
+    assert 0 < len(pc) < ncells
+    assert abs(len(pc) / float(ncells) - .3) < .05
+
+@pytest.mark.parametrize('chunk_size', (1000, 2**20))
+def test_transform_applies_affine_matrix(pc_las, chunk_size):
+    """Does transforming a pointcloud apply a homogeneous matrix and update its bounds?"""
+    c, s = np.cos(.3), np.sin(.3)
+    matrix = np.array([[c, -s, 0, 10.], [s, c, 0, -5.], [0, 0, 1, 2.], [0, 0, 0, 1]])
+    pc = pc_las.transform(matrix, chunk_size=chunk_size)
+    assert np.allclose(pc.arr, np.dot(matrix[:3, :3], pc_las.arr) + matrix[:3, 3:])
+    assert np.allclose(pc.bounds, type(pc)(pc.arr).bounds)
+    assert type(pc) is type(pc_las) and pc.attrs is pc_las.attrs
+
+def test_transform_maps_cached_bounds(pc_las):
+    """Are cached bounds of tiles mapped directly through axis swaps, flips and scaling?"""
+    tile = simulocloud.tiles.Tile(pc_las.arr)
+    tile.bounds # cache bounds
+    matrix = [[0, 2., 0, 1.], [-1., 0, 0, 0], [0, 0, .5, 0]]
+    transformed = tile.transform(matrix, chunk_size=1000)
+    assert transformed.__dict__['_bounds'] == simulocloud.pointcloud.PointCloud(transformed.arr).bounds
+    assert '_bounds' not in pc_las.transform(matrix).__dict__ or isinstance(pc_las, simulocloud.tiles.Tile)
+
+def test_transform_inplace_only_if_mutable(pc_las):
+    """Is a pointcloud transformed in place, but a tile copied?"""
+    arr = pc_las.arr.copy()
+    pc = pc_las.transform(np.eye(3) * 2., inplace=True)
+    if isinstance(pc_las, simulocloud.tiles.Tile):
+        assert pc is not pc_las and np.array_equal(pc_las.arr, arr)
+        assert not pc.arr.flags.writeable
+    else:
+        assert pc is pc_las
+    assert np.array_equal(pc.arr, arr * 2.)
+
+def test_transform_rejects_projective_matrix(pc_las):
+    """Are matrices other than linear or affine transformations refused?"""
+    for matrix in (np.ones((4, 4)), np.eye(2)):
+        with pytest.raises(ValueError):
+            pc_las.transform(matrix)
+
+def attributes_match(pc, ref, name='gps_time'):
+    """Assess whether attribute `name` of each point in pc matches that in ref."""
+    lookup = dict(zip(map(tuple, ref.arr.T.round(6)), ref.attrs[name]))
+    return all(lookup[point] == value
+               for point, value in zip(map(tuple, pc.arr.T.round(6)), pc.attrs[name]))
+
+def test_PointCloud_reads_attributes_lazily_from_las(fpaths, half_bounds):
+    """Are attributes of points read from .las files loaded upon access only?"""
+    pc = simulocloud.pointcloud.PointCloud.from_las(*fpaths, bounds=half_bounds)
+    assert 'intensity' in pc.attrs and not pc.attrs._segments[0].columns
+    assert len(pc.attrs['intensity']) == len(pc)
+
+def test_lazy_attributes_decode_selected_records_only(fpaths, monkeypatch):
+    """Are only the records of selected points decoded when attributes of a selection are loaded?"""
+    pc = simulocloud.pointcloud.PointCloud.from_las(*fpaths)
+    expected = pc.attrs['intensity']
+    idx = np.arange(0, len(pc), 7)
+    decoded = []
+    get = simulocloud.pointcloud._get_las_record_attribute
+    def get_record_attribute(f, name, key=slice(None)):
+        values = get(f, name, key)
+        decoded.append(len(values))
+        return values
+    monkeypatch.setattr(simulocloud.pointcloud, '_get_las_record_attribute', get_record_attribute)
+    for key in (idx, idx[::-1]):
+        attrs = simulocloud.pointcloud.PointCloud.from_las(*fpaths)._take(key).attrs
+        assert np.array_equal(attrs['intensity'], expected[key])
+    assert sum(decoded) == 2 * len(idx)
+
+def test_concatenating_no_attributes():
+    """Does concatenating no attributes give empty attributes?"""
+    attrs = simulocloud.pointcloud.Attributes.concatenate([])
+    assert len(attrs) == 0 and not attrs.names
+
+def test_attributes_carried_through_operations(pc_las, fpaths, half_bounds):
+    """Do attributes remain aligned with points through cropping, merging, splitting and downsampling?"""
+    pcs = [simulocloud.pointcloud.PointCloud.from_las(fpath) for fpath in fpaths]
+    merged = simulocloud.pointcloud.merge(pcs)
+    cropped = merged.crop(half_bounds)
+    low, high = cropped.split('z', [np.median(cropped.z)])
+    for pc in (merged, cropped, low, high, merged.downsample(100)):
+        assert attributes_match(pc, pc_las)
+
+def test_PointCloud_exports_attributes_to_las(pc_las, tmpdir):
+    """Are attributes preserved in the file output by PointCloud.to_las?"""
+    fpath = tmpdir.join('pc_las.las').strpath
+    pc_las.crop(pc_las.bounds._replace(maxx=pc_las.bounds.minx+10.)).to_las(fpath)
+    pc = simulocloud.pointcloud.PointCloud.from_las(fpath)
+    assert pc.attrs.names == pc_las.attrs.names and attributes_match(pc, pc_las)
+
+def test_PointCloud_to_las_warns_of_unwritable_attributes(pc_las, tmpdir):
+    """Is a warning issued naming attributes which are not .las dimensions, and the rest written?"""
+    fpath = tmpdir.join('extra.las').strpath
+    attrs = {'intensity': np.arange(len(pc_las)) % 1000, 'height': pc_las.z.copy()}
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter('always')
+        simulocloud.pointcloud.PointCloud(pc_las.arr, attrs=attrs).to_las(fpath)
+    assert len(caught) == 1 and "'height'" in str(caught[0].message)
+    pc = simulocloud.pointcloud.PointCloud.from_las(fpath)
+    assert np.array_equal(pc.attrs['intensity'], attrs['intensity'])
+
+def test_attributes_from_columns(pc_arr):
+    """Can attributes be supplied in memory, and are they dropped when merged with a pointcloud lacking them?"""
+    pc = simulocloud.pointcloud.PointCloud(pc_arr.arr, attrs={'intensity': np.arange(len(pc_arr))})
+    assert np.array_equal(pc.crop((0.5, None, None, None, None, None)).attrs['intensity'], np.arange(5, 10))
+    assert not (pc + pc_arr).attrs.names
+
+@pytest.fixture
+def classified_las(pc_las, tmpdir):
+    """Path to .las file of `pc_las` with varied classification and intensity."""
+    n = len(pc_las)
+    attrs = {'classification': np.arange(n) % 4,
+             'intensity': np.arange(n) % 1000}
+    fpath = tmpdir.join('classified.las').strpath
+    simulocloud.pointcloud.PointCloud(pc_las.arr, attrs=attrs).to_las(fpath)
+    return fpath
+
+@pytest.mark.parametrize('where', [{'classification': {2}},
+                                   {'classification': [1, 3], 'intensity': (None, 499)},
+                                   {'intensity': lambda i: i % 7 == 0}])
+def test_PointCloud_from_las_where(classified_las, where):
+    """Are only points satisfying `where` predicates read from .las?"""
+    full = simulocloud.pointcloud.PointCloud.from_las(classified_las)
+    pc = simulocloud.pointcloud.PointCloud.from_las(classified_las, where=where)
+    mask = np.ones(len(full), dtype=bool)
+    for name, condition in where.items():
+        values = full.attrs[name]
+        if callable(condition):
+            mask &= condition(values)
+        elif isinstance(condition, tuple):
+            mask &= values <= condition[1]
+        else:
+            mask &= np.in1d(values, list(condition))
+    assert np.array_equal(pc.arr, full.arr[:, mask])
+    assert np.array_equal(pc.attrs['intensity'], full.attrs['intensity'][mask])
+
+def test_PointCloud_from_las_rejects_unknown_attributes(classified_las):
+    """Is an error raised for predicates on attributes which do not exist?"""
+    with pytest.raises(ValueError):
+        simulocloud.pointcloud.PointCloud.from_las(classified_las, where={'colour': {1}})
+
+def test_sort_spatial_preserves_points(pc_las):
+    """Does spatial sorting reorder, but not change, the points?"""
+    pc = pc_las.sort_spatial()
+    assert type(pc) is type(pc_las)
+    assert np.array_equal(np.sort(pc.points), np.sort(pc_las.points))
+    assert attributes_match(pc, pc_las)
+
+def test_sorted_cropping_matches_cropping(pc_las, half_bounds):
+    """Does cropping a spatially sorted pointcloud keep the same points as unsorted?"""
+    pc = pc_las.sort_spatial()
+    minx, miny, minz, maxx, maxy, maxz = pc_las.bounds
+    for bounds in (half_bounds,
+                   half_bounds._replace(minz=(minz+maxz)/2.),
+                   (minx+3., miny+2., None, minx+4., miny+25., None)):
+        cropped = pc.crop(bounds)
+        expected = pc_las.crop(bounds)
+        assert np.array_equal(np.sort(cropped.points), np.sort(expected.points))
+        assert len(pc.crop(bounds)._morton.keys) == len(cropped)
+
+def test_PointCloud_from_las_can_sort_spatially(pc_las):
+    """Are points read from .las in Morton order when `sort_spatial` is specified?"""
+    pc = type(pc_las).from_las(abspath('ALS.las'), sort_spatial=True)
+    assert np.all(np.diff(pc._morton.keys.astype(float)) >= 0) and len(pc) == len(pc_las)
@@ -0,0 +1,51 @@
+import pytest
+import numpy as np
+import simulocloud.raster
+import simulocloud.tiles
+import simulocloud.exceptions
+
+@pytest.fixture
+def grid(pc_las):
+    """A `TilesGrid` of `pc_las` with irregularly spaced tiles."""
+    splitlocs = simulocloud.tiles.fractional_splitlocs(pc_las.bounds, nx=3, ny=4, nz=2)
+    edges = simulocloud.tiles.make_edges(pc_las.bounds, splitlocs, inclusive=True)
+    tiles = simulocloud.tiles.grid_pointclouds([pc_las], edges)
+    return simulocloud.tiles.TilesGrid(tiles, edges)
+
+def test_rasterize_matches_cropping(pc_las):
+    """Are raster statistics the same as those of points cropped to each cell?"""
+    raster, xedges, yedges = simulocloud.raster.rasterize(
+        pc_las, cellsize=5., stats=('count', 'min', 'max', 'mean', 'p25'))
+    assert raster['count'].sum() == len(pc_las)
+    for ix, iy in np.ndindex(*raster.shape):
+        bounds = (xedges[ix], yedges[iy], None, xedges[ix+1], yedges[iy+1], None)
+        z = pc_las.crop(bounds, allow_empty=True).z
+        if len(z):
+            assert raster['count'][ix, iy] == len(z)
+            assert np.allclose([raster[stat][ix, iy] for stat in ('min', 'max', 'mean', 'p25')],
+                               [z.min(), z.max(), z.mean(), np.percentile(z, 25)])
+        else:
+            assert np.isnan(raster['max'][ix, iy])
+
+def test_rasterize_grid_has_no_seams(pc_las, grid):
+    """Is rasterising the tiles of a grid the same as rasterising the whole pointcloud?"""
+    stats = ('count', 'max', 'p50')
+    whole, xedges, yedges = simulocloud.raster.rasterize(pc_las, cellsize=2.3, stats=stats)
+    tiled, _, _ = simulocloud.raster.rasterize(grid, cellsize=2.3, stats=stats)
+    for stat in stats:
+        assert np.allclose(whole[stat], tiled[stat], equal_nan=True)
+
+def test_rasterize_grid_uses_grid_edges(grid):
+    """Does rasterising a grid default to one cell per column of tiles?"""
+    raster, xedges, yedges = simulocloud.raster.rasterize(grid, stats=('count',))
+    assert np.array_equal(raster['count'], grid.summaries['count'].sum(axis=2))
+
+def test_rasterize_empty_pointclouds(pc_las):
+    """Are empty pointclouds rasterised onto given edges, and rejected without them?"""
+    empty = type(pc_las)(None)
+    raster, xedges, yedges = simulocloud.raster.rasterize(
+        [empty, empty], edges=([0., 1., 2.], [0., 1.]), stats=('count', 'max'))
+    assert raster.shape == (2, 1) and not raster['count'].any()
+    assert np.isnan(raster['max']).all()
+    with pytest.raises(simulocloud.exceptions.EmptyPointCloud):
+        simulocloud.raster.rasterize([empty, empty], cellsize=5.)
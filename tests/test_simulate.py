@@ -0,0 +1,64 @@
+import pytest
+import numpy as np
+import simulocloud.simulate
+import simulocloud.pointcloud
+import simulocloud.voxels
+
+@pytest.fixture
+def pattern():
+    """A scan pattern with a 1 m footprint."""
+    return simulocloud.simulate.ScanPattern(scan_angle=20., pulse_rate=2000.,
+                                            scan_rate=10., footprint=1.)
+
+@pytest.fixture
+def layers():
+    """A 60*80 m scene of opaque ground beneath a half-transparent canopy layer."""
+    occupancy = np.zeros((60, 80, 5))
+    occupancy[:, :, 0] = 1.
+    occupancy[:, :, 3] = .5
+    return simulocloud.simulate.Scene.from_occupancy(occupancy, (0., 0., 0.), 1.)
+
+@pytest.fixture
+def trajectory():
+    """A flight line at 50 m over the middle of `layers`, turning halfway."""
+    return np.array([[30., 30., 32.], [5., 40., 75.], [50., 50., 50.]])
+
+def test_simulate_records_first_and_last_returns(layers, trajectory, pattern):
+    """Does each pulse return first from the canopy and last from the ground beneath?"""
+    pc = simulocloud.simulate.simulate(layers, trajectory, pattern, speed=10.)
+    assert len(pc)
+    return_num, num_returns = pc.attrs['return_num'], pc.attrs['num_returns']
+    first, last = return_num == 1, return_num == num_returns
+    assert np.all(num_returns >= 2)
+    assert np.all((pc.z[first] >= 3.) & (pc.z[first] <= 4.))
+    assert np.all((pc.z[last] >= 0.) & (pc.z[last] <= 1.))
+    assert np.all(pc.attrs['intensity'][first] == 32768)
+    assert np.all(np.diff(pc.attrs['gps_time']) >= 0)
+    # Within the swath beneath the trajectory
+    assert np.all(np.abs(pc.x[first] - 31.) <= 1. + 47. * np.tan(np.radians(20.)))
+
+def test_simulate_stops_at_max_returns(layers, trajectory, pattern):
+    """Are no more than `max_returns` returns recorded per pulse?"""
+    pc = simulocloud.simulate.simulate(layers, trajectory, pattern, speed=10., max_returns=1)
+    assert np.all(pc.attrs['return_num'] == 1)
+    assert np.all((pc.z >= 3.) & (pc.z <= 4.))
+
+def test_simulate_pointcloud_scene_in_parallel(pc_las, pattern):
+    """Does scanning a pointcloud give the same returns serially and in parallel?"""
+    b = pc_las.bounds
+    trajectory = np.array([[b.minx, b.maxx], [(b.miny + b.maxy)/2]*2, [b.maxz + 100.]*2])
+    kwargs = dict(speed=20., batchsize=500)
+    serial = simulocloud.simulate.simulate(pc_las, trajectory, pattern, **kwargs)
+    parallel = simulocloud.simulate.simulate(pc_las, trajectory, pattern, workers=2, **kwargs)
+    assert len(serial) and np.array_equal(serial.arr, parallel.arr)
+    scene_bounds = simulocloud.simulate.Scene.from_pointcloud(pc_las, pattern.footprint).bounds
+    scene_bounds = np.array(scene_bounds) + ([0.]*3 + [1e-6]*3) # returns on exit faces
+    assert not simulocloud.pointcloud.points_out_of_bounds(serial, scene_bounds).any()
+
+def test_scene_from_voxels_uses_hit_fraction():
+    """Is the occupancy of a scene made from voxel counts the fraction of rays hitting each voxel?"""
+    voxels = simulocloud.voxels.DenseVoxels(1., np.array([2, 0, 0]),
+                                            np.array([[[3, 0, 1]]]), np.array([[[1, 5, 0]]]))
+    scene = simulocloud.simulate.Scene.from_voxels(voxels)
+    assert np.allclose(scene.occupancy, [.75, 1.])
+    assert np.allclose(scene.centroids, [[2.5, .5, .5], [2.5, .5, 2.5]])
@@ -1,7 +1,11 @@
 import pytest
 import test_pointcloud
 import numpy as np
+import multiprocessing
 import itertools
+import pickle
+import gc
+import os
 import simulocloud.pointcloud
 import simulocloud.tiles
 import simulocloud.exceptions
@@ -44,6 +48,11 @@ def grid(tiles, edges):
     """Construct a `TilesGrid` instance."""
     return simulocloud.tiles.TilesGrid(tiles, edges, validate=False)
 
+@pytest.fixture
+def fpaths():
+    """List of filepaths of tiled .las test data."""
+    return test_pointcloud.get_fpaths('ALS_tiles')
+
 @pytest.fixture
 def half_indices(grid):
     """Tuple of ints specifying the halfway (rounding down) indices of grid tiles."""
@@ -57,6 +66,12 @@ def test_tile_array_is_immutable(tile):
     with pytest.raises(ValueError):
         tile.arr[0,0] = 1.
 
+def test_tile_array_is_immutable_once_unpickled(tile):
+    """Does a `Tile` remain immutable after a pickle round-trip?"""
+    tile = pickle.loads(pickle.dumps(tile, pickle.HIGHEST_PROTOCOL))
+    with pytest.raises(ValueError):
+        tile.arr[0,0] = 1.
+
 def test_tile_array_cannot_be_changed(tile):
     """Is an error raised when trying to set to the coordinates of a `Tile`?"""
     arr2 = tile.arr*2
@@ -216,3 +231,288 @@ def test_bounds_can_align_onto_base(bounds):
         minold, maxold = simulocloud.pointcloud.axis_bounds(bounds, axis)
         minnew, maxnew = simulocloud.pointcloud.axis_bounds(aligned_bounds, axis)
         assert minold <= minnew and maxold >= maxnew
+
+def test_grid_pointclouds_can_deduplicate_overlaps(pc_las, pcs, edges):
+    """Are points shared by overlapping pointclouds gridded only once when deduplicating?"""
+    tiles = simulocloud.tiles.grid_pointclouds(pcs, edges, deduplicate=0)
+    expected = simulocloud.tiles.grid_pointclouds([pc_las.deduplicate(0)], edges)
+    assert [len(tile) for tile in tiles.flat] == [len(tile) for tile in expected.flat]
+    assert all(isinstance(tile, simulocloud.tiles.Tile) for tile in tiles.flat)
+
+@pytest.mark.parametrize('memory', (1000, 2**28))
+def test_TilesGrid_from_files_matches_gridding(fpaths, tmpdir, memory):
+    """Does streaming files into a grid (spilling to disk or not) match gridding a merged pointcloud?"""
+    pc = simulocloud.pointcloud.PointCloud.from_las(*fpaths)
+    edges = simulocloud.tiles.make_edges(pc.bounds, simulocloud.tiles.fractional_splitlocs(
+                                             pc.bounds, nx=3, ny=2, nz=2), inclusive=True)
+    grid = simulocloud.tiles.TilesGrid.from_files(fpaths, edges, directory=str(tmpdir),
+                                                  memory=memory, chunksize=1000)
+    expected = simulocloud.tiles.grid_pointclouds([pc], edges)
+    for tile, expected_tile in zip(grid.tiles.flat, expected.flat):
+        assert isinstance(tile, simulocloud.tiles.Tile)
+        assert np.array_equal(tile.arr, expected_tile.arr)
+    assert np.array_equal(grid.summaries, simulocloud.tiles.summarise_tiles(expected))
+
+def test_TilesGrid_from_files_with_spacings(fpaths, tmpdir):
+    """Does a regular grid built from files with `spacings` contain every point?"""
+    grid = simulocloud.tiles.TilesGrid.from_files(fpaths, spacings={'x': 7., 'y': 9.},
+                                                  directory=str(tmpdir))
+    assert grid.validate()
+    assert grid.summaries['count'].sum() == len(simulocloud.pointcloud.PointCloud.from_las(*fpaths))
+
+def test_TilesGrid_from_files_maps_tiles_lazily(fpaths, tmpdir):
+    """Are tile files only memory-mapped once their points are accessed?"""
+    grid = simulocloud.tiles.TilesGrid.from_files(fpaths, spacings={'x': 7., 'y': 9.},
+                                                  directory=str(tmpdir))
+    assert len(tmpdir.listdir()) and not any('_arr' in tile.__dict__ for tile in grid.tiles.flat)
+    counts = [len(tile) for tile in grid.tiles.flat]
+    assert not any('_arr' in tile.__dict__ for tile in grid.tiles.flat)
+    tile = max(grid.tiles.flat, key=len)
+    assert tile.arr.shape == (3, len(tile)) and not tile.arr.flags.writeable
+    assert np.array_equal(counts, grid.summaries['count'].ravel())
+
+def test_TilesGrid_from_files_removes_temporary_directory(fpaths):
+    """Is the temporary directory of a grid removed, once no tiles read from it remain?"""
+    grid = simulocloud.tiles.TilesGrid.from_files(fpaths, spacings={'x': 7., 'y': 9.})
+    tile = max(grid.tiles.flat, key=len)
+    directory = tile._source.directory.path
+    subset = grid[:1]
+    del grid
+    gc.collect()
+    assert os.path.isdir(directory)
+    assert len(subset.tiles.flat[0].arr.T) == len(subset.tiles.flat[0])
+    assert len(pickle.loads(pickle.dumps(tile)).arr.T) == len(tile)
+    del subset, tile
+    gc.collect()
+    assert not os.path.exists(directory)
+
+def test_TilesGrid_select_finds_tiles_within_bounds(grid, bounds):
+    """Does `select` return exactly the tiles whose edges intersect bounds?"""
+    half = bounds._replace(minx=(bounds.minx + bounds.maxx)/2, maxy=(bounds.miny + bounds.maxy)/3)
+    subset = grid.select(half)
+    assert 0 < len(subset) < len(grid)
+    assert subset.bounds.minx <= half.minx and subset.bounds.maxy >= half.maxy
+    selected = set(id(tile) for tile in subset.tiles.flat)
+    for tile in grid.tiles.flat:
+        if id(tile) not in selected:
+            assert not len(tile.crop(half, allow_empty=True))
+    assert not grid.select(half._replace(minx=bounds.maxx+1, maxx=bounds.maxx+2))
+
+def test_TilesGrid_crop_merges_points_within_bounds(grid, bounds):
+    """Is cropping a grid the same as cropping each tile and merging?"""
+    half = bounds._replace(minx=(bounds.minx + bounds.maxx)/2, maxy=(bounds.miny + bounds.maxy)/3)
+    cropped = grid.crop(half)
+    expected = simulocloud.pointcloud.merge([tile.crop(half, allow_empty=True)
+                                             for tile in grid.tiles.flat])
+    assert type(cropped) is simulocloud.pointcloud.PointCloud
+    assert np.array_equal(cropped.arr[:, np.lexsort(cropped.arr)],
+                          expected.arr[:, np.lexsort(expected.arr)])
+    outside = half._replace(minx=bounds.maxx+1, maxx=bounds.maxx+2)
+    with pytest.raises(simulocloud.exceptions.EmptyPointCloud):
+        grid.crop(outside)
+    assert not grid.crop(outside, allow_empty=True)
+
+def test_TilesGrid_locate_agrees_with_gridding(grid, pc_las):
+    """Does `locate` place every point in the tile it was gridded to, and -1 outside the grid?"""
+    for index in np.ndindex(*grid.shape):
+        tile = grid.tiles[index]
+        located = grid.locate(tile)
+        assert all(np.all(i == index_) for i, index_ in zip(located, index))
+    outside = np.array([[grid.bounds.minx - 1, grid.bounds.minx],
+                        [grid.bounds.miny, grid.bounds.maxy],
+                        [grid.bounds.minz, grid.bounds.minz]])
+    ix, iy, iz = grid.locate(outside)
+    assert list(ix) == [-1, -1] and list(iz) == [-1, -1]
+    assert (ix[0], iy[0], iz[0]) == (-1, -1, -1)
+
+@pytest.mark.parametrize('deduplicate', (None, 0))
+def test_TilesGrid_insert_matches_rebuilding(pc_las, deduplicate):
+    """Is inserting new pointclouds into a grid the same as gridding them all together?"""
+    old, new = pc_las.split('x', [(pc_las.bounds.minx + pc_las.bounds.maxx)/2])
+    edges = simulocloud.tiles.make_edges(pc_las.bounds, simulocloud.tiles.fractional_splitlocs(
+                                             pc_las.bounds, nx=4, ny=2, nz=2), inclusive=True)
+    grid = simulocloud.tiles.TilesGrid(simulocloud.tiles.grid_pointclouds([old], edges), edges,
+                                       validate=False)
+    grid.summaries
+    grid.insert([new, new], deduplicate=deduplicate)
+    pcs = [old, new] if deduplicate is not None else [old, new, new]
+    expected = simulocloud.tiles.grid_pointclouds(pcs, edges, deduplicate=deduplicate)
+    for tile, expected_tile in zip(grid.tiles.flat, expected.flat):
+        assert isinstance(tile, simulocloud.tiles.Tile)
+        assert np.array_equal(tile.arr, expected_tile.arr)
+    assert np.array_equal(grid.summaries, simulocloud.tiles.summarise_tiles(expected))
+
+def test_TilesGrid_insert_appends_lazily(pc_las):
+    """Are inserted points held apart from each tile's, and only merged once accessed?"""
+    old, new = pc_las.split('x', [(pc_las.bounds.minx + pc_las.bounds.maxx)/2])
+    edges = simulocloud.tiles.make_edges(pc_las.bounds, simulocloud.tiles.fractional_splitlocs(
+                                             pc_las.bounds, nx=4, ny=2, nz=2), inclusive=True)
+    grid = simulocloud.tiles.TilesGrid(simulocloud.tiles.grid_pointclouds([old], edges), edges,
+                                       validate=False)
+    before = grid.tiles.copy()
+    for batch in new.split('y', [(new.bounds.miny + new.bounds.maxy)/2]):
+        grid.insert([batch])
+    expected = simulocloud.tiles.grid_pointclouds([old, new], edges)
+    for tile, old_tile, expected_tile in zip(grid.tiles.flat, before.flat, expected.flat):
+        if tile is old_tile:
+            continue
+        assert '_arr' not in tile.__dict__
+        assert len(tile) == len(expected_tile) and tile.bounds == expected_tile.bounds
+        assert np.array_equal(tile.arr[:, np.lexsort(tile.arr)],
+                              expected_tile.arr[:, np.lexsort(expected_tile.arr)])
+        assert not tile.arr.flags.writeable and tile._source is None
+    assert any(tile is not old_tile for tile, old_tile in zip(grid.tiles.flat, before.flat))
+
+@pytest.mark.parametrize('summarised', ('parent', 'subset'))
+def test_TilesGrid_insert_into_subset_updates_parent(pc_las, summarised):
+    """Does inserting into a subset update the summaries its parent shares, however they were cached?"""
+    old, new = pc_las.split('x', [(pc_las.bounds.minx + pc_las.bounds.maxx)/2])
+    edges = simulocloud.tiles.make_edges(pc_las.bounds, simulocloud.tiles.fractional_splitlocs(
+                                             pc_las.bounds, nx=4, ny=2, nz=2), inclusive=True)
+    grid = simulocloud.tiles.TilesGrid(simulocloud.tiles.grid_pointclouds([old], edges), edges,
+                                       validate=False)
+    if summarised == 'parent':
+        grid.summaries
+    subset = grid[2:, :, :]
+    subset.summaries
+    subset.insert([new])
+    expected = simulocloud.tiles.summarise_tiles(simulocloud.tiles.grid_pointclouds([old, new], edges))
+    assert np.array_equal(subset.summaries, expected[2:])
+    assert np.array_equal(grid.summaries, expected)
+    assert np.array_equal(grid.summaries, simulocloud.tiles.summarise_tiles(grid.tiles))
+
+def test_TilesGrid_coarsen_merges_blocks(grid):
+    """Does coarsening merge blocks of tiles, with edges and summaries of the merged tiles?"""
+    grid.summaries
+    coarse = grid.coarsen({'x': 2, 'y': 3})
+    assert coarse.shape == (3, 2, 1)
+    assert coarse.bounds == grid.bounds
+    assert np.array_equal(coarse.edges, simulocloud.tiles.make_edges(
+        grid.bounds, {'x': grid.edges[2:-1:2,0,0,0], 'y': grid.edges[0,3:-1:3,0,1]}))
+    assert np.array_equal(coarse.tiles[1,0,0].arr,
+                          simulocloud.pointcloud.merge(list(grid.tiles[2:4,0:3].flat)).arr)
+    assert np.array_equal(coarse.summaries, simulocloud.tiles.summarise_tiles(coarse.tiles))
+
+def test_TilesGrid_refine_is_serial_by_default(grid, monkeypatch):
+    """Does refining split tiles in process unless workers are requested?"""
+    def no_pool(*args, **kwargs):
+        raise AssertionError('process pool started')
+    monkeypatch.setattr(multiprocessing, 'Pool', no_pool)
+    assert grid.refine({'x': 2}).shape == (12, 5, 1)
+
+@pytest.mark.parametrize('workers', (1, 2))
+def test_TilesGrid_refine_splits_tiles(grid, workers):
+    """Does refining split every tile onto evenly subdivided edges?"""
+    fine = grid.refine({'x': 2, 'z': 3}, workers=workers)
+    assert fine.shape == (12, 5, 3)
+    assert fine.bounds == grid.bounds
+    assert np.allclose(fine.edges[::2,:,::3], grid.edges)
+    expected = simulocloud.tiles.grid_pointclouds(list(grid.tiles.flat), fine.edges)
+    for tile, expected_tile in zip(fine.tiles.flat, expected.flat):
+        assert isinstance(tile, simulocloud.tiles.Tile)
+        assert np.array_equal(tile.arr, expected_tile.arr)
+    assert np.array_equal(fine.coarsen({'x': 2, 'z': 3}).summaries, grid.summaries)
+
+def test_TilesGrid_refine_keeps_points_on_upper_edges(pc_las):
+    """Are points on the outer upper edges of a grid kept, and summarised, when refined?"""
+    b = pc_las.bounds
+    edges = simulocloud.tiles.make_edges(b, {'x': [(b.minx + b.maxx)/2]})
+    tiles = np.empty((2, 1, 1), dtype=object)
+    mid = edges[1, 0, 0, 0]
+    tiles[0, 0, 0] = pc_las.crop((None, None, None, mid, None, None))
+    tiles[1, 0, 0] = pc_las.crop((mid, None, None, None, None, None))
+    grid = simulocloud.tiles.TilesGrid(tiles, edges)
+    assert sum(len(tile) for tile in tiles.flat) == len(pc_las)
+    fine = grid.refine({'x': 2, 'y': 2, 'z': 3})
+    assert sum(len(tile) for tile in fine.tiles.flat) == len(pc_las)
+    assert fine.validate()
+    assert np.array_equal(fine.summaries, simulocloud.tiles.summarise_tiles(fine.tiles))
+
+@pytest.mark.parametrize('workers', (1, 2))
+def test_TilesGrid_thin_to_density_has_no_seams(pc_las, workers):
+    """Does thinning the tiles of a grid keep the points thinning them merged keeps?"""
+    edges = simulocloud.tiles.make_regular_edges(pc_las.bounds, spacings={'x': 7.3, 'y': 5.1})
+    grid = simulocloud.tiles.TilesGrid(simulocloud.tiles.grid_pointclouds([pc_las], edges),
+                                       edges, validate=False)
+    thinned = grid.thin_to_density(1.5, cell_size=2., seed=4, workers=workers)
+    merged = simulocloud.pointcloud.merge(list(thinned.tiles.flat))
+    expected = simulocloud.pointcloud.merge(list(grid.tiles.flat)).thin_to_density(
+                   1.5, cell_size=2., seed=4)
+    assert np.array_equal(np.sort(merged.points), np.sort(expected.points))
+    assert np.array_equal(thinned.edges, grid.edges)
+
+@pytest.mark.parametrize('density', (1.25, .3))
+def test_TilesGrid_thin_to_density_caps_duplicates(pc_las, density):
+    """Does thinning tiles of duplicated points keep no more than the cap, as merged thinning does?"""
+    pc = simulocloud.pointcloud.merge([pc_las, pc_las])
+    edges = simulocloud.tiles.make_regular_edges(pc.bounds, spacings={'x': 7.3, 'y': 5.1})
+    grid = simulocloud.tiles.TilesGrid(simulocloud.tiles.grid_pointclouds([pc], edges),
+                                       edges, validate=False)
+    thinned = simulocloud.pointcloud.merge(list(
+                  grid.thin_to_density(density, cell_size=2., seed=4, workers=1).tiles.flat))
+    expected = simulocloud.pointcloud.merge(list(grid.tiles.flat)).thin_to_density(
+                   density, cell_size=2., seed=4)
+    counts = np.unique(np.floor(thinned.arr[:2] / 2.), axis=1, return_counts=True)[1]
+    assert counts.max() <= np.ceil(density * 4)
+    assert np.array_equal(thinned.arr, expected.arr)
+
+def _len(tile):
+    """Return the number of points in `tile` (picklable, for `TilesGrid.map`)."""
+    return len(tile)
+
+def _is_writeable(tile):
+    """Return whether `tile`'s array can be written to (for `TilesGrid.map`)."""
+    return tile.arr.flags.writeable
+
+@pytest.mark.parametrize('workers', (1, 2))
+def test_TilesGrid_map_gathers_results_onto_grid(grid, workers):
+    """Does `TilesGrid.map` return the result for each tile at the tile's index?"""
+    results = grid.map(_len, workers=workers)
+    assert results.shape == grid.shape
+    for index in np.ndindex(*grid.shape):
+        assert results[index] == len(grid.tiles[index])
+
+def test_TilesGrid_map_passes_immutable_tiles(grid):
+    """Are tiles passed to worker processes still immutable?"""
+    assert not grid.map(_is_writeable, workers=2).any()
+
+def _sum(tile):
+    """Return the sum of `tile`'s coordinates (for `TilesGrid.map`)."""
+    return tile.arr.sum(axis=1)
+
+def test_TilesGrid_map_reuses_tile_files(fpaths, tmpdir, monkeypatch):
+    """Are tiles already stored in files mapped by workers without being written again?"""
+    grid = simulocloud.tiles.TilesGrid.from_files(fpaths, spacings={'x': 7., 'y': 9.},
+                                                  directory=str(tmpdir))
+    expected = grid.map(_sum, workers=1)
+    def no_write(*args, **kwargs):
+        raise AssertionError('tile written to shared file')
+    monkeypatch.setattr(simulocloud.tiles.Tile, 'to_shared', no_write)
+    results = grid.map(_sum, workers=2)
+    for index in np.ndindex(*grid.shape):
+        if len(grid.tiles[index]):
+            assert np.allclose(results[index], expected[index])
+
+def test_TilesGrid_summaries_describe_tiles(grid):
+    """Do the cached tile summaries record the size and bounds of each tile?"""
+    summaries = grid.summaries
+    assert summaries.shape == grid.shape
+    for index in np.ndindex(*grid.shape):
+        tile = grid.tiles[index]
+        assert summaries['count'][index] == len(tile)
+        if len(tile):
+            assert tuple(summaries[index])[1:] == tuple(tile.bounds)
+
+def test_TilesGrid_subset_summaries(grid, half_indices):
+    """Are cached summaries subset alongside tiles?"""
+    ix, iy, iz = half_indices
+    grid.summaries
+    subset = grid[ix:, iy:, iz:]
+    assert np.array_equal(subset.summaries['count'],
+                          simulocloud.tiles.summarise_tiles(subset.tiles)['count'])
+
+def test_grid_pointclouds_carries_attributes(pc_las, pcs, edges):
+    """Do attributes remain aligned with points when gridded to tiles?"""
+    tiles = simulocloud.tiles.grid_pointclouds(pcs, edges)
+    for tile in tiles.flat:
+        assert test_pointcloud.attributes_match(tile, pc_las)
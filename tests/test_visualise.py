@@ -2,8 +2,14 @@
 Unit testing for the pointcloud.visualise module
 """
 import pytest
+import gc
+import weakref
+import numpy as np
 import simulocloud.visualise
+import simulocloud.pointcloud
+import simulocloud.tiles
 import simulocloud.exceptions
+import test_pointcloud
 
 def test_scatter_rejects_wrong_axes_type(pc_las):
     """Is an error raised when axes argument to scatter is not str?."""
@@ -14,3 +20,95 @@ def test_scatter_rejects_wrong_axes_length(pc_las):
     """Is an error raised when axes argument to scatter is not str?."""
     with pytest.raises(simulocloud.exceptions.WrongNDims):
         simulocloud.visualise.scatter((pc_las,), 'x')
+
+def test_raster_render_rejects_3D(pc_las):
+    """Is an error raised when attempting to raster render in 3D?"""
+    with pytest.raises(simulocloud.exceptions.WrongNDims):
+        simulocloud.visualise.scatter((pc_las,), 'xyz', render='density')
+
+def test_density_image_counts_every_point(pc_las):
+    """Does the density raster image account for every point?"""
+    image, extent = simulocloud.visualise._raster_image([pc_las, pc_las], 'xy', 50, 'density')
+    assert image.shape == (50, 50) and image.sum() == 2*len(pc_las)
+
+def test_height_image_has_max_z(pc_las):
+    """Is the maximum of the height raster image the highest point?"""
+    image, extent = simulocloud.visualise._raster_image([pc_las], 'xy', (40, 30), 'height')
+    assert image.shape == (40, 30) and np.nanmax(image) == pc_las.bounds.maxz
+
+def test_height_image_cells_hold_max_z(pc_las):
+    """Does each cell of the height raster image hold the maximum z of its points?"""
+    image, (left, right, bottom, top) = simulocloud.visualise._raster_image([pc_las], 'xy', 8, 'height')
+    ix = np.minimum(((pc_las.x - left) / ((right - left) / 8.)).astype(int), 7)
+    iy = np.minimum(((pc_las.y - bottom) / ((top - bottom) / 8.)).astype(int), 7)
+    for i, j in np.ndindex(8, 8):
+        z = pc_las.z[(ix == i) & (iy == j)]
+        assert image[i, j] == z.max() if len(z) else np.isnan(image[i, j])
+
+def test_raster_image_extent_follows_bounds(pc_las):
+    """Does a raster image span the bounds requested, rather than those of the points?"""
+    bounds = pc_las.bounds._replace(minx=pc_las.bounds.minx - 10., maxy=None)
+    image, extent = simulocloud.visualise._raster_image([pc_las.crop(bounds)], 'xy', 10, 'density', bounds)
+    assert extent == (bounds.minx, bounds.maxx, pc_las.bounds.miny, pc_las.bounds.maxy)
+    assert image.sum() == len(pc_las.crop(bounds)) and not image[0].any()
+
+@pytest.mark.parametrize('render', ('density', 'height'))
+def test_raster_image_of_nothing(pc_las, render):
+    """Is a raster image of no points empty, rather than an error?"""
+    image, extent = simulocloud.visualise._raster_image([type(pc_las)(None)], 'xy', 5, render)
+    assert image.shape == (5, 5) and extent is None
+    assert not image.any() if render == 'density' else np.isnan(image).all()
+    bounds = pc_las.bounds._replace(minx=pc_las.bounds.maxx + 1., maxx=pc_las.bounds.maxx + 2.)
+    fig = simulocloud.visualise.scatter([pc_las], 'xy', bounds=bounds, render=render)
+    assert tuple(fig.axes[0].images[0].get_extent()) == (bounds.minx, bounds.maxx, bounds.miny, bounds.maxy)
+
+def test_preview_samples_are_memoised(pc_las):
+    """Are repeated preview samples of the same pointcloud area reused?"""
+    bounds = pc_las.bounds._replace(maxx=pc_las.bounds.minx + 10.)
+    sample, = simulocloud.visualise._crop_and_sample_pointclouds([pc_las], bounds, 100)
+    again, = simulocloud.visualise._crop_and_sample_pointclouds([pc_las], bounds, 100)
+    assert len(sample) == 100 and sample is again
+
+
+def test_rendered_pointcloud_can_be_collected(pc_las):
+    """Can a pointcloud be garbage collected once it has been previewed?"""
+    for bounds in (None, pc_las.bounds):
+        pc = type(pc_las)(pc_las.arr)
+        for n in xrange(100, 100 + 2*simulocloud.visualise._MAX_SAMPLES):
+            simulocloud.visualise._sample_pointcloud(pc, bounds, n)
+        simulocloud.visualise._sample_pointcloud(pc, None, len(pc))
+        assert len(simulocloud.visualise._SAMPLES[pc][1]) <= simulocloud.visualise._MAX_SAMPLES
+        ref = weakref.ref(pc)
+        del pc
+        gc.collect()
+        assert ref() is None
+
+def test_grid_overview_rejects_unknown_stat(pc_las):
+    """Is an error raised when an unknown statistic is requested for a grid overview?"""
+    grid = simulocloud.tiles.TilesGrid.from_splitlocs([pc_las], {'x': [pc_las.bounds.minx + 5.]})
+    with pytest.raises(ValueError):
+        simulocloud.visualise.grid_overview(grid, stat='colour')
+
+@pytest.mark.parametrize('stat', ('count', 'density', 'height'))
+def test_grid_overview_renders_from_summaries(tmpdir, monkeypatch, stat):
+    """Is a grid of streamed tiles rendered, shading exactly its non-empty columns, without reading points?"""
+    fpaths = test_pointcloud.get_fpaths('ALS_tiles')
+    streamed = simulocloud.tiles.TilesGrid.from_files(fpaths, spacings={'x': 4., 'y': 6.},
+                                                     directory=str(tmpdir))
+    grid = simulocloud.tiles.TilesGrid(streamed.tiles, streamed.edges, validate=False)
+    def read_points(pc):
+        raise AssertionError('points were read')
+    monkeypatch.setattr(simulocloud.pointcloud.PointCloud, 'bounds', property(read_points))
+    fig = simulocloud.visualise.grid_overview(grid, stat=stat, figsize=(4, 3))
+    fig.canvas.draw()
+    width, height = fig.canvas.get_width_height()
+    image = np.frombuffer(fig.canvas.tostring_rgb(), dtype=np.uint8).reshape(height, width, 3)
+    assert image.shape == (3*fig.dpi, 4*fig.dpi, 3)
+    assert len(np.unique(image.reshape(-1, 3), axis=0)) > 2
+    
+    values = fig.axes[0].collections[0].get_array()
+    nonempty = streamed.summaries['count'].sum(axis=2).T.ravel() > 0
+    assert len(values) == grid.shape[0] * grid.shape[1]
+    masked = np.ma.getmaskarray(values)
+    assert not masked[nonempty].any() and masked[~nonempty].all()
+    assert np.all(values[nonempty] > 0)
@@ -0,0 +1,100 @@
+import pytest
+import numpy as np
+import simulocloud.pointcloud
+import simulocloud.tiles
+import simulocloud.voxels
+
+@pytest.fixture
+def grid(pc_las):
+    """A `TilesGrid` of `pc_las` with irregularly spaced tiles."""
+    splitlocs = simulocloud.tiles.fractional_splitlocs(pc_las.bounds, nx=3, ny=2, nz=2)
+    edges = simulocloud.tiles.make_edges(pc_las.bounds, splitlocs, inclusive=True)
+    tiles = simulocloud.tiles.grid_pointclouds([pc_las], edges)
+    return simulocloud.tiles.TilesGrid(tiles, edges)
+
+@pytest.fixture
+def sensor(pc_las):
+    """A sensor position above the centre of `pc_las`."""
+    b = pc_las.bounds
+    return np.array([(b.minx + b.maxx) / 2., (b.miny + b.maxy) / 2., b.maxz + 50.])
+
+def test_voxelise_counts_hits(pc_las):
+    """Is the number of hits of each voxel the number of points falling in it?"""
+    voxels = simulocloud.voxels.voxelise(pc_las, 2.)
+    assert voxels.hits.sum() == len(pc_las)
+    assert not voxels.passes.any()
+    ijk = np.floor(pc_las.arr.T / 2.).astype(np.int64)
+    for i in np.random.RandomState(0).randint(len(voxels), size=20):
+        assert voxels.hits[i] == np.all(ijk == voxels.ijk[i], axis=1).sum()
+
+def test_voxelise_counts_passes_of_vertical_ray():
+    """Does a vertical ray pass through each voxel above the one it hits?"""
+    pc = simulocloud.pointcloud.PointCloud([[.5], [.5], [.5]])
+    voxels = simulocloud.voxels.voxelise(pc, 1., sensors=[.5, .5, 10.],
+                                         bounds=(0, 0, 0, .9, .9, 4.5))
+    assert np.array_equal(voxels.ijk, [[0, 0, k] for k in range(5)])
+    assert np.array_equal(voxels.hits, [1, 0, 0, 0, 0])
+    assert np.array_equal(voxels.passes, [0, 1, 1, 1, 1])
+
+def test_voxelise_passes_match_sampled_rays():
+    """Are the voxels passed by rays those of closely spaced samples along them?"""
+    rs = np.random.RandomState(1)
+    ends = rs.uniform(0, 10, size=(3, 50))
+    sensors = rs.uniform(-5, 15, size=(3, 50))
+    for ray in xrange(50):
+        pc = simulocloud.pointcloud.PointCloud(ends[:, ray:ray+1])
+        voxels = simulocloud.voxels.voxelise(pc, 1., sensors=sensors[:, ray],
+                                             bounds=(0, 0, 0, 9.99, 9.99, 9.99))
+        t = np.linspace(0, 1, 100000)[:, None]
+        samples = sensors[:, ray] + (ends[:, ray] - sensors[:, ray]) * t
+        ijk = np.floor(samples).astype(np.int64)
+        ijk = ijk[np.all((ijk >= 0) & (ijk < 10), axis=1)]
+        expected = set(map(tuple, ijk)) - set(map(tuple, np.floor(ends[:, ray:ray+1].T).astype(int)))
+        passed = set(map(tuple, voxels.ijk[voxels.passes > 0]))
+        # Samples can miss voxels whose corners rays barely clip
+        assert passed >= expected
+        assert len(passed - expected) <= 2
+
+def test_voxelise_grid_has_no_seams(pc_las, grid, sensor):
+    """Is voxelising the tiles of a grid the same as voxelising the whole pointcloud?"""
+    whole = simulocloud.voxels.voxelise(pc_las, 1.5, sensors=sensor, bounds=grid.bounds)
+    tiled = simulocloud.voxels.voxelise(grid, 1.5, sensors=sensor, workers=2)
+    assert whole.passes.sum() > 0
+    for field in ('ijk', 'hits', 'passes'):
+        assert np.array_equal(getattr(whole, field), getattr(tiled, field))
+
+def test_voxelise_dense_matches_sparse(pc_las, sensor):
+    """Do the dense and sparse backends count the same voxels?"""
+    sparse = simulocloud.voxels.voxelise(pc_las, 1.5, sensors=sensor)
+    dense = simulocloud.voxels.voxelise(pc_las, 1.5, sensors=sensor, dense=True)
+    assert dense.bounds[:3] <= pc_las.bounds[:3]
+    assert dense.bounds[3:] >= pc_las.bounds[3:]
+    for field in ('ijk', 'hits', 'passes'):
+        assert np.array_equal(getattr(sparse, field), getattr(dense.to_sparse(), field))
+    assert np.array_equal(sparse.to_dense().to_sparse().hits, sparse.hits)
+
+def test_combine_sums_counts(pc_las, sensor):
+    """Are counts of pointclouds combined by summing them voxel by voxel?"""
+    voxels = simulocloud.voxels.voxelise(pc_las, 2., sensors=sensor, dense=True)
+    combined = simulocloud.voxels.combine([voxels, voxels.to_sparse()])
+    assert np.array_equal(combined.hits, 2 * voxels.hits)
+    assert np.array_equal(combined.passes, 2 * voxels.passes)
+    with pytest.raises(ValueError):
+        simulocloud.voxels.combine([voxels, simulocloud.voxels.voxelise(pc_las, 1.)])
+
+def test_voxelise_dense_grid_matches_whole(pc_las, grid, sensor):
+    """Is densely voxelising a grid the same as densely voxelising the whole pointcloud?"""
+    whole = pc_las.voxelise(1.5, sensors=sensor, bounds=grid.bounds, dense=True)
+    tiled = grid.voxelise(1.5, sensors=sensor, dense=True, workers=2)
+    assert np.array_equal(whole.origin, tiled.origin)
+    for field in ('hits', 'passes'):
+        assert np.array_equal(getattr(whole, field), getattr(tiled, field))
+    assert tiled.hits.sum() == len(pc_las)
+
+def test_voxelise_methods_match_function(pc_las, grid, sensor):
+    """Do the `voxelise` methods of pointclouds and grids delegate to `voxelise`?"""
+    for pcs in (pc_las, grid):
+        expected = simulocloud.voxels.voxelise(pcs, 2., sensors=sensor)
+        voxels = pcs.voxelise(2., sensors=sensor)
+        for field in ('ijk', 'hits', 'passes'):
+            assert np.array_equal(getattr(expected, field), getattr(voxels, field))